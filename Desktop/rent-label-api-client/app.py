@@ -12,6 +12,13 @@ from excel_utils import append_row_to_excel
 
 app = FastAPI()  # ✅ FastAPI 객체 먼저 생성
 
+# ✅ 요청마다 새 연결을 만들지 않도록 앱 전체에서 클라이언트 하나를 재사용
+http_client = httpx.AsyncClient(timeout=15.0)
+
+@app.on_event("shutdown")
+async def close_http_client():
+    await http_client.aclose()
+
 @app.post("/upload-test-image/")
 async def upload_test_image(image: UploadFile = File(...)):
     temp_path = f"temp_{image.filename}"
@@ -71,8 +78,7 @@ async def callback(request: Request):
         "Content-Type": "application/x-www-form-urlencoded"
     }
 
-    async with httpx.AsyncClient() as client:
-        token_response = await client.post(token_url, data=data, headers=headers)
+    token_response = await http_client.post(token_url, data=data, headers=headers)
 
     if token_response.status_code != 200:
         return JSONResponse(status_code=500, content={"error": "Token exchange failed", "details": token_response.text})
@@ -95,24 +101,23 @@ async def write_excel(data: ExcelInput):
     base_url = f"https://graph.microsoft.com/v1.0/me/drive/root:{encoded_path}:/workbook/worksheets('{WORKSHEET_NAME}')"
 
     try:
-        async with httpx.AsyncClient(timeout=15.0) as client:
-            # 현재 데이터가 입력된 마지막 행 확인
-            used_range_url = f"{base_url}/usedRange"
-            used_res = await client.get(used_range_url, headers=headers)
-            used_data = used_res.json()
+        # 현재 데이터가 입력된 마지막 행 확인
+        used_range_url = f"{base_url}/usedRange"
+        used_res = await http_client.get(used_range_url, headers=headers)
+        used_data = used_res.json()
 
-            if "address" not in used_data:
-                return {"error": "Unable to detect used range", "details": used_data}
+        if "address" not in used_data:
+            return {"error": "Unable to detect used range", "details": used_data}
 
-            last_row = int(used_data["address"].split("!")[1].split(":")[1][1:])
-            next_row = last_row + 1
-            target_range = f"A{next_row}:G{next_row}"
+        last_row = int(used_data["address"].split("!")[1].split(":")[1][1:])
+        next_row = last_row + 1
+        target_range = f"A{next_row}:G{next_row}"
 
-            range_url = f"{base_url}/range(address='{target_range}')"
-            response = await client.patch(range_url, headers=headers, json={"values": [data.row]})
+        range_url = f"{base_url}/range(address='{target_range}')"
+        response = await http_client.patch(range_url, headers=headers, json={"values": [data.row]})
 
-            if response.status_code != 200:
-                return {"error": "Failed to write to Excel", "details": response.text}
+        if response.status_code != 200:
+            return {"error": "Failed to write to Excel", "details": response.text}
 
     except Exception as e:
         return {"error": "Internal Server Error", "details": str(e)}
@@ -1,27 +1,88 @@
+import time
+_IMPORT_STARTED = time.perf_counter()  # 기동 시간 보고용 (무거운 import 전에)
+
 import os
-import shutil
+import asyncio
 import hashlib
 import urllib.parse
+import json
 import uuid
+import sqlite3
+from typing import List, Optional
+from contextlib import asynccontextmanager
 
 from dotenv import load_dotenv; load_dotenv()
 
 from fastapi import FastAPI, Request, UploadFile, Form, File
-from fastapi.responses import RedirectResponse, JSONResponse
+from fastapi.responses import RedirectResponse, JSONResponse, StreamingResponse, PlainTextResponse
 from pydantic import BaseModel
 from starlette.middleware.sessions import SessionMiddleware
 
 import httpx
-import requests
-import msal
 
-from ocr_utils import make_final_entry
+from ocr_utils import (
+    extract_shipping_info_timed, segment_labels, build_entry, ocr_config_fingerprint, note_backend, today_str, OCR_MODE,
+    warm_ocr_sample, warmup_image_bytes,
+)
+from cache_utils import ocr_cache, courier_hints
+from upload_utils import (
+    read_upload_image, read_batch_archive, check_image_bytes, UploadRejected, BATCH_MAX_ITEMS,
+    BATCH_MAX_ARCHIVE_BYTES,
+)
+import excel_utils
 from excel_utils import append_row_to_excel
+from graph_utils import get_graph_client, close_graph_client, is_item_not_found
+from row_utils import row_allocator
+from record_utils import record_store
+from append_utils import AppendBuffer, AppendQueueFull
+from pool_utils import ocr_pool, OcrBusy, OcrTimeout, OcrCancelled
+from mirror_utils import WRITE_MODE, workbook_mirror
+from idempotency_utils import idempotency_store, request_key, STATE_DONE, STATE_INFLIGHT
+from job_utils import JobQueue, JobRunner, JobRetry, JobFailed
+import metrics_utils
+from metrics_utils import stage, record_timings, MetricsMiddleware, METRICS_ENABLED
+from auth_utils import CLIENT_ID, TENANT_ID, SCOPES, AUTHORITY, build_msal_app, save_msal_cache, token_manager
+from warmup_utils import startup
 
 # -------------------------------
 # FastAPI & Session
 # -------------------------------
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # ✅ 앱 공용 Graph 클라이언트(커넥션 풀) + OCR 프로세스 풀 생성
+    get_graph_client()
+    ocr_pool.start()
+    if WRITE_MODE == "mirror":
+        # ✅ 미러 모드: 주기적 업로드 시작 (행마다 Graph 호출 없음). 원격 사본 받기는 graph 워밍업 단계에서
+        workbook_mirror.start(get_graph_client, _get_access_token)
+    # ✅ 출고 기록 저장소: 워크북 변경분(cTag 확인)을 주기적으로 반영 → /records 는 Graph 없이 조회
+    record_store.start(get_graph_client, _get_access_token, RECORD_SHEET_KEY)
+    # ✅ 비동기 작업 큐 처리 시작 (재시작 전 남은 작업도 이어서)
+    job_runner.start(workers=job_runner.workers or ocr_pool.workers)
+    # ✅ 기동 워밍업은 백그라운드로 → 서버는 바로 요청을 받고(/__ping), /ready 는 끝나야 200
+    #    OCR 워커 샘플 OCR / 업로드 디코더 / MSAL App + 토큰 → 워크북 item ID·행 cursor (Graph 커넥션 열기)
+    startup.start([
+        [("ocr", _warm_ocr)],
+        [("decode", _warm_decode)],
+        [("auth", _warm_auth), ("graph", _warm_graph)],
+    ])
+    yield
+    await startup.close()
+    # ✅ 처리 중인 작업 마무리 → 버퍼에 남은 행 마저 쓰기 (APPEND_FLUSH_ON_SHUTDOWN) → 그 다음 풀 닫기
+    await job_runner.close()
+    await row_buffer.close()
+    await excel_utils.table_buffer.close()
+    await record_store.close()
+    if WRITE_MODE == "mirror":
+        await workbook_mirror.close()
+    await close_graph_client()
+    ocr_pool.shutdown()
+
+app = FastAPI(lifespan=lifespan)
+
+# ✅ 단계별 시간 → /metrics (Prometheus) + 응답 Server-Timing 헤더 (METRICS_ENABLED=0 이면 안 붙임)
+if METRICS_ENABLED:
+    app.add_middleware(MetricsMiddleware)
 
 app.add_middleware(
     SessionMiddleware,
@@ -35,32 +96,13 @@ app.add_middleware(
 # -------------------------------
 # ENV & Constants
 # -------------------------------
-# ✅ 과거 값 개입 차단: 기본값은 하드코딩하되, 필요 시 환경변수로 덮어쓸 수 있게(운영이 유연해짐)
-CLIENT_ID = os.getenv("CLIENT_ID", "41745db3-a5c5-4e6e-acd7-fc4ce18b1999")
-TENANT_ID = os.getenv("TENANT_ID", "405ba8a3-73ff-4423-8925-d9eda360cfa7")  # GUID 또는 yourtenant.onmicrosoft.com
-CLIENT_SECRET = os.getenv("CLIENT_SECRET")  # 반드시 설정 필요
+# ✅ CLIENT_ID / TENANT_ID / CLIENT_SECRET / SCOPES / AUTHORITY 는 auth_utils (excel_utils와 공유)
 REDIRECT_URI = os.getenv("REDIRECT_URI", "https://rent-label-api-client-docker.onrender.com/callback")
 
-# ✅ OIDC + Graph 권장 스코프 (로그인 식별을 위해 openid/profile/email은 필수로 넣자)
-SCOPES = [
-    "User.Read", "Files.ReadWrite.All", "Sites.ReadWrite.All"
-]
-
-AUTHORITY = f"https://login.microsoftonline.com/{TENANT_ID}"
-
-GRAPH = "https://graph.microsoft.com/v1.0"
-
 # -------------------------------
-# MSAL App 생성
+# MSAL App (프로세스당 하나, 토큰 캐시/discovery 캐시 공유)
 # -------------------------------
-def _build_msal_app():
-    if not CLIENT_SECRET:
-        raise RuntimeError("CLIENT_SECRET env is missing.")
-    return msal.ConfidentialClientApplication(
-        CLIENT_ID,
-        authority=AUTHORITY,
-        client_credential=CLIENT_SECRET,
-    )
+_build_msal_app = build_msal_app
 
 # -------------------------------
 # 로그인 (Azure OAuth2 - MSAL)
@@ -94,28 +136,20 @@ async def callback(request: Request):
     if not code:
         return JSONResponse(status_code=400, content={"error": "Authorization code missing"})
 
-    result = _build_msal_app().acquire_token_by_authorization_code(
+    # MSAL 토큰 교환은 동기 HTTP → 스레드에서. 결과는 공유 토큰 캐시에도 들어간다
+    result = await asyncio.to_thread(
+        _build_msal_app().acquire_token_by_authorization_code,
         code,
         scopes=["User.Read", "Files.ReadWrite.All", "Sites.ReadWrite.All"],
         redirect_uri=REDIRECT_URI,
     )
+    save_msal_cache()
 
     if "access_token" not in result:
         return JSONResponse({"error": "Token acquire failed", "details": result}, status_code=400)
 
-    # refresh_token 파일 저장(있으면)
-    try:
-        with open("refresh_token.txt", "w", encoding="utf-8") as f:
-            f.write(result.get("refresh_token", ""))
-    except Exception:
-        pass
-
-    # ✅ access_token 파일 저장 (우리는 이걸로 Graph 호출)
-    try:
-        with open("access_token.txt", "w", encoding="utf-8") as f:
-            f.write(result.get("access_token", ""))
-    except Exception:
-        pass
+    # ✅ access_token(+만료 시각)은 메모리에, refresh_token/access_token 파일은 바뀔 때만 저장
+    token_manager.set_tokens(result)
 
     # ✅ 세션은 가벼운 사용자 정보만
     claims = result.get("id_token_claims", {}) or {}
@@ -138,7 +172,6 @@ def me(request: Request):
 
 # === 진단용: 런타임 Azure 설정/로그인 URL 확인 (강화) ===
 from hashlib import sha256
-from fastapi.responses import PlainTextResponse
 
 @app.get("/__debug/azure")
 def dbg_azure():
@@ -162,15 +195,17 @@ def login_url():
 
 # ✅ 추가: 토큰으로 실제 테넌트/사용자 확인 (누가/어느 디렉터리인지 1방에 증명)
 @app.get("/whoami")
-def whoami(request: Request):
+async def whoami(request: Request):
     tokens = request.session.get("tokens")
     if not tokens:
         return RedirectResponse("/login")
-    headers = {"Authorization": f"Bearer {tokens['access_token']}"}
     try:
-        me = requests.get(f"{GRAPH}/me", headers=headers).json()
-        org = requests.get(f"{GRAPH}/organization", headers=headers).json()
-        return {"me": me, "organization": org}
+        # /me + /organization 을 $batch 한 번으로
+        results = await get_graph_client().batch(tokens["access_token"], [
+            {"id": "me", "method": "GET", "url": "/me"},
+            {"id": "organization", "method": "GET", "url": "/organization"},
+        ])
+        return {"me": results["me"]["body"], "organization": results["organization"]["body"]}
     except Exception as e:
         return {"error": str(e)}
 
@@ -179,6 +214,12 @@ from uuid import uuid4
 @app.get("/__ping")
 def ping(): return {"ping": str(uuid4())}
 
+@app.get("/ready")
+def ready():
+    """워밍업이 끝났으면 200, 아직이면 503 (+ 기동 시간 보고). /__ping 은 프로세스가 살아 있는지만."""
+    report = startup.report()
+    return JSONResponse(report, status_code=200 if report["ready"] else 503)
+
 @app.get("/")
 def root():
     return {"message": "probe1"}
@@ -199,164 +240,661 @@ async def callback_login_path_slash(request: Request):
 # --- Graph 호출 테스트: refresh_token으로 access_token 갱신 후 /me 조회 ---
 SCOPES_GRAPH = ["User.Read", "Files.ReadWrite.All", "Sites.ReadWrite.All"]
 
-def _get_access_token():
-    try:
-        with open("access_token.txt", "r", encoding="utf-8") as f:
-            t = f.read().strip()
-        return t if t else None
-    except Exception:
-        return None
+async def _get_access_token():
+    # 메모리 토큰 (만료 임박 시 refresh_token으로 한 번만 갱신)
+    return await token_manager.get_token()
 
 @app.get("/graph/me")
-def graph_me():
-    token = _get_access_token()
+async def graph_me():
+    token = await _get_access_token()
     if not token:
         return JSONResponse({"error": "no_access_token"}, status_code=401)
-    headers = {"Authorization": f"Bearer {token}"}
-    r = requests.get(f"{GRAPH}/me", headers=headers)
+    r = await get_graph_client().get("/me", token)
     return JSONResponse({"status": r.status_code, "json": r.json()})
 
 @app.get("/onedrive")
-def onedrive():
-    token = _get_access_token()
+async def onedrive():
+    token = await _get_access_token()
     if not token:
         return JSONResponse({"error": "no_access_token"}, status_code=401)
-    headers = {"Authorization": f"Bearer {token}"}
-    r = requests.get("https://graph.microsoft.com/v1.0/me/drive/root/children", headers=headers)
+    r = await get_graph_client().get("/me/drive/root/children", token)
     return JSONResponse({"status": r.status_code, "json": r.json()})
 
 from fastapi import Body
+from graph_utils import FILE_NAME, SHEET_NAME
 
-FILE_NAME = os.getenv("FILE_NAME", "유축기출고.xlsx")
-SHEET_NAME = os.getenv("WORKSHEET_NAME", "유축기출고")
+# -------------------------------
+# 중복 요청 방지 (Idempotency-Key)
+# -------------------------------
+def _idempotency_key(request, scope, *fallback):
+    """Idempotency-Key 헤더, 없으면 fallback 값들의 해시. 둘 다 없으면 None (중복 확인 안 함)."""
+    header = request.headers.get("idempotency-key")
+    if header:
+        return f"{scope}:key:{header}"
+    if fallback and all(fallback):
+        return f"{scope}:{request_key(*fallback)}"
+    return None
+
+_REPLAYED_HEADERS = {"Idempotent-Replayed": "true"}
+
+async def _dedupe(key):
+    """
+    중복 확인 (Idempotency-Key / 같은 라벨의 송장번호 공통 규칙).
+    처리 중이면 IDEMPOTENCY_WAIT 까지 기다린 뒤 → 저장된 응답 (status, body, True, Idempotent-Replayed 헤더),
+    그래도 처리 중이면 409. 처음 보는 key 면 None (→ 이 요청이 처리하고 finish).
+    """
+    state, stored = await idempotency_store.acquire(key)
+    if state == STATE_DONE:
+        return stored[0], stored[1], True, _REPLAYED_HEADERS
+    if state == STATE_INFLIGHT:
+        return 409, {"error": "request_in_progress"}, False, None
+    return None
+
+async def _run_idempotent(key, handler):
+    """
+    handler() → (status, body, store[, headers]). 같은 key 로 다시 오면 저장된 응답을 그대로 (Idempotent-Replayed 헤더),
+    처리 중이면 끝날 때까지 기다렸다가 그 응답. store=False(일시적 실패)면 저장하지 않아 재시도가 다시 처리한다.
+    """
+    if key is None:
+        status, body, _, *extra = await handler()
+        return JSONResponse(body, status_code=status, headers=extra[0] if extra else None)
+    reply = await _dedupe(key)
+    if reply is not None:
+        status, body, _, headers = reply
+        return JSONResponse(body, status_code=status, headers=headers)
+    status, body, store, extra = 500, None, False, []
+    try:
+        status, body, store, *extra = await handler()
+    finally:
+        await idempotency_store.finish(key, status, body, store)
+    return JSONResponse(body, status_code=status, headers=extra[0] if extra else None)
 
 @app.post("/excel/append")
-def excel_append(
+async def excel_append(
+    request: Request,
     row: list = Body(...)
 ):
     """
     row 예시:
     ["2025-08-12","홍길동","010-1234-5678","서울시 강남구 ...","SM123456","시밀레 S6","송장번호123"]
+    재시도 중복 방지: Idempotency-Key 헤더, 없으면 기기번호 + 송장번호
     """
-    token = _get_access_token()
-    if not token:
-        return JSONResponse({"error": "no_access_token"}, status_code=401)
-    headers = {"Authorization": f"Bearer {token}", "Content-Type": "application/json"}
-
-    # 1) 파일 찾기
-    search = requests.get(
-        f"{GRAPH}/me/drive/root/search(q='{FILE_NAME}')?$top=1",
-        headers=headers
-    ).json()
-    items = search.get("value", [])
-    if not items or items[0]["name"] != FILE_NAME:
-        return JSONResponse({"error": "file_not_found", "details": FILE_NAME}, status_code=404)
-
-    item_id = items[0]["id"]
-
-    # 2) 현재 사용 범위 조회 → 다음 행 계산
-    used = requests.get(
-        f"{GRAPH}/me/drive/items/{item_id}/workbook/worksheets('{SHEET_NAME}')/usedRange",
-        headers=headers
-    ).json()
-    address = used.get("address") or f"{SHEET_NAME}!A1:A1"
-    # address 예: "유축기출고!A1:G12" → 끝행 12 추출
-    try:
-        last_row = int(address.split("!")[1].split(":")[1][1:])
-    except Exception:
-        last_row = 1
-    next_row = last_row + 1
-    target = f"A{next_row}:G{next_row}"  # 열 수는 필요에 맞게 조정
-
-    # 3) 쓰기
-    resp = requests.patch(
-        f"{GRAPH}/me/drive/items/{item_id}/workbook/worksheets('{SHEET_NAME}')/range(address='{target}')",
-        headers=headers,
-        json={"values": [row]},
+    fallback = (row[4], row[6]) if len(row) == ROW_COLUMNS else ()
+    return await _run_idempotent(
+        _idempotency_key(request, "append", *fallback), lambda: _excel_append(row)
     )
-    if resp.status_code != 200:
-        return JSONResponse({"error": "write_failed", "status": resp.status_code, "text": resp.text}, status_code=500)
 
-    return {"status": "ok", "range": target, "written": row}
+async def _excel_append(row):
+    ok, info = await write_row_to_onedrive(row)
+    if not ok:
+        if info["error"] == "invalid_row":
+            return 400, info, True
+        if info["error"] == "queue_full":
+            return 503, info, False
+        if info["error"] == "no_access_token":
+            return 401, info, False
+        if info["error"] == "file_not_found":
+            return 404, {"error": "file_not_found", "details": FILE_NAME}, False
+        return 500, info, False
+
+    return 200, {"status": "ok", "range": info["range"], "written": row}, True
 
 # --- 사진 + OCR + OneDrive 엑셀 쓰기 ---
 @app.post("/process-ocr/")
-async def process_ocr(qr_text: str = Form(...), image: UploadFile = File(...)):
-    temp_path = f"temp_{image.filename}"
-    with open(temp_path, "wb") as f:
-        shutil.copyfileobj(image.file, f)
+async def process_ocr(request: Request, qr_text: str = Form(...), image: UploadFile = File(...)):
+    """
+    재시도 중복 방지: Idempotency-Key 헤더, 없으면
+    - OCR 전: qr_text + 이미지 해시 (같은 사진 재전송 → OCR/Graph 없이 이전 응답)
+    - OCR 후: qr_text + 송장번호 (같은 라벨을 다시 찍어 보낸 경우 → 쓰기 없이 이전 응답)
+    """
+    # 0) 업로드를 메모리에서 바로 읽기 (임시 파일 없음). 크기/픽셀 수는 전체 디코딩 전에 확인
+    try:
+        with stage("upload"):
+            data = await read_upload_image(image)
+    except UploadRejected as e:
+        return JSONResponse({"error": e.code, "text": str(e)}, status_code=e.status)
+
+    header = request.headers.get("idempotency-key")
+    key = _idempotency_key(request, "process-ocr", qr_text, hashlib.sha256(data).hexdigest())
+    return await _run_idempotent(key, lambda: _process_ocr(request, qr_text, data, dedupe_invoice=not header))
+
+async def _process_ocr(request, qr_text, data, dedupe_invoice):
+    # 1) OCR (같은 사진은 캐시 결과 사용)
     try:
-        # 1) OCR 수행
-        result = make_final_entry(qr_text, temp_path)
-
-        # 2) 엑셀에 쓸 배열로 변환 (빈 값 허용)
-        row = [
-            result.get("출고일", ""),
-            result.get("대여자명", ""),
-            result.get("전화번호", ""),
-            result.get("주소", ""),
-            result.get("기기번호", ""),
-            result.get("기종", ""),
-            result.get("송장번호", ""),
-        ]
-
-        # 3) OneDrive에 기록
-        ok, info = write_row_to_onedrive(row)
+        info, timings = await _recognize(data, request)
+    except OcrBusy as e:
+        return 503, {"error": "ocr_busy", "text": str(e)}, False
+    except OcrTimeout as e:
+        return 504, {"error": "ocr_timeout", "text": str(e)}, False
+    except OcrCancelled:
+        return 499, {"error": "client_disconnected"}, False
+    except Exception as e:
+        print("[OCR] 실패:", repr(e))
+        return 500, {"error": "ocr_failed", "text": repr(e)}, False
+    result = build_entry(qr_text, info)
+
+    # 2) 엑셀에 쓸 배열로 변환 (빈 값 허용)
+    row = _entry_to_row(result)
+
+    # 3) 같은 라벨(qr_text + 송장번호)이 이미 처리됐거나 처리 중이면 그 결과
+    invoice_key = f"process-ocr:{request_key(qr_text, result['송장번호'])}" \
+        if dedupe_invoice and result["송장번호"] else None
+    if invoice_key:
+        reply = await _dedupe(invoice_key)
+        if reply is not None:
+            return reply
+
+    # 4) OneDrive에 기록
+    body, store = None, False
+    try:
+        ok, info = await write_row_to_onedrive(row)
         if not ok:
-            return {
+            body = {
                 "status": "ocr_ok_but_write_failed",
                 "data": result,
-                "write_error": info
+                "write_error": info,
+                "timings": timings,
             }
+        else:
+            body, store = {"status": "success", "data": result, "write_info": info, "timings": timings}, True
+    finally:
+        if invoice_key:
+            await idempotency_store.finish(invoice_key, 200, body, store)
+    return 200, body, store
+
+# --- 한 사진에 라벨 여러 장: 라벨 영역 찾기 → 라벨마다 OCR 병렬 → QR 과 순서대로 짝지어 한 번에 쓰기 ---
+@app.post("/process-ocr/multi")
+async def process_ocr_multi(request: Request, qr_text: List[str] = Form(...), image: UploadFile = File(...)):
+    """
+    qr_text: 사진 속 라벨 순서(위 줄 → 아래 줄, 줄 안에서 왼쪽 → 오른쪽)대로 찍은 QR 들.
+    라벨 수와 QR 수가 다르면 앞에서부터 짝지은 만큼만 쓰고, 남은 라벨/QR 은 unpaired 로 돌려준다.
+    """
+    try:
+        with stage("upload"):
+            data = await read_upload_image(image)
+    except UploadRejected as e:
+        return JSONResponse({"error": e.code, "text": str(e)}, status_code=e.status)
 
-        return {"status": "success", "data": result, "write_info": info}
+    # 1) 라벨 영역 찾기 (축소 사본, 워커에서)
+    try:
+        with stage("segment"):
+            boxes = await ocr_pool.run(segment_labels, data, request=request)
+    except OcrBusy as e:
+        return JSONResponse({"error": "ocr_busy", "text": str(e)}, status_code=503)
+    except OcrTimeout as e:
+        return JSONResponse({"error": "ocr_timeout", "text": str(e)}, status_code=504)
+    except OcrCancelled:
+        return JSONResponse({"error": "client_disconnected"}, status_code=499)
+    except Exception as e:
+        print("[OCR] 라벨 찾기 실패:", repr(e))
+        return JSONResponse({"error": "ocr_failed", "text": repr(e)}, status_code=500)
+
+    # 2) 라벨마다 OCR (워커 수만큼 동시에)
+    gate = asyncio.Semaphore(ocr_pool.workers)
+    device = _device_key(request)
+
+    async def recognize(box):
+        async with gate:
+            return await _recognize(data, request, device=device, crop=box)
+
+    results = await asyncio.gather(*[recognize(box) for box in boxes], return_exceptions=True)
+    if any(isinstance(r, OcrCancelled) for r in results):
+        return JSONResponse({"error": "client_disconnected"}, status_code=499)
+
+    labels = []
+    for index, (box, result) in enumerate(zip(boxes, results)):
+        label = {"index": index, "box": box, "qr_text": qr_text[index] if index < len(qr_text) else None}
+        if isinstance(result, OcrBusy):
+            label.update(status="error", error="ocr_busy", text=str(result))
+        elif isinstance(result, OcrTimeout):
+            label.update(status="error", error="ocr_timeout", text=str(result))
+        elif isinstance(result, BaseException):
+            label.update(status="error", error="ocr_failed", text=repr(result))
+        elif label["qr_text"] is None:
+            label.update(status="unpaired", data=result[0], timings=result[1])
+        else:
+            label.update(status="ocr_ok", data=build_entry(label["qr_text"], result[0]), timings=result[1])
+        labels.append(label)
+
+    # 3) 짝지어진 라벨만 순서대로 → 연속 행 한 번에
+    ready = [label for label in labels if label["status"] == "ocr_ok"]
+    try:
+        writes = await _flush_rows([_entry_to_row(label["data"]) for label in ready]) if ready else []
+    except httpx.HTTPError as e:
+        writes = [(False, {"error": "write_failed", "text": repr(e)})] * len(ready)
+    for label, (ok, info) in zip(ready, writes):
+        label["status"] = "written" if ok else "ocr_ok_but_write_failed"
+        label["write_info" if ok else "write_error"] = info
+
+    written = sum(1 for label in labels if label["status"] == "written")
+    return {
+        "status": "success" if written == len(labels) == len(qr_text) else "partial",
+        "detected": len(boxes),
+        "written": written,
+        "labels": labels,
+        "unpaired_qr": qr_text[len(boxes):],
+    }
+
+# --- 비동기 처리: 업로드만 받고 바로 job ID 반환 → OCR/쓰기는 백그라운드 (실패 시 재시도) ---
+@app.post("/process-ocr/async", status_code=202)
+async def process_ocr_async(qr_text: str = Form(...), image: UploadFile = File(...)):
+    try:
+        data = await read_upload_image(image)
+    except UploadRejected as e:
+        return JSONResponse({"error": e.code, "text": str(e)}, status_code=e.status)
+    # 이미지까지 디스크(SQLite)에 남긴 뒤 응답 → 프로세스가 죽어도 작업은 남는다
+    job_id = await asyncio.to_thread(job_queue.submit, qr_text, data)
+    job_runner.notify()
+    return {"job_id": job_id, "status": "queued", "status_url": f"/jobs/{job_id}"}
+
+@app.get("/jobs/{job_id}")
+def job_status(job_id: str):
+    job = job_queue.get(job_id)
+    if job is None:
+        return JSONResponse({"error": "job_not_found"}, status_code=404)
+    return job
+
+@app.get("/jobs")
+def job_stats():
+    return job_queue.stats()
+
+async def _job_ocr(qr_text, data):
+    try:
+        info, _ = await _recognize(data)
+    except (OcrBusy, OcrTimeout) as e:
+        raise JobRetry(f"{type(e).__name__}: {e}")
+    return build_entry(qr_text, info)
+
+async def _job_write(entry):
+    ok, info = await write_row_to_onedrive(_entry_to_row(entry))
+    if ok:
+        return info
+    if info["error"] == "invalid_row":
+        raise JobFailed(info)
+    # no_access_token / file_not_found / queue_full / write_failed → Graph가 돌아오면 다시
+    raise JobRetry(info)
+
+job_queue = JobQueue()
+job_runner = JobRunner(job_queue, _job_ocr, _job_write)
+
+# --- 여러 장 한 번에: OCR 병렬 → 끝나는 대로 NDJSON 스트리밍 → 성공한 행만 한 번에 쓰기 ---
+@app.post("/process-ocr/batch")
+async def process_ocr_batch(
+    request: Request,
+    qr_text: Optional[List[str]] = Form(None),
+    images: Optional[List[UploadFile]] = File(None),
+    archive: Optional[UploadFile] = File(None),
+):
+    """
+    입력 둘 중 하나:
+    - multipart: qr_text, images 를 같은 순서로 여러 번
+    - archive: zip (manifest.json = [{"qr_text": ..., "file": ...}, ...])
+    응답(application/x-ndjson): 항목마다 한 줄(index 포함, 끝난 순서) → 마지막 줄에 쓰기 결과.
+    항목 하나가 실패해도 나머지는 계속 처리한다.
+    """
+    try:
+        items = await _read_batch_items(qr_text, images, archive)
+    except UploadRejected as e:
+        return JSONResponse({"error": e.code, "text": str(e)}, status_code=e.status)
+    return StreamingResponse(_run_batch(items, _device_key(request)), media_type="application/x-ndjson")
+
+async def _read_batch_items(qr_texts, images, archive):
+    """→ [(qr_text, 이미지 bytes 또는 UploadRejected)]"""
+    if archive is not None:
+        if archive.size is not None and archive.size > BATCH_MAX_ARCHIVE_BYTES:
+            raise UploadRejected("upload_too_large", f"{archive.size} bytes > {BATCH_MAX_ARCHIVE_BYTES}", status=413)
+        data = await archive.read(BATCH_MAX_ARCHIVE_BYTES + 1)
+        if len(data) > BATCH_MAX_ARCHIVE_BYTES:
+            raise UploadRejected("upload_too_large", f"> {BATCH_MAX_ARCHIVE_BYTES} bytes", status=413)
+        # zip 해제 + 헤더 검사는 CPU 작업 → 스레드에서
+        return await asyncio.to_thread(read_batch_archive, data)
+
+    qr_texts, images = qr_texts or [], images or []
+    if not images:
+        raise UploadRejected("no_images", "images or archive required")
+    if len(qr_texts) != len(images):
+        raise UploadRejected("count_mismatch", f"{len(qr_texts)} qr_text vs {len(images)} images")
+    if len(images) > BATCH_MAX_ITEMS:
+        raise UploadRejected("too_many_items", f"{len(images)} > {BATCH_MAX_ITEMS}", status=413)
+    items = []
+    for text, upload in zip(qr_texts, images):
+        try:
+            items.append((text, await read_upload_image(upload)))
+        except UploadRejected as e:
+            items.append((text, e))
+    return items
+
+async def _run_batch(items, device=None):
+    def line(obj):
+        return json.dumps(obj, ensure_ascii=False) + "\n"
+
+    # 풀 대기열(OCR_QUEUE_MAX)을 한 요청이 다 차지하지 않게 워커 수만큼만 동시에
+    gate = asyncio.Semaphore(ocr_pool.workers)
+
+    async def recognize(index, text, data):
+        async with gate:
+            try:
+                info, timings = await _recognize(data, device=device)
+                entry = build_entry(text, info)
+            except OcrBusy as e:
+                return index, {"error": "ocr_busy", "text": str(e)}, None
+            except OcrTimeout as e:
+                return index, {"error": "ocr_timeout", "text": str(e)}, None
+            except Exception as e:
+                return index, {"error": "ocr_failed", "text": repr(e)}, None
+        return index, None, (entry, timings)
+
+    entries = {}
+    tasks = []
+    for index, (text, data) in enumerate(items):
+        if isinstance(data, UploadRejected):
+            yield line({"index": index, "status": "error", "error": data.code, "text": str(data)})
+            continue
+        tasks.append(asyncio.ensure_future(recognize(index, text, data)))
+
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            index, error, ok = await next_done
+            if error:
+                yield line({"index": index, "status": "error", **error})
+                continue
+            entries[index], timings = ok
+            yield line({"index": index, "status": "ocr_ok", "data": entries[index], "timings": timings})
     finally:
-        if os.path.exists(temp_path):
-            os.remove(temp_path)
+        # 클라이언트가 끊어 스트림이 닫히면 남은 OCR은 취소
+        for t in tasks:
+            t.cancel()
 
-# === OneDrive에 한 줄 쓰는 헬퍼 ===
-def write_row_to_onedrive(row):
-    token = _get_access_token()
-    if not token:
-        return False, {"error": "no_access_token"}
-
-    headers = {"Authorization": f"Bearer {token}", "Content-Type": "application/json"}
-    FILE_NAME = os.getenv("FILE_NAME", "유축기출고.xlsx")
-    SHEET_NAME = os.getenv("WORKSHEET_NAME", "유축기출고")
-
-    # 1) 파일 찾기
-    search = requests.get(
-        f"{GRAPH}/me/drive/root/search(q='{FILE_NAME}')?$top=1", headers=headers
-    ).json()
-    items = search.get("value", [])
-    if not items or items[0]["name"] != FILE_NAME:
-        return False, {"error": "file_not_found", "file": FILE_NAME}
-    item_id = items[0]["id"]
-
-    # 2) 사용범위 조회 → 다음 행 계산
-    used = requests.get(
-        f"{GRAPH}/me/drive/items/{item_id}/workbook/worksheets('{SHEET_NAME}')/usedRange",
-        headers=headers,
-    ).json()
-    address = used.get("address") or f"{SHEET_NAME}!A1:A1"
+    # 성공한 행만 입력 순서대로 → 연속 행 예약 + range PATCH 한 번
+    order = sorted(entries)
     try:
-        last_row = int(address.split("!")[1].split(":")[1][1:])
-    except Exception:
-        last_row = 1
-    next_row = last_row + 1
-    target = f"A{next_row}:G{next_row}"
-
-    # 3) 쓰기
-    resp = requests.patch(
-        f"{GRAPH}/me/drive/items/{item_id}/workbook/worksheets('{SHEET_NAME}')/range(address='{target}')",
-        headers=headers,
-        json={"values": [row]},
-    )
-    if resp.status_code != 200:
-        return False, {"error": "write_failed", "status": resp.status_code, "text": resp.text}
-    return True, {"range": target}
+        results = await _flush_rows([_entry_to_row(entries[i]) for i in order]) if order else []
+    except httpx.HTTPError as e:
+        # 회로 차단(GraphCircuitOpen) 등 → 마지막 줄은 항상 보낸다
+        results = [(False, {"error": "write_failed", "text": repr(e)})] * len(order)
+    writes = [{"index": i, "ok": ok, **info} for i, (ok, info) in zip(order, results)]
+    yield line({
+        "status": "done",
+        "total": len(items),
+        "ocr_ok": len(order),
+        "written": sum(1 for w in writes if w["ok"]),
+        "writes": writes,
+    })
+
+def _device_key(request):
+    """촬영 기기 구분: X-Device-Id 헤더, 없으면 접속 주소."""
+    if request is None:
+        return None
+    return request.headers.get("x-device-id") or (request.client.host if request.client else None)
 
+async def _recognize(data, request=None, device=None, crop=None):
+    """
+    이미지 bytes → (송장 정보, 단계별 시간). 같은 사진(+같은 OCR 설정)은 캐시에서 바로.
+    device: 촬영 기기 키 (OCR_MODE=template 에서 그 기기가 직전에 찍은 택배사부터 시도)
+    crop: 여러 라벨 사진에서 이 라벨 영역 (정규화 좌표)
+    """
+    content_hash = hashlib.sha256(data).hexdigest()
+    crop_key = f"|crop={crop}" if crop else ""
+    cache_key = ocr_cache.make_key(content_hash, ocr_config_fingerprint() + crop_key)
+    info = await ocr_cache.aget(cache_key)
+    if info is not None:
+        info["출고일"] = today_str()
+        return info, {"cache": "hit"}
+
+    device = device or _device_key(request)
+    courier = courier_hints.get(device) if OCR_MODE == "template" else None
+    # OCR 수행 (프로세스 풀 → 이벤트 루프는 다른 요청 계속 처리)
+    with stage("ocr"):  # 풀 대기 + 워커 안의 decode~tesseract 전체
+        info, timings = await ocr_pool.run(extract_shipping_info_timed, data, courier, crop, request=request)
+    record_timings(timings)
+    if OCR_MODE == "template":
+        courier_hints.put(device, timings.get("courier"))
+    # 결과는 실제로 쓴 엔진 기준 키로 (워커가 pytesseract 로 전환했으면 조회 키도 따라감)
+    backend = timings.pop("ocr_backend", None)
+    note_backend(backend)
+    await ocr_cache.aput(ocr_cache.make_key(content_hash, ocr_config_fingerprint(backend) + crop_key), info)
+    timings["cache"] = "miss"
+    return info, timings
+
+def _entry_to_row(result):
+    return [
+        result.get("출고일", ""),
+        result.get("대여자명", ""),
+        result.get("전화번호", ""),
+        result.get("주소", ""),
+        result.get("기기번호", ""),
+        result.get("기종", ""),
+        result.get("송장번호", ""),
+    ]
 
+# === OneDrive에 한 줄 쓰는 헬퍼 ===
+ROW_COLUMNS = 7  # A~G
 
+async def write_row_to_onedrive(row):
+    """
+    행을 버퍼에 넣고, 같이 모인 행들과 함께 한 번의 range PATCH로 기록된 뒤 자기 행 주소를 받는다.
+    반환: (ok, info)  예) (True, {"range": "A13:G13"})
+    """
+    if len(row) != ROW_COLUMNS:
+        return False, {"error": "invalid_row", "columns": len(row), "expected": ROW_COLUMNS}
+    try:
+        with stage("write"):  # 버퍼 대기 + flush 전체
+            return await row_buffer.append(row)
+    except AppendQueueFull as e:
+        return False, {"error": "queue_full", "text": str(e)}
+
+async def _flush_rows_to_onedrive(rows):
+    """버퍼가 모은 행들을 연속 행으로 예약해 A{n}:G{n+k-1} 한 번에 쓴다. 행마다 (ok, info)."""
+    with stage("token"):
+        token = await _get_access_token()
+    if not token:
+        return [(False, {"error": "no_access_token"})] * len(rows)
+
+    graph = get_graph_client()
+
+    # item ID가 캐시에 있으면 search 없이, 행 cursor가 있으면 usedRange 없이 바로 쓰기.
+    # 둘 중 하나라도 없으면 search → usedRange 를 $batch 한 번으로 가져온다.
+    # 캐시된 ID가 404/itemNotFound면 무효화 후 한 번만 다시 찾는다.
+    for _ in range(2):
+        # 1) 연속 행 예약 (모든 워커 공유 장부)
+        item_id = graph.cached_item_id()
+        sheet_key = f"{item_id}/{SHEET_NAME}"
+        # (BEGIN IMMEDIATE 트랜잭션 → 다른 워커가 잡고 있으면 기다리므로 이벤트 루프 밖에서)
+        first_row = await asyncio.to_thread(row_allocator.reserve, sheet_key, len(rows)) if item_id else None
+
+        # 2) cursor가 없거나 충돌 후면 item ID / usedRange 로 재동기화
+        if first_row is None:
+            item_id, last_row = await graph.discover_workbook(token, item_id)
+            if not item_id:
+                return [(False, {"error": "file_not_found", "file": FILE_NAME})] * len(rows)
+            if last_row is None:
+                if graph.cached_item_id() is None:
+                    # 캐시된 item ID가 무효였음 → 한 번 더 찾기
+                    continue
+                # 파일은 있는데 usedRange 조회 실패 → file_not_found 와 구분
+                return [(False, {"error": "used_range_failed", "file": FILE_NAME})] * len(rows)
+            sheet_key = f"{item_id}/{SHEET_NAME}"
+            await asyncio.to_thread(row_allocator.sync, sheet_key, last_row)
+            first_row = await asyncio.to_thread(row_allocator.reserve, sheet_key, len(rows))
+        last_row = first_row + len(rows) - 1
+        target = f"A{first_row}:G{last_row}"
+
+        # 3) 쓰기 (모은 행 전체를 한 번에)
+        try:
+            with stage("patch"):
+                resp = await graph.patch_range(token, item_id, target, rows)
+        except httpx.HTTPError as e:
+            # 타임아웃 등으로 결과를 모르면 다음 예약 전에 usedRange로 다시 맞춘다 (예약은 남김)
+            await asyncio.to_thread(row_allocator.mark_conflict, sheet_key)
+            return [(False, {"error": "write_failed", "text": repr(e)})] * len(rows)
+        if is_item_not_found(resp):
+            graph.invalidate_item_id()
+            continue
+        if resp.status_code == 401:
+            token_manager.invalidate()
+        if resp.status_code != 200:
+            # 오류 응답 → 이 행들은 안 쓰였으므로 예약 해제 (재동기화 때 그 자리부터 다시)
+            await asyncio.to_thread(row_allocator.mark_conflict, sheet_key, first_row)
+            error = {"error": "write_failed", "status": resp.status_code, "text": resp.text}
+            return [(False, error)] * len(rows)
+        return [(True, {"range": f"A{n}:G{n}"}) for n in range(first_row, last_row + 1)]
+
+    return [(False, {"error": "file_not_found", "file": FILE_NAME})] * len(rows)
+
+async def _flush_rows(rows):
+    """
+    WRITE_MODE=mirror 면 로컬 xlsx 사본에 (업로드는 workbook_mirror 가 모아서), 아니면 range PATCH.
+    쓰인 행은 출고 기록 저장소에도 바로 남긴다 (/records 조회용).
+    """
+    if WRITE_MODE == "mirror":
+        with stage("mirror"):
+            results = await asyncio.to_thread(workbook_mirror.append_rows, rows)
+    else:
+        results = await _flush_rows_to_onedrive(rows)
+    written = [(int(info["range"].split(":")[1][1:]), row) for row, (ok, info) in zip(rows, results) if ok]
+    if written:
+        try:
+            await asyncio.to_thread(record_store.record_rows, RECORD_SHEET_KEY, written)
+        except sqlite3.Error as e:
+            # 조회용 사본일 뿐 → 쓰기 결과는 그대로 (다음 워크북 동기화 때 채워짐)
+            print("[Records] 기록 저장 실패:", repr(e))
+    return results
+
+row_buffer = AppendBuffer(_flush_rows)
+
+async def _warm_workbook(token):
+    item_id, last_row = await get_graph_client().warm_workbook(token)
+    if item_id and last_row is not None:
+        next_row = await asyncio.to_thread(row_allocator.sync, f"{item_id}/{SHEET_NAME}", last_row)
+        print(f"[OneDrive] 행 cursor 워밍업 → {SHEET_NAME}: 다음 행 {next_row}")
+    return item_id, last_row
 
+# -------------------------------
+# 기동 워밍업 (warmup_utils.startup 단계들)
+# -------------------------------
+async def _warm_ocr():
+    # 워커 수만큼 동시에 → 워커 프로세스가 모두 뜨고 각자 PIL/pytesseract import + 언어 모델 로드
+    seconds = await asyncio.gather(*(ocr_pool.run(warm_ocr_sample) for _ in range(ocr_pool.workers)))
+    return {"workers": len(seconds), "max_s": max(seconds)}
+
+async def _warm_decode():
+    # 앱 프로세스 쪽 업로드 검사(PIL 헤더 디코딩)도 첫 요청 전에
+    width, height = await asyncio.to_thread(check_image_bytes, warmup_image_bytes())
+    return {"size": f"{width}x{height}"}
+
+async def _warm_auth():
+    # msal import + App 생성(authority discovery, 캐시 파일 로드) → 토큰 (만료 임박이면 갱신)
+    await asyncio.to_thread(build_msal_app)
+    return {"token": bool(await _get_access_token())}
+
+async def _warm_graph():
+    token = await _get_access_token()
+    if not token:
+        raise RuntimeError("no_access_token (/login 필요)")
+    if WRITE_MODE == "mirror":
+        # 미러 모드: 원격과 맞춘 적 없는 사본이면 원격 파일을 받아 둔다 (빈 디스크로 뜬 컨테이너)
+        #  → 끝날 때까지 /ready 503. 이미 맞춘 사본이면 파일 메타데이터만 (커넥션 열기)
+        graph = get_graph_client()
+        await workbook_mirror.bootstrap(graph, token)
+        r = await graph.get_drive_item(token)
+        return {"status": r.status_code, "pending_rows": await asyncio.to_thread(workbook_mirror.pending_rows)}
+    # ✅ 워크북 item ID + 다음 행 cursor 미리 준비 → 첫 쓰기부터 search/usedRange 생략
+    item_id, last_row = await _warm_workbook(token)
+    if not item_id:
+        raise RuntimeError("workbook_not_found")
+    return {"item_id": item_id, "last_row": last_row}
+
+@app.get("/metrics")
+def metrics():
+    if not METRICS_ENABLED:
+        return JSONResponse({"error": "metrics_disabled"}, status_code=404)
+    return PlainTextResponse(metrics_utils.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/graph/throttle")
+def graph_throttle_stats():
+    return get_graph_client().throttle.stats()
+
+@app.get("/graph/sessions")
+def graph_session_stats():
+    return get_graph_client().sessions.stats()
+
+@app.get("/mirror")
+def mirror_stats():
+    if WRITE_MODE != "mirror":
+        return JSONResponse({"error": "mirror_disabled", "mode": WRITE_MODE}, status_code=404)
+    return workbook_mirror.stats()
+
+@app.post("/mirror/sync")
+async def mirror_sync():
+    """쌓인 행을 지금 바로 OneDrive에 올린다."""
+    if WRITE_MODE != "mirror":
+        return JSONResponse({"error": "mirror_disabled", "mode": WRITE_MODE}, status_code=404)
+    try:
+        result = await workbook_mirror.sync_now(force=True)
+    except httpx.HTTPError as e:
+        return JSONResponse({"error": "sync_failed", "text": repr(e)}, status_code=502)
+    if result["status"] == "failed":
+        return JSONResponse({"error": "sync_failed", **result}, status_code=502)
+    return result
 
+# -------------------------------
+# 출고 기록 조회 (로컬 색인, Graph 호출 없음)
+# -------------------------------
+RECORD_SHEET_KEY = f"{FILE_NAME}/{SHEET_NAME}"
+
+@app.get("/records")
+def records_query(
+    device: Optional[str] = None,
+    invoice: Optional[str] = None,
+    phone: Optional[str] = None,
+    name: Optional[str] = None,
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+    limit: int = 50,
+):
+    """예) /records?phone=010-1234-5678, /records?date_from=2026-10-01&date_to=2026-10-16"""
+    records = record_store.query(
+        device=device, invoice=invoice, phone=phone, name=name,
+        date_from=date_from, date_to=date_to, limit=limit,
+    )
+    return {"count": len(records), "records": records}
+
+@app.get("/records/device/{device}")
+def records_by_device(device: str):
+    """기기가 마지막으로 나간 곳 + 출고 이력."""
+    records = record_store.query(device=device)
+    if not records:
+        return JSONResponse({"error": "record_not_found", "device": device}, status_code=404)
+    return {"device": device, "latest": records[0], "history": records}
+
+@app.get("/records/invoice/{invoice}")
+def records_by_invoice(invoice: str):
+    """이 송장이 이미 출고(기록)됐는지."""
+    records = record_store.query(invoice=invoice)
+    return {"invoice": invoice, "shipped": bool(records), "records": records}
+
+@app.get("/records/stats")
+def records_stats():
+    return record_store.stats()
+
+@app.post("/records/sync")
+async def records_sync(full: bool = False):
+    """워크북과 지금 바로 맞춘다 (full=true 면 전체 다시 읽기)."""
+    try:
+        result = await record_store.sync_now(full=full)
+    except httpx.HTTPError as e:
+        return JSONResponse({"error": "sync_failed", "text": repr(e)}, status_code=502)
+    if result["status"] == "failed":
+        return JSONResponse({"error": "sync_failed", **result}, status_code=502)
+    return result
+
+@app.get("/idempotency")
+def idempotency_stats():
+    return idempotency_store.stats()
+
+@app.get("/ocr/cache")
+def ocr_cache_stats():
+    return {**ocr_cache.stats(), "courier_hints": courier_hints.stats()}
+
+# ✅ 여기까지가 app 모듈 import (라우트 등록 포함) → 기동 시간 보고
+startup.imported(_IMPORT_STARTED)
@@ -0,0 +1,117 @@
+import os
+import asyncio
+
+from metrics_utils import collect, current_spans
+
+# 한 번에 모아 쓸 최대 행 수 / 첫 행이 들어온 뒤 최대 대기(ms) / 대기열 최대 길이
+APPEND_FLUSH_ROWS = int(os.getenv("APPEND_FLUSH_ROWS", "20"))
+APPEND_FLUSH_MS = float(os.getenv("APPEND_FLUSH_MS", "50"))
+APPEND_QUEUE_MAX = int(os.getenv("APPEND_QUEUE_MAX", "500"))
+# 종료 시 남은 행을 마저 쓸지 (0이면 실패로 돌려준다)
+APPEND_FLUSH_ON_SHUTDOWN = os.getenv("APPEND_FLUSH_ON_SHUTDOWN", "1") == "1"
+
+
+class AppendQueueFull(Exception):
+    pass
+
+
+class AppendBuffer:
+    """
+    여러 요청의 행을 모아서 한 번에 쓰는 버퍼 (프로세스 내부).
+    flush_fn(rows) → 행마다 (ok, info) 리스트. 동기 함수면 스레드에서 실행한다.
+    각 호출자는 자기 행의 (ok, info)를 그대로 돌려받는다.
+    """
+
+    def __init__(self, flush_fn, max_rows=APPEND_FLUSH_ROWS, max_delay_ms=APPEND_FLUSH_MS,
+                 max_queue=APPEND_QUEUE_MAX, flush_on_shutdown=APPEND_FLUSH_ON_SHUTDOWN):
+        self.flush_fn = flush_fn
+        self.max_rows = max(1, max_rows)
+        self.max_delay = max(0.0, max_delay_ms) / 1000
+        self.max_queue = max_queue
+        self.flush_on_shutdown = flush_on_shutdown
+        self._pending = []  # [(row, future, 요청의 단계 기록 목록)]
+        self._wakeup = None
+        self._task = None
+        self._closed = False
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._closed = False
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+
+    async def append(self, row):
+        return (await self.append_many([row]))[0]
+
+    async def append_many(self, rows):
+        """여러 행을 한꺼번에 넣는다 (순서 유지). 대기열이 차면 AppendQueueFull."""
+        if self._closed:
+            raise AppendQueueFull("append buffer is closed")
+        if len(self._pending) + len(rows) > self.max_queue:
+            raise AppendQueueFull(f"append queue is full ({self.max_queue})")
+        self.start()
+        loop = asyncio.get_running_loop()
+        futures = []
+        spans = current_spans()
+        for row in rows:
+            fut = loop.create_future()
+            self._pending.append((row, fut, spans))
+            futures.append(fut)
+        self._wakeup.set()
+        return await asyncio.gather(*futures)
+
+    async def close(self):
+        """종료 시 호출. 설정에 따라 남은 행을 마저 쓰거나 실패 처리한 뒤 flush 루프를 끝낸다."""
+        self._closed = True
+        if self._task is None:
+            return
+        if not self.flush_on_shutdown:
+            for _, fut, _ in self._pending:
+                if not fut.done():
+                    fut.set_result((False, {"error": "shutdown"}))
+            self._pending = []
+        self._wakeup.set()
+        await self._task
+        self._task = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while self._pending or not self._closed:
+            if not self._pending:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            # 첫 행 이후 max_delay 동안 더 모은다 (max_rows 차거나 종료 중이면 즉시)
+            deadline = loop.time() + self.max_delay
+            while len(self._pending) < self.max_rows and not self._closed:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), remaining)
+                except asyncio.TimeoutError:
+                    break
+            await self._flush_once()
+
+    async def _flush_once(self):
+        batch, self._pending = self._pending[:self.max_rows], self._pending[self.max_rows:]
+        if not batch:
+            return
+        rows = [row for row, _, _ in batch]
+        # flush는 버퍼 task에서 돈다 → 걸린 단계(token/usedRange/patch)를 모아 행을 넣은 요청들에 나눠 준다
+        with collect() as flush_spans:
+            try:
+                if asyncio.iscoroutinefunction(self.flush_fn):
+                    results = await self.flush_fn(rows)
+                else:
+                    results = await asyncio.to_thread(self.flush_fn, rows)
+            except Exception as e:
+                results = [(False, {"error": "write_failed", "text": repr(e)})] * len(rows)
+        notified = set()
+        for (_, fut, spans), result in zip(batch, results):
+            if spans is not None and id(spans) not in notified:
+                spans.extend(flush_spans)
+                notified.add(id(spans))
+            if not fut.done():
+                fut.set_result(result)
@@ -0,0 +1,234 @@
+import os
+import json
+import time
+import base64
+import pickle
+import asyncio
+import threading
+
+# ✅ 과거 값 개입 차단: 기본값은 하드코딩하되, 필요 시 환경변수로 덮어쓸 수 있게(운영이 유연해짐)
+CLIENT_ID = os.getenv("CLIENT_ID", "41745db3-a5c5-4e6e-acd7-fc4ce18b1999")
+TENANT_ID = os.getenv("TENANT_ID", "405ba8a3-73ff-4423-8925-d9eda360cfa7")  # GUID 또는 yourtenant.onmicrosoft.com
+CLIENT_SECRET = os.getenv("CLIENT_SECRET")  # 반드시 설정 필요
+
+SCOPES = [
+    "User.Read", "Files.ReadWrite.All", "Sites.ReadWrite.All"
+]
+
+AUTHORITY = os.getenv("AUTHORITY", f"https://login.microsoftonline.com/{TENANT_ID}")
+# AUTHORITY를 로컬 가짜 서버로 바꿨으면 0 (login.microsoftonline.com 인스턴스 검증 생략)
+MSAL_INSTANCE_DISCOVERY = os.getenv("MSAL_INSTANCE_DISCOVERY", "1") == "1"
+
+ACCESS_TOKEN_FILE = "access_token.txt"
+REFRESH_FILE = "refresh_token.txt"
+# MSAL 토큰 캐시(SerializableTokenCache) / authority·OpenID 메타데이터(http_cache) 저장 위치
+MSAL_CACHE_FILE = os.getenv("MSAL_CACHE_FILE", "msal_token_cache.json")
+MSAL_HTTP_CACHE_FILE = os.getenv("MSAL_HTTP_CACHE_FILE", "msal_http_cache.pickle")
+
+# 만료 이 시간(초) 전에 미리 갱신
+TOKEN_REFRESH_SKEW = float(os.getenv("TOKEN_REFRESH_SKEW", "300"))
+# 만료 시각을 알 수 없는 토큰(JWT 아님)을 믿고 쓸 시간(초)
+TOKEN_UNKNOWN_TTL = float(os.getenv("TOKEN_UNKNOWN_TTL", "300"))
+
+
+# -------------------------------
+# MSAL App (프로세스당 하나)
+# -------------------------------
+# 매번 새로 만들면 authority/OpenID discovery를 다시 하고 토큰 캐시도 비어서 시작한다.
+# → 하나만 만들고, 토큰 캐시와 discovery 응답(http_cache)은 파일로 남겨 재시작 후에도 재사용.
+_msal_app = None
+_msal_lock = threading.Lock()
+_token_cache = None
+_http_cache = None
+_http_cache_saved_len = 0
+
+
+def _load_token_cache():
+    import msal
+    cache = msal.SerializableTokenCache()
+    state = _read_file(MSAL_CACHE_FILE)
+    if state:
+        try:
+            cache.deserialize(state)
+        except Exception as e:
+            print("[Auth] MSAL 토큰 캐시 읽기 실패 → 새로 시작:", repr(e))
+    return cache
+
+
+def _load_http_cache():
+    try:
+        with open(MSAL_HTTP_CACHE_FILE, "rb") as f:
+            cache = pickle.load(f)
+        return cache if isinstance(cache, dict) else {}
+    except Exception:
+        return {}
+
+
+def _atomic_write(path, data, mode="w"):
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, mode, **({} if "b" in mode else {"encoding": "utf-8"})) as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+def save_msal_cache():
+    """토큰 캐시/discovery 캐시가 바뀌었을 때만 파일에 쓴다."""
+    global _http_cache_saved_len
+    with _msal_lock:
+        try:
+            if _token_cache is not None and _token_cache.has_state_changed:
+                _atomic_write(MSAL_CACHE_FILE, _token_cache.serialize())
+                _token_cache.has_state_changed = False
+            if _http_cache is not None and len(_http_cache) != _http_cache_saved_len:
+                _atomic_write(MSAL_HTTP_CACHE_FILE, pickle.dumps(dict(_http_cache)), "wb")
+                _http_cache_saved_len = len(_http_cache)
+        except Exception as e:
+            print("[Auth] MSAL 캐시 저장 실패:", repr(e))
+
+
+def build_msal_app():
+    global _msal_app, _token_cache, _http_cache, _http_cache_saved_len
+    # msal(+requests)은 무거워서 처음 App을 만들 때 import (기동 워밍업 또는 첫 로그인/토큰 갱신)
+    import msal
+    if not CLIENT_SECRET:
+        raise RuntimeError("CLIENT_SECRET env is missing.")
+    with _msal_lock:
+        if _msal_app is None:
+            _token_cache = _load_token_cache()
+            _http_cache = _load_http_cache()
+            _http_cache_saved_len = len(_http_cache)
+            _msal_app = msal.ConfidentialClientApplication(
+                CLIENT_ID,
+                authority=AUTHORITY,
+                client_credential=CLIENT_SECRET,
+                token_cache=_token_cache,
+                http_cache=_http_cache,
+                instance_discovery=MSAL_INSTANCE_DISCOVERY,
+            )
+        return _msal_app
+
+
+def _read_file(path):
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return f.read().strip() or None
+    except Exception:
+        return None
+
+
+def _write_file(path, value):
+    try:
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(value or "")
+    except Exception as e:
+        print(f"[Auth] {path} 저장 실패:", repr(e))
+
+
+def _jwt_exp(token):
+    """access token(JWT)의 exp 클레임. 서명 검증 없이 만료 시각만 읽는다."""
+    try:
+        payload = token.split(".")[1]
+        payload += "=" * (-len(payload) % 4)
+        return float(json.loads(base64.urlsafe_b64decode(payload))["exp"])
+    except Exception:
+        return None
+
+
+# -------------------------------
+# Access token 관리 (메모리)
+# -------------------------------
+class TokenManager:
+    """
+    access token + 만료 시각을 메모리에 두고, 만료 TOKEN_REFRESH_SKEW 초 전에 미리 갱신.
+    동시에 여러 요청이 와도 갱신은 한 번만 (나머지는 기다렸다가 새 토큰 사용).
+    refresh token / access token 파일은 값이 바뀔 때만 쓴다.
+    """
+
+    def __init__(self, scopes=SCOPES):
+        self.scopes = scopes
+        self._access_token = None
+        self._expires_on = 0.0
+        self._refresh_token = None
+        self._lock = None
+
+    def _valid(self):
+        return self._access_token and self._expires_on - TOKEN_REFRESH_SKEW > time.time()
+
+    async def get_token(self):
+        """유효한 access token. 얻을 수 없으면 None (→ /login 필요)."""
+        if self._valid():
+            return self._access_token
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            if not self._valid():
+                # MSAL 호출은 동기 HTTP → 스레드에서
+                await asyncio.to_thread(self._refresh)
+        return self._access_token if self._access_token and self._expires_on > time.time() else None
+
+    def invalidate(self):
+        """Graph가 401을 주면 호출 → 다음 요청에서 갱신."""
+        self._expires_on = 0.0
+
+    def set_tokens(self, result):
+        """MSAL 결과(access_token, expires_in, refresh_token)를 반영하고 바뀐 값만 파일에 저장."""
+        token = result["access_token"]
+        expires_in = result.get("expires_in")
+        self._expires_on = (
+            time.time() + float(expires_in) if expires_in else
+            _jwt_exp(token) or time.time() + TOKEN_UNKNOWN_TTL
+        )
+        if token != self._access_token:
+            self._access_token = token
+            # 다른 워커 프로세스가 갱신 없이 바로 쓸 수 있게 공유
+            _write_file(ACCESS_TOKEN_FILE, token)
+        refresh_token = result.get("refresh_token")
+        if refresh_token and refresh_token != self._refresh_token:
+            self._refresh_token = refresh_token
+            _write_file(REFRESH_FILE, refresh_token)
+
+    def _refresh(self):
+        try:
+            self._refresh_inner()
+        finally:
+            save_msal_cache()
+
+    def _refresh_inner(self):
+        # 1) 다른 워커(또는 /callback)가 저장한 access token이 아직 유효하면 그대로 사용
+        file_token = _read_file(ACCESS_TOKEN_FILE)
+        if file_token and file_token != self._access_token:
+            expires_on = _jwt_exp(file_token) or time.time() + TOKEN_UNKNOWN_TTL
+            if expires_on - TOKEN_REFRESH_SKEW > time.time():
+                self._access_token, self._expires_on = file_token, expires_on
+                return
+
+        # 2) MSAL 토큰 캐시 (acquire_token_silent: 캐시된 토큰 → 캐시 안의 refresh token 순)
+        try:
+            app = build_msal_app()
+            accounts = app.get_accounts()
+            result = app.acquire_token_silent(self.scopes, account=accounts[0]) if accounts else None
+        except Exception as e:
+            print("[Auth] acquire_token_silent 예외:", repr(e))
+            result = None
+        if result and "access_token" in result:
+            self.set_tokens(result)
+            return
+
+        # 3) refresh_token.txt 로 갱신 (캐시가 없던 이전 배포와의 호환)
+        if self._refresh_token is None:
+            self._refresh_token = _read_file(REFRESH_FILE)
+        if not self._refresh_token:
+            print("[Auth] refresh_token.txt 없음 → /login 후 /callback 먼저 실행하세요.")
+            return
+        try:
+            result = build_msal_app().acquire_token_by_refresh_token(self._refresh_token, scopes=self.scopes)
+        except Exception as e:
+            print("[Auth] 토큰 갱신 예외:", repr(e))
+            return
+        if "access_token" not in result:
+            print("[Auth] 토큰 갱신 실패:", result.get("error"), result.get("error_description"))
+            return
+        self.set_tokens(result)
+
+
+token_manager = TokenManager()
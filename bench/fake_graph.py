@@ -0,0 +1,434 @@
+"""
+로컬 가짜 Microsoft Graph (+ MSAL 토큰 엔드포인트). 실제 OneDrive 없이 부하 테스트용.
+
+실행:
+    uvicorn bench.fake_graph:app --port 9100
+
+앱을 여기에 붙이기:
+    GRAPH_BASE_URL=http://127.0.0.1:9100/v1.0 uvicorn app:app
+    (토큰은 bench/loadtest.py 가 access_token.txt 에 가짜 JWT를 넣어 준다.
+     MSAL 경로까지 보려면 이 서버를 TLS로 띄우고 AUTHORITY=https://127.0.0.1:9100/<tenant>,
+     MSAL_INSTANCE_DISCOVERY=0, REQUESTS_CA_BUNDLE=<인증서> 로 실행 — MSAL은 https authority만 허용)
+
+흉내 내는 것:
+    GET  /v1.0/me, /v1.0/organization
+    GET  /v1.0/me/drive/root/search(q='...'), /v1.0/me/drive/root/children
+    워크북 (items/{id} 또는 root:/{이름}: 경로 모두):
+        POST createSession / refreshSession / closeSession
+        GET  worksheets('..')/usedRange, worksheets('..')/range(address='A2:G9')
+        PATCH worksheets('..')/range(address='A5:G7')
+        POST worksheets('..')/tables('..')/rows
+    POST /v1.0/$batch (dependsOn → 실패 시 424)
+    파일 통째로 (WRITE_MODE=mirror):
+        GET  root:/{이름} (eTag), GET items/{id}/content (xlsx)
+        POST root:/{이름}:/createUploadSession (If-Match 불일치 → 412), PUT/GET 업로드 URL (조각, 이어 올리기)
+    GET  /{tenant}/v2.0/.well-known/openid-configuration, POST /{tenant}/oauth2/v2.0/token
+
+설정(환경변수, 실행 중에는 POST /_fake/config 로 변경):
+    FAKE_GRAPH_LATENCY_MS      요청당 지연 평균 (기본 80)
+    FAKE_GRAPH_JITTER_MS       지연 표준편차 (기본 20)
+    FAKE_GRAPH_SESSIONLESS_MS  세션 없는 워크북 호출 추가 지연 (기본 150)
+    FAKE_GRAPH_429_RATE        429 응답 비율 0~1 (기본 0)
+    FAKE_GRAPH_RETRY_AFTER     429 의 Retry-After 초 (기본 1)
+    FAKE_GRAPH_CONFLICT_RATE   쓰기 직전에 "다른 사용자"가 한 줄 추가할 확률 (기본 0)
+    FAKE_GRAPH_FILE / FAKE_GRAPH_SHEET / FAKE_GRAPH_TABLE  파일·시트·표 이름
+
+확인용:
+    GET  /_fake/state   요청 수, 429 수, 마지막 행, 덮어쓴 행 수
+    GET  /_fake/sheet   시트 전체 (행 번호 → 값)
+    POST /_fake/external  다른 사용자가 한 줄 추가한 것처럼
+    POST /_fake/reset   시트/카운터 초기화
+"""
+import os
+import re
+import io
+import json
+import time
+import uuid
+import base64
+import random
+import asyncio
+import urllib.parse
+from collections import Counter
+
+from openpyxl import Workbook, load_workbook
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, Response
+
+FILE_NAME = os.getenv("FAKE_GRAPH_FILE", os.getenv("FILE_NAME", "유축기출고.xlsx"))
+SHEET_NAME = os.getenv("FAKE_GRAPH_SHEET", os.getenv("WORKSHEET_NAME", "유축기출고"))
+TABLE_NAME = os.getenv("FAKE_GRAPH_TABLE", os.getenv("TABLE_NAME", "출고내역"))
+ITEM_ID = "FAKEITEM0001"
+HEADER = ["출고일", "대여자명", "전화번호", "주소", "기기번호", "기종", "송장번호"]
+
+config = {
+    "latency_ms": float(os.getenv("FAKE_GRAPH_LATENCY_MS", "80")),
+    "jitter_ms": float(os.getenv("FAKE_GRAPH_JITTER_MS", "20")),
+    "sessionless_ms": float(os.getenv("FAKE_GRAPH_SESSIONLESS_MS", "150")),
+    "throttle_rate": float(os.getenv("FAKE_GRAPH_429_RATE", "0")),
+    "retry_after": float(os.getenv("FAKE_GRAPH_RETRY_AFTER", "1")),
+    "conflict_rate": float(os.getenv("FAKE_GRAPH_CONFLICT_RATE", "0")),
+}
+
+
+class Sheet:
+    """한 시트. 1행은 헤더. 이미 값이 있는 행에 PATCH하면 덮어쓰기로 센다."""
+
+    def __init__(self):
+        self.rows = {1: list(HEADER)}
+        self.overwrites = []
+        self.dropped = []
+        self.external_rows = 0
+        self.version = 1
+
+    @property
+    def etag(self):
+        return f'"{{{ITEM_ID}}},{self.version}"'
+
+    @property
+    def last_row(self):
+        return max(self.rows)
+
+    def write(self, first_row, values):
+        for offset, row in enumerate(values):
+            n = first_row + offset
+            old = self.rows.get(n)
+            if old and any(v not in ("", None) for v in old):
+                self.overwrites.append({"row": n, "old": old, "new": row})
+            self.rows[n] = list(row)
+        self.version += 1
+
+    def append(self, values):
+        first = self.last_row + 1
+        self.write(first, values)
+        return first
+
+    def to_xlsx(self):
+        wb = Workbook()
+        ws = wb.active
+        ws.title = SHEET_NAME
+        for n in sorted(self.rows):
+            for col, value in enumerate(self.rows[n], start=1):
+                ws.cell(row=n, column=col, value=value)
+        out = io.BytesIO()
+        wb.save(out)
+        return out.getvalue()
+
+    def replace_with(self, data):
+        """업로드된 xlsx로 교체. 기존 값과 다른 행은 덮어쓰기, 사라진 행은 dropped 로 센다."""
+        ws = load_workbook(io.BytesIO(data))[SHEET_NAME]
+        new_rows = {
+            n: ["" if v is None else v for v in row]
+            for n, row in enumerate(ws.iter_rows(max_col=len(HEADER), values_only=True), start=1)
+        }
+        for n, old in self.rows.items():
+            if n not in new_rows and any(v not in ("", None) for v in old):
+                self.dropped.append({"row": n, "old": old})
+        for n, row in new_rows.items():
+            old = self.rows.get(n)
+            if old and any(v not in ("", None) for v in old) and [str(v) for v in old] != [str(v) for v in row]:
+                self.overwrites.append({"row": n, "old": old, "new": row})
+        self.rows = new_rows or {1: list(HEADER)}
+        self.version += 1
+
+    def item(self):
+        return {"id": ITEM_ID, "name": FILE_NAME, "eTag": self.etag, "cTag": self.etag, "size": 0}
+
+    def external_append(self):
+        """다른 클라이언트(사람이 엑셀에서 직접 입력 등)가 끼어들어 한 줄 추가."""
+        self.external_rows += 1
+        self.append([["external", "", "", "", f"EXT{self.external_rows}", "", ""]])
+
+
+sheet = Sheet()
+sessions = {}
+uploads = {}  # 업로드 세션 ID → {"data": bytearray, "total": int | None}
+counters = Counter()
+
+app = FastAPI()
+
+
+def _error(status, code, message="", headers=None):
+    return status, {"error": {"code": code, "message": message}}, headers or {}
+
+
+def _fake_jwt(lifetime=3600):
+    def part(obj):
+        return base64.urlsafe_b64encode(json.dumps(obj).encode()).rstrip(b"=").decode()
+    return f"{part({'alg': 'none', 'typ': 'JWT'})}.{part({'exp': int(time.time()) + lifetime, 'sub': 'bench'})}.sig"
+
+
+async def _delay(extra_ms=0.0):
+    ms = max(0.0, random.gauss(config["latency_ms"], config["jitter_ms"])) + extra_ms
+    if ms:
+        await asyncio.sleep(ms / 1000)
+
+
+# -------------------------------
+# 라우팅 (경로 → 처리 함수). 반환: (status, body, headers)
+# -------------------------------
+_WORKBOOK = re.compile(r"^/v1\.0/me/drive/(?:items/(?P<item>[^/]+)|root:/(?P<path>[^:]+):)/workbook(?P<rest>/.*)$")
+_SEARCH = re.compile(r"^/v1\.0/me/drive/root/search\(q='(?P<q>[^']*)'\)$")
+_USED_RANGE = re.compile(r"^/worksheets\('(?P<sheet>[^']+)'\)/usedRange$")
+_RANGE = re.compile(r"^/worksheets\('(?P<sheet>[^']+)'\)/range\(address='(?P<address>[^']+)'\)$")
+_TABLE_ROWS = re.compile(r"^(?:/worksheets\('(?P<sheet>[^']+)'\))?/tables\('(?P<table>[^']+)'\)/rows(?:/add)?$")
+_ITEM_PATH = re.compile(r"^/v1\.0/me/drive/root:/(?P<path>[^:]+)$")
+_CONTENT = re.compile(r"^/v1\.0/me/drive/items/(?P<item>[^/]+)/content$")
+_UPLOAD_SESSION = re.compile(r"^/v1\.0/me/drive/root:/(?P<path>[^:]+):/createUploadSession$")
+_CONTENT_RANGE = re.compile(r"^bytes (?P<start>\d+)-(?P<end>\d+)/(?P<total>\d+)$")
+_ADDRESS = re.compile(r"^(?:[^!]+!)?A(?P<first>\d+):G(?P<last>\d+)$")
+
+
+def dispatch(method, path, headers, body):
+    counters[f"{method} {_route_name(path)}"] += 1
+    if config["throttle_rate"] and random.random() < config["throttle_rate"] and not path.endswith("/$batch"):
+        counters["throttled"] += 1
+        return _error(429, "TooManyRequests", "fake throttle", {"Retry-After": str(config["retry_after"])})
+
+    if path == "/v1.0/me" and method == "GET":
+        return 200, {"id": "bench-user", "displayName": "Bench User", "userPrincipalName": "bench@example.com"}, {}
+    if path == "/v1.0/organization" and method == "GET":
+        return 200, {"value": [{"id": "bench-tenant", "displayName": "Bench Org"}]}, {}
+    if path == "/v1.0/me/drive/root/children" and method == "GET":
+        return 200, {"value": [{"id": ITEM_ID, "name": FILE_NAME}]}, {}
+    m = _SEARCH.match(path)
+    if m and method == "GET":
+        q = m.group("q")
+        return 200, {"value": [{"id": ITEM_ID, "name": FILE_NAME}] if q and q in FILE_NAME else []}, {}
+    m = _ITEM_PATH.match(path)
+    if m and method == "GET":
+        return (200, sheet.item(), {}) if m.group("path") == FILE_NAME else _error(404, "itemNotFound")
+    m = _UPLOAD_SESSION.match(path)
+    if m and method == "POST":
+        if m.group("path") != FILE_NAME:
+            return _error(404, "itemNotFound")
+        if_match = headers.get("if-match")
+        if if_match and if_match != sheet.etag:
+            counters["upload_conflicts"] += 1
+            return _error(412, "resourceModified", "eTag mismatch")
+        upload_id = uuid.uuid4().hex
+        uploads[upload_id] = {"data": bytearray(), "total": None}
+        return 200, {"uploadUrl": f"/_fake/upload/{upload_id}", "nextExpectedRanges": ["0-"]}, {}
+    m = _WORKBOOK.match(path)
+    if m:
+        if m.group("item") and m.group("item") != ITEM_ID or m.group("path") and m.group("path") != FILE_NAME:
+            return _error(404, "itemNotFound")
+        return _workbook(method, m.group("rest"), headers, body)
+    return _error(404, "notFound", path)
+
+
+def _route_name(path):
+    if _UPLOAD_SESSION.match(path):
+        return "createUploadSession"
+    m = _WORKBOOK.match(path)
+    if m:
+        rest = re.sub(r"\([^)]*\)", "", m.group("rest"))
+        return f"workbook{rest}"
+    return re.sub(r"\(q='[^']*'\)", "", path)
+
+
+def _workbook(method, rest, headers, body):
+    session_id = headers.get("workbook-session-id")
+    if rest == "/createSession" and method == "POST":
+        session_id = uuid.uuid4().hex
+        sessions[session_id] = time.time()
+        return 201, {"id": session_id, "persistChanges": bool((body or {}).get("persistChanges"))}, {}
+    if rest in ("/refreshSession", "/closeSession") and method == "POST":
+        if session_id not in sessions:
+            return _error(404, "InvalidSessionReCreatable")
+        if rest == "/closeSession":
+            sessions.pop(session_id, None)
+        return 204, None, {}
+    if session_id and session_id not in sessions:
+        return _error(404, "InvalidSessionReCreatable")
+
+    m = _USED_RANGE.match(rest)
+    if m and method == "GET":
+        if m.group("sheet") != SHEET_NAME:
+            return _error(404, "ItemNotFound", "worksheet")
+        return 200, {"address": f"{SHEET_NAME}!A1:G{sheet.last_row}"}, {}
+
+    m = _RANGE.match(rest)
+    if m and method == "GET":
+        address = _ADDRESS.match(m.group("address"))
+        if not address:
+            return _error(400, "InvalidArgument", "address")
+        first, last = int(address.group("first")), int(address.group("last"))
+        blank = [""] * len(HEADER)
+        return 200, {"values": [list(sheet.rows.get(n, blank)) for n in range(first, last + 1)]}, {}
+    if m and method == "PATCH":
+        address = _ADDRESS.match(m.group("address"))
+        values = (body or {}).get("values") or []
+        if not address:
+            return _error(400, "InvalidArgument", "address")
+        first, last = int(address.group("first")), int(address.group("last"))
+        if last - first + 1 != len(values):
+            return _error(400, "InvalidArgument", "row count does not match address")
+        _maybe_conflict()
+        sheet.write(first, values)
+        return 200, {"address": f"{SHEET_NAME}!A{first}:G{last}"}, {}
+
+    m = _TABLE_ROWS.match(rest)
+    if m and method == "POST":
+        if m.group("table") != TABLE_NAME:
+            return _error(404, "ItemNotFound", "table")
+        values = (body or {}).get("values") or []
+        _maybe_conflict()
+        first = sheet.append(values)
+        return 201, {"index": first - 2, "values": values}, {}
+    return _error(404, "notFound", rest)
+
+
+def _maybe_conflict():
+    if config["conflict_rate"] and random.random() < config["conflict_rate"]:
+        counters["conflicts_injected"] += 1
+        sheet.external_append()
+
+
+def _batch(body):
+    results = {}
+    responses = []
+    for req in (body or {}).get("requests", []):
+        req_id = str(req["id"])
+        if any(results.get(str(d), 500) >= 400 for d in req.get("dependsOn") or []):
+            status, resp_body, headers = 424, {"error": {"code": "FailedDependency"}}, {}
+        else:
+            # 개별 요청도 dispatch 안에서 429가 날 수 있다 (실제 Graph와 같게)
+            url = req["url"] if req["url"].startswith("/") else f"/{req['url']}"
+            path = urllib.parse.unquote(urllib.parse.urlsplit(url).path)
+            status, resp_body, headers = dispatch(
+                req.get("method", "GET").upper(), f"/v1.0{path}",
+                {k.lower(): v for k, v in (req.get("headers") or {}).items()}, req.get("body"),
+            )
+        results[req_id] = status
+        responses.append({"id": req_id, "status": status, "headers": headers, "body": resp_body})
+    return {"responses": responses}
+
+
+# -------------------------------
+# HTTP
+# -------------------------------
+@app.get("/_fake/state")
+def fake_state():
+    return {
+        "config": config,
+        "last_row": sheet.last_row,
+        "external_rows": sheet.external_rows,
+        "overwrites": len(sheet.overwrites),
+        "dropped": len(sheet.dropped),
+        "etag": sheet.etag,
+        "sessions": len(sessions),
+        "requests": dict(counters),
+    }
+
+
+@app.get("/_fake/sheet")
+def fake_sheet():
+    return {"rows": {str(n): row for n, row in sorted(sheet.rows.items())}, "overwrites": sheet.overwrites}
+
+
+@app.post("/_fake/config")
+async def fake_config(request: Request):
+    for key, value in (await request.json()).items():
+        if key in config:
+            config[key] = float(value)
+    return config
+
+
+@app.post("/_fake/external")
+def fake_external():
+    """다른 사용자가 엑셀에서 직접 한 줄 추가 (미러 병합 확인용)."""
+    sheet.external_append()
+    return {"last_row": sheet.last_row, "etag": sheet.etag}
+
+
+@app.post("/_fake/reset")
+def fake_reset():
+    global sheet
+    sheet = Sheet()
+    sessions.clear()
+    uploads.clear()
+    counters.clear()
+    return {"status": "reset"}
+
+
+@app.get("/{tenant}/v2.0/.well-known/openid-configuration")
+def openid_configuration(tenant: str, request: Request):
+    base = f"{request.base_url}".rstrip("/") + f"/{tenant}"
+    return {
+        "issuer": f"{base}/v2.0",
+        "authorization_endpoint": f"{base}/oauth2/v2.0/authorize",
+        "token_endpoint": f"{base}/oauth2/v2.0/token",
+        "end_session_endpoint": f"{base}/oauth2/v2.0/logout",
+        "jwks_uri": f"{base}/discovery/v2.0/keys",
+    }
+
+
+@app.post("/{tenant}/oauth2/v2.0/token")
+async def token(tenant: str):
+    await _delay()
+    counters["token"] += 1
+    return {
+        "token_type": "Bearer",
+        "scope": "User.Read Files.ReadWrite.All Sites.ReadWrite.All",
+        "expires_in": 3600,
+        "access_token": _fake_jwt(),
+        "refresh_token": "fake-refresh-token",
+    }
+
+
+@app.api_route("/_fake/upload/{upload_id}", methods=["GET", "PUT"])
+async def fake_upload(upload_id: str, request: Request):
+    """업로드 세션 URL (미리 인증된 URL이라 Authorization 을 보내면 안 된다)."""
+    counters[f"{request.method} upload"] += 1
+    upload = uploads.get(upload_id)
+    if upload is None:
+        return JSONResponse({"error": {"code": "itemNotFound"}}, status_code=404)
+    if "authorization" in request.headers:
+        return JSONResponse({"error": {"code": "invalidRequest", "message": "auth header on upload url"}}, status_code=401)
+    if request.method == "GET":
+        return JSONResponse({"nextExpectedRanges": [f"{len(upload['data'])}-"]})
+    await _delay()
+    m = _CONTENT_RANGE.match(request.headers.get("content-range", ""))
+    chunk = await request.body()
+    if not m or int(m.group("start")) != len(upload["data"]) or len(chunk) != int(m.group("end")) - int(m.group("start")) + 1:
+        return JSONResponse({"error": {"code": "invalidRange"}}, status_code=416)
+    upload["data"] += chunk
+    upload["total"] = int(m.group("total"))
+    if len(upload["data"]) < upload["total"]:
+        return JSONResponse({"nextExpectedRanges": [f"{len(upload['data'])}-"]}, status_code=202)
+    uploads.pop(upload_id, None)
+    sheet.replace_with(bytes(upload["data"]))
+    return JSONResponse(sheet.item(), status_code=201)
+
+
+@app.api_route("/v1.0/{path:path}", methods=["GET", "POST", "PATCH", "PUT", "DELETE"])
+async def graph(request: Request):
+    if not request.headers.get("authorization", "").startswith("Bearer "):
+        return JSONResponse({"error": {"code": "InvalidAuthenticationToken"}}, status_code=401)
+    raw = await request.body()
+    body = json.loads(raw) if raw else None
+    path = urllib.parse.unquote(request.url.path)
+    headers = {k.lower(): v for k, v in request.headers.items()}
+
+    # 세션 없이 부른 워크북 호출은 Graph처럼 더 느리게
+    sessionless = _WORKBOOK.match(path) and "workbook-session-id" not in headers \
+        and not path.endswith(("/createSession", "/refreshSession", "/closeSession"))
+    await _delay(config["sessionless_ms"] if sessionless else 0.0)
+
+    if path == "/v1.0/$batch" and request.method == "POST":
+        counters["POST /v1.0/$batch"] += 1
+        return JSONResponse(_batch(body))
+    m = _CONTENT.match(path)
+    if m and request.method == "GET":
+        counters["GET content"] += 1
+        if m.group("item") != ITEM_ID:
+            return JSONResponse({"error": {"code": "itemNotFound"}}, status_code=404)
+        return Response(sheet.to_xlsx(), media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")
+    status, resp_body, resp_headers = dispatch(request.method, path, headers, body)
+    if status == 200 and isinstance(resp_body, dict) and str(resp_body.get("uploadUrl", "")).startswith("/"):
+        resp_body["uploadUrl"] = str(request.base_url).rstrip("/") + resp_body["uploadUrl"]
+    if resp_body is None:
+        return Response(status_code=status, headers=resp_headers)
+    return JSONResponse(resp_body, status_code=status, headers=resp_headers)
@@ -0,0 +1,324 @@
+"""
+부하 테스트: /excel/append, /process-ocr/ 를 동시에 두드리고 지연(p50/p95/p99)·처리량·유실/덮어쓴 행을 본다.
+
+가짜 Graph(bench/fake_graph.py)와 앱을 임시 폴더에서 같이 띄워서:
+    python -m bench.loadtest --spawn --mode append -n 500 -c 20
+    python -m bench.loadtest --spawn --mode ocr -n 50 -c 4 --throttle-rate 0.05 --conflict-rate 0.02
+
+이미 떠 있는 서버에 붙어서:
+    python -m bench.loadtest --target http://127.0.0.1:8000 --fake http://127.0.0.1:9100 -n 200
+
+행마다 고유 표식(기기번호 칸)을 넣고, 끝난 뒤 가짜 시트 전체를 읽어
+- lost: 성공 응답을 받았는데 시트에 없는 행
+- misplaced: 응답의 range와 실제 위치가 다른 행
+- overwritten: 다른 행이 덮어쓴 우리 행
+- duplicated: 두 번 이상 들어간 행 (재시도 중복)
+을 센다. OCR 모드는 Pillow로 만든 한글 송장 이미지를 보낸다 (한글 폰트가 있어야 읽힘, --font).
+"""
+import os
+import io
+import sys
+import json
+import time
+import random
+import signal
+import asyncio
+import argparse
+import tempfile
+import subprocess
+from collections import Counter
+
+import httpx
+from PIL import Image, ImageDraw, ImageFont
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+FONT_CANDIDATES = [
+    "/usr/share/fonts/truetype/nanum/NanumGothic.ttf",
+    "/usr/share/fonts/opentype/noto/NotoSansCJK-Regular.ttc",
+    "/usr/share/fonts/noto-cjk/NotoSansCJK-Regular.ttc",
+    "/usr/share/fonts/truetype/noto/NotoSansKR-Regular.ttf",
+    "/System/Library/Fonts/AppleSDGothicNeo.ttc",
+    "C:/Windows/Fonts/malgun.ttf",
+]
+NAMES = ["김민준", "이서연", "박지훈", "최수아", "정예준", "강하은", "조도윤", "윤지우", "장서준", "임하린"]
+ADDRESSES = [
+    "서울특별시 강남구 테헤란로 123 4층",
+    "경기도 성남시 분당구 판교역로 235",
+    "부산광역시 해운대구 센텀중앙로 79",
+    "인천광역시 연수구 송도과학로 32",
+    "대구광역시 수성구 동대구로 110",
+]
+
+
+# -------------------------------
+# 합성 송장 이미지
+# -------------------------------
+def find_font(path=None):
+    for candidate in [path] + FONT_CANDIDATES:
+        if candidate and os.path.exists(candidate):
+            return candidate
+    return None
+
+
+def make_label(index, invoice, font_path=None, size=(1200, 1800)):
+    """4×6인치(300dpi) 송장 흉내: 받는분 / 전화 / 주소 / 운송장번호. PNG bytes."""
+    rnd = random.Random(index)
+    image = Image.new("L", size, 255)
+    draw = ImageDraw.Draw(image)
+    if font_path:
+        big, small = ImageFont.truetype(font_path, 64), ImageFont.truetype(font_path, 48)
+    else:
+        big = small = ImageFont.load_default()
+    phone = f"010-{rnd.randint(1000, 9999)}-{rnd.randint(1000, 9999)}"
+    lines = [
+        ("CJ대한통운  택배", big),
+        ("받는분", small),
+        (rnd.choice(NAMES), big),
+        (phone, big),
+        (rnd.choice(ADDRESSES), small),
+        (f"운송장번호 {invoice[:4]}-{invoice[4:8]}-{invoice[8:]}", big),
+    ]
+    y = 120
+    for text, font in lines:
+        draw.text((80, y), text, fill=0, font=font)
+        y += 180
+    draw.rectangle((40, 40, size[0] - 40, size[1] - 40), outline=0, width=6)
+    buf = io.BytesIO()
+    image.save(buf, "PNG")
+    return buf.getvalue()
+
+
+# -------------------------------
+# 서버 띄우기 (--spawn)
+# -------------------------------
+def _fake_jwt(lifetime=86400):
+    sys.path.insert(0, REPO_DIR)
+    from bench.fake_graph import _fake_jwt as make
+    return make(lifetime)
+
+
+def _wait_ready(url, timeout=60):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            if httpx.get(url, timeout=1).status_code < 500:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.3)
+    raise RuntimeError(f"server did not start: {url}")
+
+
+def spawn_servers(args):
+    """임시 폴더(행 장부/작업 큐/토큰 파일 격리)에서 가짜 Graph + 앱 실행."""
+    workdir = tempfile.mkdtemp(prefix="bench-")
+    with open(os.path.join(workdir, "access_token.txt"), "w", encoding="utf-8") as f:
+        f.write(_fake_jwt())
+    fake_url = f"http://127.0.0.1:{args.fake_port}"
+    env = {**os.environ, "GRAPH_BASE_URL": f"{fake_url}/v1.0", "PYTHONUNBUFFERED": "1"}
+    log = open(os.path.join(workdir, "servers.log"), "w")
+    procs = [
+        subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "bench.fake_graph:app", "--port", str(args.fake_port),
+             "--log-level", "warning"],
+            cwd=REPO_DIR, env=env, stdout=log, stderr=subprocess.STDOUT,
+        ),
+        subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "app:app", "--app-dir", REPO_DIR, "--port", str(args.app_port),
+             "--workers", str(args.app_workers), "--log-level", "warning"],
+            cwd=workdir, env=env, stdout=log, stderr=subprocess.STDOUT,
+        ),
+    ]
+    try:
+        _wait_ready(f"{fake_url}/_fake/state")
+        _wait_ready(f"http://127.0.0.1:{args.app_port}/__ping")
+    except Exception:
+        stop_servers(procs)
+        raise
+    print(f"[bench] 서버 실행 (작업 폴더 {workdir}, 로그 servers.log)")
+    return procs, f"http://127.0.0.1:{args.app_port}", fake_url
+
+
+def stop_servers(procs):
+    for p in procs:
+        p.send_signal(signal.SIGINT)
+    for p in procs:
+        try:
+            p.wait(timeout=15)
+        except subprocess.TimeoutExpired:
+            p.kill()
+
+
+# -------------------------------
+# 부하
+# -------------------------------
+def percentile(values, p):
+    if not values:
+        return None
+    ordered = sorted(values)
+    k = max(0, min(len(ordered) - 1, int(round(p / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[k]
+
+
+async def run_load(args, target, run_id):
+    """→ 요청별 결과 [{"kind", "marker", "status", "latency", "range"}]"""
+    font = find_font(args.font)
+    if args.mode != "append" and not font:
+        print("[bench] 한글 폰트를 찾지 못함 → 기본 폰트 (OCR 결과는 비어도 쓰기 경로는 측정됨). --font 로 지정")
+
+    jobs = []
+    for i in range(args.requests):
+        kind = args.mode if args.mode != "mixed" else ("ocr" if i % 2 else "append")
+        marker = f"B{run_id}-{i:05d}"
+        jobs.append((i, kind, marker))
+    # OCR 이미지는 미리 만들어 둔다 (이미지 생성 시간이 지연에 섞이지 않게)
+    images = {
+        i: make_label(i if args.unique_images else 0, f"{(i if args.unique_images else 0):012d}", font)
+        for i, kind, _ in jobs if kind == "ocr"
+    }
+
+    gate = asyncio.Semaphore(args.concurrency)
+    results = []
+
+    async def one(client, i, kind, marker):
+        async with gate:
+            start = time.perf_counter()
+            try:
+                if kind == "append":
+                    row = ["2026-01-01", "벤치", "010-0000-0000", "서울", marker, "심포니", f"{i:012d}"]
+                    resp = await client.post(f"{target}/excel/append", json=row)
+                else:
+                    resp = await client.post(
+                        f"{target}/process-ocr/",
+                        data={"qr_text": f"SM{marker}"},
+                        files={"image": (f"{i}.png", images[i], "image/png")},
+                    )
+                status = resp.status_code
+                body = resp.json() if resp.headers.get("content-type", "").startswith("application/json") else {}
+            except httpx.HTTPError as e:
+                status, body = type(e).__name__, {}
+            latency = time.perf_counter() - start
+        ok = status == 200 and body.get("status") in ("ok", "success")
+        written_range = body.get("range") or (body.get("write_info") or {}).get("range")
+        results.append({
+            "kind": kind, "marker": marker, "status": status if ok or status != 200 else body.get("status"),
+            "ok": ok, "latency": latency, "range": written_range,
+        })
+
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(timeout=args.timeout, limits=limits) as client:
+        start = time.perf_counter()
+        await asyncio.gather(*[one(client, i, kind, marker) for i, kind, marker in jobs])
+        wall = time.perf_counter() - start
+    return results, wall
+
+
+def check_sheet(results, sheet):
+    """성공 응답을 받은 행이 시트에 제대로(제자리, 한 번) 남았는지."""
+    positions = {}
+    for n, row in sheet["rows"].items():
+        marker = row[4] if len(row) > 4 else None
+        positions.setdefault(marker, []).append(int(n))
+    overwritten_markers = {
+        o["old"][4] for o in sheet.get("overwrites", []) if len(o.get("old") or []) > 4
+    }
+    acked = [r for r in results if r["ok"]]
+    lost = [r["marker"] for r in acked if r["marker"] not in positions]
+    misplaced = []
+    for r in acked:
+        rows = positions.get(r["marker"])
+        if rows and r["range"]:
+            claimed = int(r["range"].split(":")[0][1:])
+            if claimed not in rows:
+                misplaced.append(r["marker"])
+    ours = {r["marker"] for r in results}
+    return {
+        "acked": len(acked),
+        "lost": len(lost),
+        "misplaced": len(misplaced),
+        "overwritten": len(ours & overwritten_markers),
+        "duplicated": sum(1 for m in ours if len(positions.get(m, [])) > 1),
+        "unacked_but_written": sum(1 for r in results if not r["ok"] and r["marker"] in positions),
+        "lost_markers": lost[:20],
+    }
+
+
+def report(results, wall, integrity, fake_state):
+    out = {"requests": len(results), "wall_s": round(wall, 3),
+           "throughput_rps": round(len(results) / wall, 2) if wall else None, "by_kind": {}}
+    for kind in sorted({r["kind"] for r in results}):
+        rows = [r for r in results if r["kind"] == kind]
+        lat = [r["latency"] * 1000 for r in rows]
+        out["by_kind"][kind] = {
+            "count": len(rows),
+            "ok": sum(1 for r in rows if r["ok"]),
+            "status": dict(Counter(str(r["status"]) for r in rows)),
+            "p50_ms": round(percentile(lat, 50), 1),
+            "p95_ms": round(percentile(lat, 95), 1),
+            "p99_ms": round(percentile(lat, 99), 1),
+            "max_ms": round(max(lat), 1),
+        }
+    out["integrity"] = integrity
+    if fake_state:
+        graph_calls = sum(v for k, v in fake_state["requests"].items() if k not in ("throttled", "conflicts_injected", "token"))
+        out["graph"] = {
+            "calls": graph_calls,
+            "calls_per_acked_row": round(graph_calls / integrity["acked"], 2) if integrity["acked"] else None,
+            "throttled": fake_state["requests"].get("throttled", 0),
+            "conflicts_injected": fake_state["requests"].get("conflicts_injected", 0),
+            "sheet_overwrites": fake_state["overwrites"],
+            "by_route": fake_state["requests"],
+        }
+    return out
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--target", default="http://127.0.0.1:8000", help="앱 주소")
+    parser.add_argument("--fake", default="http://127.0.0.1:9100", help="가짜 Graph 주소")
+    parser.add_argument("--spawn", action="store_true", help="가짜 Graph + 앱을 직접 띄운다")
+    parser.add_argument("--app-port", type=int, default=8765)
+    parser.add_argument("--fake-port", type=int, default=9765)
+    parser.add_argument("--app-workers", type=int, default=1, help="--spawn 시 uvicorn 워커 수")
+    parser.add_argument("--mode", choices=["append", "ocr", "mixed"], default="append")
+    parser.add_argument("-n", "--requests", type=int, default=200)
+    parser.add_argument("-c", "--concurrency", type=int, default=10)
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--font", help="한글 TTF/TTC 경로")
+    parser.add_argument("--same-image", dest="unique_images", action="store_false",
+                        help="모든 OCR 요청에 같은 이미지 (OCR 캐시 효과 측정)")
+    parser.add_argument("--latency-ms", type=float, help="가짜 Graph 지연 평균")
+    parser.add_argument("--throttle-rate", type=float, help="가짜 Graph 429 비율")
+    parser.add_argument("--conflict-rate", type=float, help="쓰기 전에 다른 사용자가 끼어들 확률")
+    parser.add_argument("--json", action="store_true", help="결과를 JSON 한 덩어리로만 출력")
+    args = parser.parse_args()
+
+    procs = []
+    target, fake = args.target.rstrip("/"), args.fake.rstrip("/")
+    if args.spawn:
+        procs, target, fake = spawn_servers(args)
+    try:
+        fake_config = {k: v for k, v in {
+            "latency_ms": args.latency_ms, "throttle_rate": args.throttle_rate, "conflict_rate": args.conflict_rate,
+        }.items() if v is not None}
+        httpx.post(f"{fake}/_fake/reset")
+        if fake_config:
+            httpx.post(f"{fake}/_fake/config", json=fake_config)
+
+        run_id = f"{int(time.time()) % 100000:05d}"
+        results, wall = asyncio.run(run_load(args, target, run_id))
+        sheet = httpx.get(f"{fake}/_fake/sheet", timeout=30).json()
+        fake_state = httpx.get(f"{fake}/_fake/state").json()
+        summary = report(results, wall, check_sheet(results, sheet), fake_state)
+        if args.json:
+            print(json.dumps(summary, ensure_ascii=False))
+        else:
+            print(json.dumps(summary, ensure_ascii=False, indent=2))
+    finally:
+        if procs:
+            stop_servers(procs)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,251 @@
+import os
+import json
+import time
+import asyncio
+import hashlib
+import threading
+from collections import OrderedDict
+
+# 메모리 LRU 최대 크기(바이트, 값의 JSON 기준) / 유지 시간(초)
+OCR_CACHE_MAX_BYTES = int(os.getenv("OCR_CACHE_MAX_BYTES", str(4 * 1024 * 1024)))
+OCR_CACHE_TTL = float(os.getenv("OCR_CACHE_TTL", "86400"))
+# 디스크 계층 (비우면 사용 안 함). 여러 워커 프로세스가 같이 쓴다.
+OCR_CACHE_DIR = os.getenv("OCR_CACHE_DIR", "")
+OCR_CACHE_DISK_MAX_BYTES = int(os.getenv("OCR_CACHE_DISK_MAX_BYTES", str(64 * 1024 * 1024)))
+# 디스크 용량은 쓴 크기로 따라가다가 이 횟수마다 한 번 디렉터리를 다시 훑는다 (다른 프로세스가 쓴 분 반영)
+OCR_CACHE_DISK_SCAN_EVERY = int(os.getenv("OCR_CACHE_DISK_SCAN_EVERY", "256"))
+# 용량을 넘으면 이 비율까지 지운다 (넘을 때마다 매번 훑지 않게)
+OCR_CACHE_DISK_LOW_WATER = float(os.getenv("OCR_CACHE_DISK_LOW_WATER", "0.9"))
+# 기기(촬영 단말)별 마지막 택배사 기억 시간(초) / 최대 기기 수
+COURIER_HINT_TTL = float(os.getenv("COURIER_HINT_TTL", "1800"))
+COURIER_HINT_MAX = int(os.getenv("COURIER_HINT_MAX", "1024"))
+
+
+class OcrResultCache:
+    """
+    이미지 내용 해시(+OCR 설정) → OCR 결과.
+    같은 사진을 다시 올리면 Tesseract를 건너뛴다. 메모리 LRU → (선택) 디스크 순으로 찾는다.
+    이벤트 루프에서는 aget/aput (디스크 계층만 스레드에서).
+    """
+
+    def __init__(self, max_bytes=OCR_CACHE_MAX_BYTES, ttl=OCR_CACHE_TTL,
+                 disk_dir=OCR_CACHE_DIR, disk_max_bytes=OCR_CACHE_DISK_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.disk_dir = disk_dir
+        self.disk_max_bytes = disk_max_bytes
+        self._items = OrderedDict()  # key → (만료시각, 크기, 값)
+        self._bytes = 0
+        self._disk_bytes = None  # 첫 쓰기 때 한 번 훑어서 시작
+        self._disk_writes = 0
+        self._lock = threading.Lock()
+        self.counters = {"hits_memory": 0, "hits_disk": 0, "misses": 0, "evictions": 0}
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+
+    @staticmethod
+    def make_key(content_hash, config=""):
+        return hashlib.sha256(f"{content_hash}:{config}".encode()).hexdigest()
+
+    def get(self, key):
+        now = time.time()
+        value = self._memory_get(key, now)
+        if value is not None:
+            return value
+        return self._disk_lookup(key, now)
+
+    def put(self, key, value):
+        self._memory_put(key, value, time.time())
+        self._disk_put(key, value)
+
+    async def aget(self, key):
+        """get 과 같음. 메모리에 없고 디스크 계층이 있으면 파일 읽기는 스레드에서."""
+        now = time.time()
+        value = self._memory_get(key, now)
+        if value is not None:
+            return value
+        if not self.disk_dir:
+            return self._disk_lookup(key, now)
+        return await asyncio.to_thread(self._disk_lookup, key, now)
+
+    async def aput(self, key, value):
+        """put 과 같음. 디스크 쓰기(+정리)는 스레드에서."""
+        self._memory_put(key, value, time.time())
+        if self.disk_dir:
+            await asyncio.to_thread(self._disk_put, key, value)
+
+    def stats(self):
+        with self._lock:
+            lookups = sum(self.counters[k] for k in ("hits_memory", "hits_disk", "misses"))
+            hits = self.counters["hits_memory"] + self.counters["hits_disk"]
+            return {
+                **self.counters,
+                "entries": len(self._items),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hit_ratio": round(hits / lookups, 3) if lookups else None,
+                "disk": bool(self.disk_dir),
+                "disk_bytes": self._disk_bytes,
+            }
+
+    # -------------------------------
+    # 메모리
+    # -------------------------------
+    def _memory_get(self, key, now):
+        with self._lock:
+            hit = self._items.get(key)
+            if hit and hit[0] > now:
+                self._items.move_to_end(key)
+                self.counters["hits_memory"] += 1
+                return dict(hit[2])
+            if hit:
+                self._drop(key)
+        return None
+
+    def _drop(self, key):
+        _, size, _ = self._items.pop(key)
+        self._bytes -= size
+
+    def _memory_put(self, key, value, now):
+        size = len(json.dumps(value, ensure_ascii=False).encode())
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._items:
+                self._drop(key)
+            self._items[key] = (now + self.ttl, size, dict(value))
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                oldest = next(iter(self._items))
+                self._drop(oldest)
+                self.counters["evictions"] += 1
+
+    # -------------------------------
+    # 디스크 (key.json, 만료는 mtime 기준)
+    # -------------------------------
+    def _disk_lookup(self, key, now):
+        value = self._disk_get(key, now)
+        with self._lock:
+            if value is None:
+                self.counters["misses"] += 1
+                return None
+            self.counters["hits_disk"] += 1
+        self._memory_put(key, value, now)
+        return dict(value)
+
+    def _path(self, key):
+        return os.path.join(self.disk_dir, f"{key}.json")
+
+    def _disk_get(self, key, now):
+        if not self.disk_dir:
+            return None
+        path = self._path(key)
+        try:
+            if os.path.getmtime(path) + self.ttl <= now:
+                os.remove(path)
+                return None
+            with open(path, encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _disk_put(self, key, value):
+        if not self.disk_dir:
+            return
+        path = self._path(key)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        try:
+            try:
+                old_size = os.path.getsize(path)
+            except OSError:
+                old_size = 0
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(value, f, ensure_ascii=False)
+            size = os.path.getsize(tmp)
+            os.replace(tmp, path)
+            with self._lock:
+                self._disk_writes += 1
+                rescan = self._disk_bytes is None or self._disk_writes % max(1, OCR_CACHE_DISK_SCAN_EVERY) == 0
+                if not rescan:
+                    self._disk_bytes += size - old_size
+                over = not rescan and self._disk_bytes > self.disk_max_bytes
+            if rescan or over:
+                self._disk_evict()
+        except OSError as e:
+            print("[OCR cache] 디스크 저장 실패:", repr(e))
+
+    def _disk_evict(self):
+        """
+        디렉터리를 훑어 실제 용량을 다시 잰다. 넘으면 오래된(mtime) 파일부터 low water 까지 지운다.
+        (매 쓰기마다가 아니라 첫 쓰기 / 용량 초과 / OCR_CACHE_DISK_SCAN_EVERY 번마다)
+        """
+        entries = []
+        total = 0
+        for name in os.listdir(self.disk_dir):
+            if not name.endswith(".json"):
+                continue
+            try:
+                st = os.stat(os.path.join(self.disk_dir, name))
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, name))
+            total += st.st_size
+        if total > self.disk_max_bytes:
+            target = self.disk_max_bytes * OCR_CACHE_DISK_LOW_WATER
+            for _, size, name in sorted(entries):
+                try:
+                    os.remove(os.path.join(self.disk_dir, name))
+                except OSError:
+                    pass
+                total -= size
+                with self._lock:
+                    self.counters["evictions"] += 1
+                if total <= target:
+                    break
+        with self._lock:
+            self._disk_bytes = total
+
+
+class CourierHints:
+    """
+    기기 → 마지막으로 템플릿 인식에 성공한 택배사 (OCR_MODE=template).
+    한 기기는 보통 같은 택배사 라벨을 연달아 찍으므로 다음 사진은 헤더 판별 없이 그 템플릿부터.
+    """
+
+    def __init__(self, ttl=COURIER_HINT_TTL, max_items=COURIER_HINT_MAX):
+        self.ttl = ttl
+        self.max_items = max_items
+        self._items = OrderedDict()  # 기기 키 → (만료시각, 택배사)
+        self._lock = threading.Lock()
+        self.counters = {"hits": 0, "misses": 0}
+
+    def get(self, device):
+        if not device:
+            return None
+        with self._lock:
+            hit = self._items.get(device)
+            if hit and hit[0] > time.time():
+                self.counters["hits"] += 1
+                return hit[1]
+            self._items.pop(device, None)
+            self.counters["misses"] += 1
+            return None
+
+    def put(self, device, courier):
+        """courier 가 비어 있으면(템플릿 실패) 잊는다."""
+        if not device:
+            return
+        with self._lock:
+            self._items.pop(device, None)
+            if courier:
+                self._items[device] = (time.time() + self.ttl, courier)
+                while len(self._items) > self.max_items:
+                    self._items.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            return {**self.counters, "devices": len(self._items)}
+
+
+ocr_cache = OcrResultCache()
+courier_hints = CourierHints()
@@ -1,50 +1,23 @@
 import os
-import urllib.parse
-import httpx
-import msal
 
-GRAPH_BASE = "https://graph.microsoft.com/v1.0"
-
-CLIENT_ID = os.getenv("CLIENT_ID")
-CLIENT_SECRET = os.getenv("CLIENT_SECRET")
-TENANT_ID = os.getenv("TENANT_ID")
-AUTHORITY = f"https://login.microsoftonline.com/{TENANT_ID}"
-SCOPES = ["offline_access", "Files.ReadWrite.All", "Sites.ReadWrite.All", "User.Read"]
+from append_utils import AppendBuffer, AppendQueueFull
+from graph_utils import get_graph_client
+from auth_utils import token_manager
+from metrics_utils import stage
 
 FILE_NAME = os.getenv("FILE_NAME", "유축기출고.xlsx")
 WORKSHEET_NAME = os.getenv("WORKSHEET_NAME", "유축기출고")
 TABLE_NAME = os.getenv("TABLE_NAME", "출고내역")
 
-REFRESH_FILE = "refresh_token.txt"
-
-
-def _build_msal_app():
-    return msal.ConfidentialClientApplication(
-        CLIENT_ID, authority=AUTHORITY, client_credential=CLIENT_SECRET
-    )
-
-
-def _load_refresh_token():
-    if not os.path.exists(REFRESH_FILE):
-        raise RuntimeError("refresh_token.txt 없음 → /login 후 /callback 먼저 실행하세요.")
-    with open(REFRESH_FILE, encoding="utf-8") as f:
-        return f.read().strip()
-
 
-def get_access_token():
+async def get_access_token():
     """
-    refresh_token으로 새 access_token 발급
+    메모리에 있는 access_token (만료 임박 시에만 refresh_token으로 갱신)
     """
-    refresh_token = _load_refresh_token()
-    app = _build_msal_app()
-    result = app.acquire_token_by_refresh_token(refresh_token, scopes=SCOPES)
-    if "access_token" not in result:
-        raise RuntimeError(f"토큰 갱신 실패: {result}")
-    # refresh_token이 새로 내려오면 교체 저장
-    if "refresh_token" in result:
-        with open(REFRESH_FILE, "w", encoding="utf-8") as f:
-            f.write(result["refresh_token"])
-    return result["access_token"]
+    token = await token_manager.get_token()
+    if not token:
+        raise RuntimeError("access_token 없음 → /login 후 /callback 먼저 실행하세요.")
+    return token
 
 
 async def append_row_to_excel(row: dict):
@@ -59,25 +32,9 @@ async def append_row_to_excel(row: dict):
         "기기번호": "ABC123",
         "송장번호": "123-456"
     }
+    반환: 성공 시 {"table": TABLE_NAME, "index": 표 안의 행 index}, 실패 시 None
     """
-    try:
-        token = get_access_token()
-    except Exception as e:
-        print("[OneDrive] ACCESS_TOKEN 획득 실패:", e)
-        return
-
-    headers = {
-        "Authorization": f"Bearer {token}",
-        "Content-Type": "application/json"
-    }
-
-    encoded_path = urllib.parse.quote(f"/{FILE_NAME}")
-    table_url = (
-        f"{GRAPH_BASE}/me/drive/root:{encoded_path}:/workbook/worksheets('{WORKSHEET_NAME}')"
-        f"/tables('{TABLE_NAME}')/rows"
-    )
-
-    values = [[
+    values = [
         row.get("출고일", ""),
         row.get("대여자명", ""),
         row.get("전화번호", ""),
@@ -85,13 +42,45 @@ async def append_row_to_excel(row: dict):
         row.get("유축기기종", ""),
         row.get("기기번호", ""),
         row.get("송장번호", ""),
-    ]]
+    ]
+
+    # 버퍼에 넣으면 다른 요청의 행들과 함께 rows POST 한 번으로 추가된다
+    try:
+        ok, info = await table_buffer.append(values)
+    except AppendQueueFull as e:
+        print("[OneDrive] 대기열 가득 참:", e)
+        return None
+
+    if not ok:
+        print("[OneDrive] 테이블 행 추가 실패:", info)
+        return None
+
+    print(f"[OneDrive] 업로드 성공 → {FILE_NAME} / {WORKSHEET_NAME} / {TABLE_NAME} / {info['index']}")
+    return info
+
 
-    async with httpx.AsyncClient(timeout=20.0) as client:
-        res = await client.post(table_url, headers=headers, json={"values": values})
+async def _flush_rows_to_table(rows):
+    """모인 행들을 tables('{TABLE_NAME}')/rows POST 한 번에 추가. 행마다 (ok, info)."""
+    try:
+        with stage("token"):
+            token = await get_access_token()
+    except Exception as e:
+        print("[OneDrive] ACCESS_TOKEN 획득 실패:", e)
+        return [(False, {"error": "no_access_token", "text": str(e)})] * len(rows)
+
+    with stage("rows"):
+        res = await get_graph_client().add_table_rows(token, rows, TABLE_NAME)
 
     if res.status_code not in (200, 201):
-        print("[OneDrive] 테이블 행 추가 실패:", res.status_code, res.text)
-        return
+        error = {"error": "write_failed", "status": res.status_code, "text": res.text}
+        return [(False, error)] * len(rows)
+
+    # 응답은 추가된 첫 행 → 나머지는 index가 1씩 증가
+    first = res.json().get("index")
+    return [
+        (True, {"table": TABLE_NAME, "index": first + i if first is not None else None})
+        for i in range(len(rows))
+    ]
+
 
-    print(f"[OneDrive] 업로드 성공 → {FILE_NAME} / {WORKSHEET_NAME} / {TABLE_NAME}")
+table_buffer = AppendBuffer(_flush_rows_to_table)
@@ -0,0 +1,439 @@
+import os
+import time
+import asyncio
+import urllib.parse
+
+import httpx
+
+from row_utils import parse_last_row
+from throttle_utils import (
+    ThrottlePolicy, IDEMPOTENT_METHODS, GRAPH_MAX_RETRIES, GRAPH_RETRY_MAX,
+    retry_after_seconds, backoff_delay, workbook_base, workbook_key,
+)
+from session_utils import WorkbookSessionManager, SESSION_HEADER, is_session_error
+from metrics_utils import stage
+
+# 로컬 가짜 Graph(bench/fake_graph.py)로 돌릴 때 덮어쓴다
+GRAPH = os.getenv("GRAPH_BASE_URL", "https://graph.microsoft.com/v1.0")
+
+FILE_NAME = os.getenv("FILE_NAME", "유축기출고.xlsx")
+SHEET_NAME = os.getenv("WORKSHEET_NAME", "유축기출고")
+TABLE_NAME = os.getenv("TABLE_NAME", "출고내역")
+
+# $batch 한 번에 넣을 수 있는 최대 요청 수 (Graph 제한)
+BATCH_MAX = 20
+
+# 워크북 item ID 캐시 유지 시간(초). 파일이 이동/재생성되면 404로 감지해 무효화한다.
+ITEM_ID_TTL = float(os.getenv("ITEM_ID_TTL", "3600"))
+
+# 커넥션 풀 / 타임아웃 (초)
+GRAPH_HTTP2 = os.getenv("GRAPH_HTTP2", "1") == "1"
+GRAPH_MAX_CONNECTIONS = int(os.getenv("GRAPH_MAX_CONNECTIONS", "20"))
+GRAPH_MAX_KEEPALIVE = int(os.getenv("GRAPH_MAX_KEEPALIVE", "10"))
+GRAPH_KEEPALIVE_EXPIRY = float(os.getenv("GRAPH_KEEPALIVE_EXPIRY", "120"))
+GRAPH_CONNECT_TIMEOUT = float(os.getenv("GRAPH_CONNECT_TIMEOUT", "5"))
+GRAPH_READ_TIMEOUT = float(os.getenv("GRAPH_READ_TIMEOUT", "30"))
+GRAPH_WRITE_TIMEOUT = float(os.getenv("GRAPH_WRITE_TIMEOUT", "30"))
+GRAPH_POOL_TIMEOUT = float(os.getenv("GRAPH_POOL_TIMEOUT", "10"))
+# 업로드 세션 조각 크기 (Graph 요구: 320 KiB의 배수, 60 MiB 이하)
+_UPLOAD_UNIT = 320 * 1024
+UPLOAD_CHUNK_BYTES = max(1, int(os.getenv("UPLOAD_CHUNK_BYTES", str(_UPLOAD_UNIT * 10))) // _UPLOAD_UNIT) * _UPLOAD_UNIT
+
+
+def _http2_available():
+    try:
+        import h2  # noqa: F401  (httpx[http2])
+    except ImportError:
+        return False
+    return True
+
+
+def is_item_not_found(resp):
+    """Graph 응답이 404 / itemNotFound 인지 (캐시된 item ID가 더 이상 유효하지 않음)."""
+    if resp.status_code == 404:
+        return True
+    try:
+        code = (resp.json().get("error") or {}).get("code")
+    except Exception:
+        return False
+    return code == "itemNotFound"
+
+
+def _next_expected(body, default):
+    """업로드 세션 응답의 nextExpectedRanges ["26-", ...] → 다음 시작 위치."""
+    ranges = (body or {}).get("nextExpectedRanges") or []
+    try:
+        return int(ranges[0].split("-")[0])
+    except (IndexError, ValueError):
+        return default
+
+
+def _search_item_id(search_body, file_name):
+    items = (search_body or {}).get("value", [])
+    if not items or items[0]["name"] != file_name:
+        return None
+    return items[0]["id"]
+
+
+class GraphWorkbookClient:
+    """
+    앱 전체가 공유하는 비동기 Graph 클라이언트 (httpx.AsyncClient 하나 + keep-alive 풀).
+    lifespan에서 만들고 닫는다. 워크북 item ID 캐시도 여기서 관리.
+    모든 요청은 ThrottlePolicy(Retry-After 재시도 / 파일별 동시성 제한 / 회로 차단)를 거친다.
+    워크북 호출에는 파일별 영구 세션(workbook-session-id)을 붙인다 ($batch 안의 요청은 제외).
+    """
+
+    def __init__(self, base_url=GRAPH, file_name=FILE_NAME, sheet_name=SHEET_NAME, http=None):
+        self.base_url = base_url
+        self.file_name = file_name
+        self.sheet_name = sheet_name
+        self.http = http or httpx.AsyncClient(
+            http2=GRAPH_HTTP2 and _http2_available(),
+            limits=httpx.Limits(
+                max_connections=GRAPH_MAX_CONNECTIONS,
+                max_keepalive_connections=GRAPH_MAX_KEEPALIVE,
+                keepalive_expiry=GRAPH_KEEPALIVE_EXPIRY,
+            ),
+            timeout=httpx.Timeout(
+                connect=GRAPH_CONNECT_TIMEOUT,
+                read=GRAPH_READ_TIMEOUT,
+                write=GRAPH_WRITE_TIMEOUT,
+                pool=GRAPH_POOL_TIMEOUT,
+            ),
+        )
+        # (file_name, sheet_name) → (item_id, 만료시각)
+        self._item_ids = {}
+        self.throttle = ThrottlePolicy()
+        self.sessions = WorkbookSessionManager(self)
+
+    async def aclose(self):
+        await self.sessions.close()
+        await self.http.aclose()
+
+    # -------------------------------
+    # HTTP
+    # -------------------------------
+    async def request(self, method, url, token, idempotent=None, **kwargs):
+        """
+        url은 /v1.0 기준 상대경로("/me") 또는 전체 URL.
+        idempotent: 503/504·타임아웃 후 다시 보내도 되는 요청인지 (기본: GET/PUT/DELETE 등)
+        """
+        headers = {"Authorization": f"Bearer {token}", **(kwargs.pop("headers", None) or {})}
+        if url.startswith("/"):
+            url = f"{self.base_url}{url}"
+        if idempotent is None:
+            idempotent = method.upper() in IDEMPOTENT_METHODS
+
+        base = workbook_base(url)
+        if base is None or self.sessions.is_session_action(url) or SESSION_HEADER in headers:
+            return await self.throttle.send(self.http, method, url, idempotent, headers=headers, **kwargs)
+
+        # 워크북 호출: 세션 붙여서. 세션이 무효라는 응답이면 새 세션으로 한 번 더
+        key = self._session_key(url)
+        for _ in range(2):
+            session_id = await self.sessions.session_id(key, base, token)
+            if session_id:
+                headers[SESSION_HEADER] = session_id
+            else:
+                headers.pop(SESSION_HEADER, None)
+            start = time.perf_counter()
+            resp = await self.throttle.send(self.http, method, url, idempotent, headers=headers, **kwargs)
+            self.sessions.record(bool(session_id), time.perf_counter() - start)
+            if not (session_id and is_session_error(resp)):
+                break
+            self.sessions.invalidate(key, session_id)
+        self.sessions.touch(key)
+        return resp
+
+    def _session_key(self, url):
+        """워크북 세션 키: item ID. 이 파일의 경로(root:/파일:) 호출도 item ID를 알면 같은 세션으로."""
+        key = workbook_key(url)
+        if "/items/" not in workbook_base(url) and urllib.parse.unquote(key).lstrip("/") == self.file_name:
+            return self.cached_item_id() or key
+        return key
+
+    async def get(self, url, token, **kwargs):
+        return await self.request("GET", url, token, **kwargs)
+
+    async def post(self, url, token, **kwargs):
+        return await self.request("POST", url, token, **kwargs)
+
+    async def patch(self, url, token, **kwargs):
+        return await self.request("PATCH", url, token, **kwargs)
+
+    # -------------------------------
+    # 워크북 item ID 캐시
+    # -------------------------------
+    def _cache_key(self):
+        return (self.file_name, self.sheet_name)
+
+    def cached_item_id(self):
+        hit = self._item_ids.get(self._cache_key())
+        if hit and hit[1] > time.monotonic():
+            return hit[0]
+        self._item_ids.pop(self._cache_key(), None)
+        return None
+
+    def remember_item_id(self, item_id):
+        self._item_ids[self._cache_key()] = (item_id, time.monotonic() + ITEM_ID_TTL)
+
+    def invalidate_item_id(self):
+        self._item_ids.pop(self._cache_key(), None)
+
+    # -------------------------------
+    # 워크북
+    # -------------------------------
+    def _worksheet_url(self, item_id):
+        return f"/me/drive/items/{item_id}/workbook/worksheets('{self.sheet_name}')"
+
+    async def get_used_range(self, token, item_id):
+        return await self.get(f"{self._worksheet_url(item_id)}/usedRange", token)
+
+    async def get_range(self, token, item_id, address):
+        return await self.get(f"{self._worksheet_url(item_id)}/range(address='{address}')?$select=values", token)
+
+    async def patch_range(self, token, item_id, address, values):
+        # 주소가 정해진 range 덮어쓰기 → 같은 값을 다시 써도 결과가 같으므로 재시도 가능
+        return await self.patch(
+            f"{self._worksheet_url(item_id)}/range(address='{address}')", token,
+            idempotent=True, json={"values": values},
+        )
+
+    async def add_table_rows(self, token, values, table_name=TABLE_NAME):
+        encoded_path = urllib.parse.quote(f"/{self.file_name}")
+        return await self.post(
+            f"/me/drive/root:{encoded_path}:/workbook/worksheets('{self.sheet_name}')"
+            f"/tables('{table_name}')/rows",
+            token,
+            json={"values": values},
+        )
+
+    async def discover_workbook(self, token, item_id=None):
+        """
+        쓰기 전에 필요한 (item_id, 마지막 행)을 최소 왕복으로 구한다.
+        - item_id를 모르면: drive search → 경로 기반 usedRange (dependsOn) 를 $batch 한 번에
+          (PATCH 주소는 usedRange 결과로 정해지므로 같은 batch에 넣을 수 없다)
+        - item_id를 알면: usedRange 한 번
+        반환: (item_id, last_row). 파일 없음 → (None, None),
+        캐시된 ID가 무효 → (item_id, None) + 캐시 무효화, usedRange 실패 → (item_id, None) (캐시 유지)
+        """
+        if item_id:
+            with stage("usedRange"):
+                used = await self.get_used_range(token, item_id)
+            if is_item_not_found(used):
+                self.invalidate_item_id()
+                return item_id, None
+            if used.status_code != 200:
+                return item_id, None
+            return item_id, parse_last_row(used.json().get("address"))
+
+        encoded_path = urllib.parse.quote(f"/{self.file_name}")
+        # search + usedRange 한 번의 $batch → "search" 단계로 기록
+        with stage("search"):
+            results = await self.batch(token, [
+                {"id": "search", "method": "GET", "url": f"/me/drive/root/search(q='{self.file_name}')?$top=1"},
+                {"id": "used", "method": "GET", "dependsOn": ["search"],
+                 "url": f"/me/drive/root:{encoded_path}:/workbook/worksheets('{self.sheet_name}')/usedRange"},
+            ])
+        item_id = _search_item_id(results["search"].get("body"), self.file_name)
+        if not item_id:
+            self.invalidate_item_id()
+            return None, None
+        self.remember_item_id(item_id)
+
+        used = results["used"]
+        if used.get("status") == 200:
+            return item_id, parse_last_row((used.get("body") or {}).get("address"))
+        # 파일이 루트가 아닌 하위 폴더에 있으면 경로 기반 조회는 실패 → ID로 한 번 더
+        return await self.discover_workbook(token, item_id)
+
+    async def warm_workbook(self, token):
+        """시작 시 item ID + 마지막 행을 미리 찾아 둔다. 토큰이 없거나 실패해도 기동은 계속."""
+        if not token:
+            return None, None
+        try:
+            item_id, last_row = await self.discover_workbook(token)
+        except Exception as e:
+            print("[OneDrive] 워크북 워밍업 실패:", repr(e))
+            return None, None
+        print(f"[OneDrive] 워크북 워밍업 → {self.file_name}: {item_id} / 마지막 행 {last_row}")
+        return item_id, last_row
+
+    # -------------------------------
+    # 파일 (미러 모드: 통째로 받고 올리기)
+    # -------------------------------
+    def _item_path(self):
+        return f"/me/drive/root:{urllib.parse.quote(f'/{self.file_name}')}"
+
+    async def get_drive_item(self, token):
+        """파일 메타데이터 (id, eTag, cTag ...). 없으면 404 응답 그대로."""
+        return await self.get(f"{self._item_path()}?$select=id,eTag,cTag,size", token)
+
+    async def download_item(self, token, item_id):
+        # /content 는 미리 인증된 다운로드 URL로 302 → httpx가 다른 호스트로 갈 때 Authorization을 뗀다
+        return await self.get(f"/me/drive/items/{item_id}/content", token, follow_redirects=True)
+
+    async def upload_file(self, token, data, if_match=None):
+        """
+        업로드 세션으로 파일 전체 교체. if_match(eTag)를 주면 그 사이 원격이 바뀌었을 때 412.
+        반환: 마지막 조각의 응답 (200/201 이면 완료, body는 driveItem)
+        """
+        headers = {"If-Match": if_match} if if_match else {}
+        resp = await self.post(
+            f"{self._item_path()}:/createUploadSession", token, headers=headers,
+            json={"item": {"@microsoft.graph.conflictBehavior": "replace"}},
+        )
+        if resp.status_code != 200:
+            return resp
+        return await self._upload_chunks(resp.json()["uploadUrl"], data)
+
+    async def _upload_chunks(self, upload_url, data):
+        """
+        조각 PUT (uploadUrl 은 미리 인증됨 → Authorization 헤더를 붙이면 안 된다).
+        조각이 실패하면 세션 상태(nextExpectedRanges)를 물어 그 위치부터 이어서 올린다.
+        """
+        total = len(data)
+        start = 0
+        failures = 0
+        while True:
+            end = min(start + UPLOAD_CHUNK_BYTES, total) - 1
+            try:
+                resp = await self.throttle.send(
+                    self.http, "PUT", upload_url, True,
+                    headers={"Content-Range": f"bytes {start}-{end}/{total}"},
+                    content=data[start:end + 1],
+                )
+            except httpx.TransportError as e:
+                print("[OneDrive] 업로드 조각 전송 실패 → 이어 올리기:", repr(e))
+                resp = None
+            if resp is not None and resp.status_code in (200, 201):
+                return resp
+            if resp is not None and resp.status_code == 202:
+                start = _next_expected(resp.json(), end + 1)
+                failures = 0
+                continue
+
+            failures += 1
+            if failures > GRAPH_MAX_RETRIES:
+                if resp is None:
+                    raise httpx.TransportError("upload session: too many failed chunks")
+                return resp
+            status = await self.throttle.send(self.http, "GET", upload_url, True)
+            if status.status_code != 200:
+                # 세션 만료/이미 완료 → 호출한 쪽이 eTag 확인 후 다시
+                return status
+            start = _next_expected(status.json(), start)
+
+    # -------------------------------
+    # JSON $batch
+    # -------------------------------
+    async def batch(self, token, batch_requests):
+        """
+        여러 Graph 요청을 POST /$batch 로 묶어 보낸다 (20개씩 끊어서 순서대로).
+        batch_requests 예:
+            [{"id": "me", "method": "GET", "url": "/me"},
+             {"id": "org", "method": "GET", "url": "/organization"},
+             {"id": "w1", "method": "PATCH", "url": "...", "body": {...}, "dependsOn": ["org"]}]
+        url은 /v1.0 기준 상대경로. body가 있으면 Content-Type: application/json 자동 추가.
+        반환: {id: {"status": ..., "headers": {...}, "body": ...}}
+        - dependsOn 대상이 앞 조각에 있으면 이미 끝난 요청이므로 의존성에서 뺀다.
+          그 요청이 실패했으면(또는 건너뛰었으면) Graph와 같게 424(Failed Dependency) 처리.
+        - 개별 응답이 429면 (처리되지 않은 요청이므로) 그 요청과, 그 때문에 424가 된 요청만
+          Retry-After 뒤에 다시 묶어 보낸다.
+        """
+        results = {}
+        for start in range(0, len(batch_requests), BATCH_MAX):
+            chunk = batch_requests[start:start + BATCH_MAX]
+            sent = set()
+            payload = []
+            for r in chunk:
+                req_id = str(r["id"])
+                depends = [str(d) for d in r.get("dependsOn") or []]
+                if any(d not in sent and results.get(d, {}).get("status", 0) >= 400 for d in depends):
+                    results[req_id] = {"status": 424, "headers": {}, "body": None}
+                    continue
+
+                req = {"id": req_id, "method": r.get("method", "GET"), "url": r["url"]}
+                req_headers = dict(r.get("headers") or {})
+                if "body" in r:
+                    req["body"] = r["body"]
+                    req_headers.setdefault("Content-Type", "application/json")
+                if req_headers:
+                    req["headers"] = req_headers
+                depends = [d for d in depends if d in sent]
+                if depends:
+                    req["dependsOn"] = depends
+                payload.append(req)
+                sent.add(req_id)
+
+            # GET만 있는 묶음은 통째로 다시 보내도 안전
+            idempotent = all(req["method"].upper() in IDEMPOTENT_METHODS for req in payload)
+            for attempt in range(GRAPH_MAX_RETRIES + 1):
+                if not payload:
+                    break
+                resp = await self.post("/$batch", token, idempotent=idempotent, json={"requests": payload})
+                if resp.status_code != 200:
+                    for req in payload:
+                        results[req["id"]] = {"status": resp.status_code, "headers": {}, "body": resp.text}
+                    break
+                for item in resp.json().get("responses", []):
+                    results[str(item["id"])] = {
+                        "status": item.get("status"),
+                        "headers": item.get("headers") or {},
+                        "body": item.get("body"),
+                    }
+                if attempt == GRAPH_MAX_RETRIES:
+                    break
+                payload, wait = self._throttled_subrequests(payload, results, attempt)
+                if payload:
+                    self.throttle.note_retry(wait)
+                    await asyncio.sleep(wait)
+        return results
+
+    @staticmethod
+    def _throttled_subrequests(payload, results, attempt):
+        """429를 받은 요청 + 그 때문에 424가 된 요청 → (다시 보낼 목록, 기다릴 시간)."""
+        retry_ids = set()
+        waits = []
+        for req in payload:
+            result = results.get(req["id"], {})
+            if result.get("status") == 429:
+                retry_ids.add(req["id"])
+                waits.append(retry_after_seconds(result.get("headers")))
+            elif result.get("status") == 424 and set(req.get("dependsOn") or []) & retry_ids:
+                retry_ids.add(req["id"])
+        if not retry_ids:
+            return [], 0.0
+        retry = []
+        for req in payload:
+            if req["id"] not in retry_ids:
+                continue
+            req = dict(req)
+            # 이미 성공한 요청에 대한 의존성은 뺀다
+            depends = [d for d in req.pop("dependsOn", []) if d in retry_ids]
+            if depends:
+                req["dependsOn"] = depends
+            retry.append(req)
+        known = [w for w in waits if w is not None]
+        wait = min(GRAPH_RETRY_MAX, max(known)) if known else backoff_delay(attempt)
+        return retry, wait
+
+
+# -------------------------------
+# 앱 공용 인스턴스 (lifespan에서 열고 닫음)
+# -------------------------------
+_graph_client = None
+
+
+def get_graph_client():
+    global _graph_client
+    if _graph_client is None:
+        _graph_client = GraphWorkbookClient()
+    return _graph_client
+
+
+async def close_graph_client():
+    global _graph_client
+    if _graph_client is not None:
+        await _graph_client.aclose()
+        _graph_client = None
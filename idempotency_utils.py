@@ -0,0 +1,168 @@
+import os
+import json
+import time
+import asyncio
+import hashlib
+import sqlite3
+from contextlib import closing
+
+# 재시도된 POST(같은 Idempotency-Key)에 처음 응답을 그대로 돌려주기 위한 저장소 (SQLite, 워커 공유)
+IDEMPOTENCY_PATH = os.getenv("IDEMPOTENCY_PATH", "idempotency.sqlite3")
+# 저장한 응답 유지 시간(초) / 최대 보관 개수 (넘으면 오래된 것부터 지움)
+IDEMPOTENCY_TTL = float(os.getenv("IDEMPOTENCY_TTL", "86400"))
+IDEMPOTENCY_MAX_ENTRIES = int(os.getenv("IDEMPOTENCY_MAX_ENTRIES", "50000"))
+# 같은 키가 처리 중이면 결과를 기다리는 최대 시간(초) → 넘으면 409
+IDEMPOTENCY_WAIT = float(os.getenv("IDEMPOTENCY_WAIT", "60"))
+# 처리 중 표시가 이 시간(초)보다 오래되면 처리하던 프로세스가 죽은 것으로 보고 새로 처리
+IDEMPOTENCY_LEASE = float(os.getenv("IDEMPOTENCY_LEASE", "180"))
+# 다른 워커 프로세스가 처리 중일 때 결과 확인 주기(초)
+IDEMPOTENCY_POLL = float(os.getenv("IDEMPOTENCY_POLL", "0.2"))
+
+STATE_NEW = "new"          # 처음 보는 키 → 이 요청이 처리
+STATE_DONE = "done"        # 저장된 응답 있음 → 그대로 돌려줌
+STATE_INFLIGHT = "inflight"  # 다른 요청이 처리 중 (기다려도 안 끝남)
+
+
+def request_key(*parts):
+    """헤더가 없을 때 쓰는 키: 요청 내용(qr_text, 송장번호, 이미지 해시 등)의 해시."""
+    return hashlib.sha256("|".join(str(p) for p in parts).encode("utf-8")).hexdigest()
+
+
+class IdempotencyStore:
+    """
+    key → 처음 처리한 요청의 (status, body).
+    - acquire: 처음이면 처리 중 표시 후 STATE_NEW, 저장된 응답이 있으면 STATE_DONE,
+      다른 요청이 처리 중이면 끝날 때까지 기다렸다가 그 결과 (같은 프로세스는 이벤트로 바로, 다른 워커는 polling)
+    - finish: 성공 등 다시 보내도 같은 결과여야 하는 응답만 저장, 일시적 실패는 지워서 재시도가 다시 처리하게
+    """
+
+    def __init__(self, path=IDEMPOTENCY_PATH, ttl=IDEMPOTENCY_TTL, max_entries=IDEMPOTENCY_MAX_ENTRIES):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._events = {}  # 이 프로세스에서 처리 중인 key → asyncio.Event
+        self._writes = 0
+        self.counters = {"new": 0, "replayed": 0, "waited": 0, "wait_timeouts": 0, "stored": 0, "released": 0}
+        with closing(self._connect()) as db:
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS idempotency ("
+                " key TEXT PRIMARY KEY,"
+                " state TEXT NOT NULL,"
+                " status INTEGER,"
+                " body TEXT,"
+                " lease_until REAL NOT NULL DEFAULT 0,"
+                " expires_at REAL NOT NULL)"
+            )
+            db.execute("CREATE INDEX IF NOT EXISTS idempotency_expires ON idempotency (expires_at)")
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30, isolation_level=None)
+
+    # -------------------------------
+    # 동기 (SQLite)
+    # -------------------------------
+    def begin(self, key):
+        """→ (STATE_NEW, None) / (STATE_DONE, (status, body)) / (STATE_INFLIGHT, None)"""
+        now = time.time()
+        db = self._connect()
+        try:
+            db.execute("BEGIN IMMEDIATE")
+            row = db.execute(
+                "SELECT state, status, body, lease_until, expires_at FROM idempotency WHERE key = ?", (key,)
+            ).fetchone()
+            if row and row[4] > now:
+                state, status, body, lease_until, _ = row
+                if state == STATE_DONE:
+                    db.execute("ROLLBACK")
+                    return STATE_DONE, (status, json.loads(body))
+                if lease_until > now:
+                    db.execute("ROLLBACK")
+                    return STATE_INFLIGHT, None
+            # 처음이거나, 만료됐거나, 처리하던 쪽이 사라짐 → 이 요청이 맡는다
+            db.execute(
+                "INSERT OR REPLACE INTO idempotency (key, state, status, body, lease_until, expires_at)"
+                " VALUES (?, ?, NULL, NULL, ?, ?)",
+                (key, STATE_INFLIGHT, now + IDEMPOTENCY_LEASE, now + self.ttl),
+            )
+            db.execute("COMMIT")
+            return STATE_NEW, None
+        finally:
+            db.close()
+
+    def complete(self, key, status, body):
+        with closing(self._connect()) as db:
+            db.execute(
+                "UPDATE idempotency SET state = ?, status = ?, body = ?, lease_until = 0, expires_at = ?"
+                " WHERE key = ?",
+                (STATE_DONE, status, json.dumps(body, ensure_ascii=False), time.time() + self.ttl, key),
+            )
+        self._writes += 1
+        if self._writes % 200 == 0:
+            self.purge()
+
+    def release(self, key):
+        with closing(self._connect()) as db:
+            db.execute("DELETE FROM idempotency WHERE key = ? AND state = ?", (key, STATE_INFLIGHT))
+
+    def purge(self):
+        """만료된 항목 삭제 + 최대 개수 넘으면 오래된(만료가 가까운) 것부터."""
+        with closing(self._connect()) as db:
+            removed = db.execute("DELETE FROM idempotency WHERE expires_at <= ?", (time.time(),)).rowcount
+            removed += db.execute(
+                "DELETE FROM idempotency WHERE key IN ("
+                " SELECT key FROM idempotency WHERE state = ? ORDER BY expires_at DESC LIMIT -1 OFFSET ?)",
+                (STATE_DONE, self.max_entries),
+            ).rowcount
+        return removed
+
+    # -------------------------------
+    # async (엔드포인트에서)
+    # -------------------------------
+    async def acquire(self, key, wait=IDEMPOTENCY_WAIT):
+        """begin + 처리 중이면 최대 wait 초 기다림. 기다려도 안 끝나면 (STATE_INFLIGHT, None)."""
+        state, stored = await asyncio.to_thread(self.begin, key)
+        if state == STATE_INFLIGHT:
+            self.counters["waited"] += 1
+            deadline = time.monotonic() + wait
+            while state == STATE_INFLIGHT and time.monotonic() < deadline:
+                event = self._events.get(key)
+                remaining = max(0.0, deadline - time.monotonic())
+                if event is not None:
+                    try:
+                        await asyncio.wait_for(event.wait(), timeout=min(remaining, 1.0))
+                    except asyncio.TimeoutError:
+                        pass
+                else:
+                    await asyncio.sleep(min(remaining, IDEMPOTENCY_POLL))
+                state, stored = await asyncio.to_thread(self.begin, key)
+            if state == STATE_INFLIGHT:
+                self.counters["wait_timeouts"] += 1
+        if state == STATE_NEW:
+            self.counters["new"] += 1
+            self._events[key] = asyncio.Event()
+        elif state == STATE_DONE:
+            self.counters["replayed"] += 1
+        return state, stored
+
+    async def finish(self, key, status, body, store):
+        """store=True 면 응답 저장, 아니면 처리 중 표시만 지움 → 기다리던 요청은 직접 처리."""
+        try:
+            if store:
+                await asyncio.to_thread(self.complete, key, status, body)
+                self.counters["stored"] += 1
+            else:
+                await asyncio.to_thread(self.release, key)
+                self.counters["released"] += 1
+        finally:
+            event = self._events.pop(key, None)
+            if event is not None:
+                event.set()
+
+    def stats(self):
+        with closing(self._connect()) as db:
+            counts = dict(db.execute("SELECT state, COUNT(*) FROM idempotency GROUP BY state").fetchall())
+        return {**self.counters, "entries": counts, "inflight_here": len(self._events)}
+
+
+idempotency_store = IdempotencyStore()
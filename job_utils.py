@@ -0,0 +1,286 @@
+import os
+import json
+import time
+import uuid
+import random
+import asyncio
+import sqlite3
+from contextlib import closing
+
+# 비동기 처리(/process-ocr/async) 작업 큐 (SQLite). 재시작해도 남은 작업을 이어서 처리한다.
+JOB_QUEUE_PATH = os.getenv("JOB_QUEUE_PATH", "job_queue.sqlite3")
+# 작업 처리 동시 개수 (0 → OCR 워커 수)
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "0"))
+# 한 단계(OCR / 쓰기) 최대 시도 횟수 → 넘으면 failed
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "8"))
+# 재시도 간격(초): base × 2^(시도-1), 최대 max, ±20% jitter
+JOB_RETRY_BASE = float(os.getenv("JOB_RETRY_BASE", "2"))
+JOB_RETRY_MAX = float(os.getenv("JOB_RETRY_MAX", "300"))
+# 작업을 가져간 워커가 죽었을 때 다른 워커가 다시 가져가기까지(초)
+JOB_LEASE = float(os.getenv("JOB_LEASE", "120"))
+# 할 일이 없을 때 큐 확인 주기(초) / 끝난 작업 보관 기간(초)
+JOB_POLL = float(os.getenv("JOB_POLL", "1"))
+JOB_RETENTION = float(os.getenv("JOB_RETENTION", str(7 * 86400)))
+# 종료 시 처리 중인 작업을 기다리는 시간(초). 넘으면 취소 → 재시작 후 lease 만료 뒤 다시 처리
+JOB_SHUTDOWN_GRACE = float(os.getenv("JOB_SHUTDOWN_GRACE", "10"))
+
+# 상태: ocr(OCR 대기) → write(엑셀 쓰기 대기) → done / failed
+STATE_OCR = "ocr"
+STATE_WRITE = "write"
+STATE_DONE = "done"
+STATE_FAILED = "failed"
+
+
+class JobRetry(Exception):
+    """일시적 실패 → backoff 후 같은 단계 재시도."""
+
+
+class JobFailed(Exception):
+    """재시도해도 소용없는 실패 → 바로 failed."""
+
+
+class JobQueue:
+    """
+    OCR + 쓰기 작업을 SQLite에 남겨 두는 큐.
+    claim은 BEGIN IMMEDIATE로 처리 → 여러 uvicorn 워커가 같은 작업을 동시에 가져가지 않는다.
+    가져간 작업에는 lease(만료 시각)를 두어, 처리하던 프로세스가 죽으면 다른 워커가 이어받는다.
+    """
+
+    def __init__(self, path=JOB_QUEUE_PATH, max_attempts=JOB_MAX_ATTEMPTS, lease=JOB_LEASE):
+        self.path = path
+        self.max_attempts = max_attempts
+        self.lease = lease
+        with closing(self._connect()) as db:
+            # 이미지 BLOB을 쓰는 동안에도 /jobs 조회가 막히지 않게 WAL
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                " id TEXT PRIMARY KEY,"
+                " state TEXT NOT NULL,"
+                " qr_text TEXT NOT NULL,"
+                " image BLOB,"
+                " entry TEXT,"
+                " result TEXT,"
+                " error TEXT,"
+                " attempts INTEGER NOT NULL DEFAULT 0,"
+                " next_at REAL NOT NULL,"
+                " lease_until REAL NOT NULL DEFAULT 0,"
+                " created_at REAL NOT NULL,"
+                " updated_at REAL NOT NULL)"
+            )
+            db.execute("CREATE INDEX IF NOT EXISTS jobs_pending ON jobs (state, next_at)")
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30, isolation_level=None)
+
+    def submit(self, qr_text, image):
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with closing(self._connect()) as db:
+            db.execute(
+                "INSERT INTO jobs (id, state, qr_text, image, next_at, created_at, updated_at)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (job_id, STATE_OCR, qr_text, image, now, now, now),
+            )
+        return job_id
+
+    def claim(self):
+        """
+        처리할 작업 하나를 가져온다 (없으면 None).
+        시도 횟수는 가져갈 때 올린다 → 처리 중 프로세스가 계속 죽는 작업도 결국 failed.
+        """
+        now = time.time()
+        db = self._connect()
+        try:
+            db.execute("BEGIN IMMEDIATE")
+            row = db.execute(
+                "SELECT id, state, qr_text, image, entry, attempts FROM jobs"
+                " WHERE state IN (?, ?) AND next_at <= ? AND lease_until <= ?"
+                " ORDER BY next_at LIMIT 1",
+                (STATE_OCR, STATE_WRITE, now, now),
+            ).fetchone()
+            if row is None:
+                db.execute("ROLLBACK")
+                return None
+            db.execute(
+                "UPDATE jobs SET attempts = attempts + 1, lease_until = ?, updated_at = ? WHERE id = ?",
+                (now + self.lease, now, row[0]),
+            )
+            db.execute("COMMIT")
+        finally:
+            db.close()
+        job_id, state, qr_text, image, entry, attempts = row
+        return {
+            "id": job_id,
+            "state": state,
+            "qr_text": qr_text,
+            "image": image,
+            "entry": json.loads(entry) if entry else None,
+            "attempts": attempts + 1,
+        }
+
+    def ocr_done(self, job_id, entry):
+        """OCR 결과 저장 → 쓰기 단계로. 이미지는 더 필요 없으므로 지운다."""
+        self._update(
+            job_id,
+            state=STATE_WRITE, entry=json.dumps(entry, ensure_ascii=False),
+            image=None, error=None, attempts=0, next_at=time.time(), lease_until=0,
+        )
+
+    def write_done(self, job_id, result):
+        self._update(
+            job_id,
+            state=STATE_DONE, result=json.dumps(result, ensure_ascii=False), error=None, lease_until=0,
+        )
+
+    def fail(self, job_id, error):
+        self._update(job_id, state=STATE_FAILED, image=None, error=str(error), lease_until=0)
+
+    def retry(self, job_id, attempts, error):
+        """backoff 후 같은 단계 재시도. 최대 시도 횟수를 넘으면 failed."""
+        if attempts >= self.max_attempts:
+            self.fail(job_id, error)
+            return None
+        delay = min(JOB_RETRY_MAX, JOB_RETRY_BASE * 2 ** (attempts - 1)) * random.uniform(0.8, 1.2)
+        self._update(job_id, error=str(error), next_at=time.time() + delay, lease_until=0)
+        return delay
+
+    def get(self, job_id):
+        with closing(self._connect()) as db:
+            row = db.execute(
+                "SELECT id, state, entry, result, error, attempts, next_at, created_at, updated_at"
+                " FROM jobs WHERE id = ?",
+                (job_id,),
+            ).fetchone()
+        if row is None:
+            return None
+        job_id, state, entry, result, error, attempts, next_at, created_at, updated_at = row
+        return {
+            "job_id": job_id,
+            "status": state,
+            "data": json.loads(entry) if entry else None,
+            "write_info": json.loads(result) if result else None,
+            "error": error,
+            "attempts": attempts,
+            "next_attempt_at": next_at if state in (STATE_OCR, STATE_WRITE) else None,
+            "created_at": created_at,
+            "updated_at": updated_at,
+        }
+
+    def stats(self):
+        with closing(self._connect()) as db:
+            counts = dict(db.execute("SELECT state, COUNT(*) FROM jobs GROUP BY state").fetchall())
+        return {state: counts.get(state, 0) for state in (STATE_OCR, STATE_WRITE, STATE_DONE, STATE_FAILED)}
+
+    def purge(self, older_than=JOB_RETENTION):
+        """끝난(done/failed) 작업 중 오래된 것 삭제."""
+        with closing(self._connect()) as db:
+            return db.execute(
+                "DELETE FROM jobs WHERE state IN (?, ?) AND updated_at < ?",
+                (STATE_DONE, STATE_FAILED, time.time() - older_than),
+            ).rowcount
+
+    def _update(self, job_id, **fields):
+        fields["updated_at"] = time.time()
+        columns = ", ".join(f"{name} = ?" for name in fields)
+        with closing(self._connect()) as db:
+            db.execute(f"UPDATE jobs SET {columns} WHERE id = ?", (*fields.values(), job_id))
+
+
+class JobRunner:
+    """
+    큐를 비우는 백그라운드 작업자 (lifespan에서 시작/종료).
+    run_ocr(qr_text, image) → entry, run_write(entry) → write 결과.
+    둘 다 JobRetry(일시적) / JobFailed(영구) 로 실패를 알린다. 그 밖의 예외는 재시도.
+    """
+
+    def __init__(self, queue, run_ocr, run_write, workers=JOB_WORKERS, poll=JOB_POLL):
+        self.queue = queue
+        self.run_ocr = run_ocr
+        self.run_write = run_write
+        self.workers = workers
+        self.poll = poll
+        self._tasks = []
+        self._wake = None
+        self._stopping = False
+        self._last_purge = 0.0
+
+    def start(self, workers=None):
+        if self._tasks:
+            return
+        self._stopping = False
+        self._wake = asyncio.Event()
+        count = max(1, workers or self.workers or 1)
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(count)]
+
+    def notify(self):
+        """새 작업이 들어왔음 → 대기 중인 워커를 바로 깨운다."""
+        if self._wake is not None:
+            self._wake.set()
+
+    async def close(self, grace=JOB_SHUTDOWN_GRACE):
+        """처리 중인 작업은 grace 초까지 기다리고, 남으면 취소 (lease 만료 후 재처리)."""
+        if not self._tasks:
+            return
+        self._stopping = True
+        self.notify()
+        _, pending = await asyncio.wait(self._tasks, timeout=grace)
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def _worker(self):
+        while not self._stopping:
+            # claim 전에 clear → claim과 대기 사이에 들어온 notify도 놓치지 않는다
+            self._wake.clear()
+            try:
+                job = await asyncio.to_thread(self.queue.claim)
+            except sqlite3.Error as e:
+                print("[Job] 큐 읽기 실패:", repr(e))
+                job = None
+            if job is None:
+                await self._maybe_purge()
+                try:
+                    await asyncio.wait_for(self._wake.wait(), timeout=self.poll)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            await self._process(job)
+
+    async def _process(self, job):
+        job_id, attempts = job["id"], job["attempts"]
+        try:
+            if job["state"] == STATE_OCR:
+                entry = await self.run_ocr(job["qr_text"], job["image"])
+                await asyncio.to_thread(self.queue.ocr_done, job_id, entry)
+                # 같은 워커가 바로 쓰기까지 (다른 워커가 먼저 가져가도 무방)
+                self.notify()
+            else:
+                result = await self.run_write(job["entry"])
+                await asyncio.to_thread(self.queue.write_done, job_id, result)
+        except JobFailed as e:
+            print(f"[Job] {job_id} 실패:", e)
+            await asyncio.to_thread(self.queue.fail, job_id, e)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            delay = await asyncio.to_thread(
+                self.queue.retry, job_id, attempts, e if isinstance(e, JobRetry) else repr(e))
+            if delay is None:
+                print(f"[Job] {job_id} {job['state']} {attempts}회 실패 → failed:", e)
+            else:
+                print(f"[Job] {job_id} {job['state']} 실패 → {delay:.1f}초 후 재시도 ({attempts}/{self.queue.max_attempts}):", e)
+
+    async def _maybe_purge(self):
+        now = time.time()
+        if now - self._last_purge < 3600:
+            return
+        self._last_purge = now
+        try:
+            removed = await asyncio.to_thread(self.queue.purge)
+        except sqlite3.Error as e:
+            print("[Job] 오래된 작업 정리 실패:", repr(e))
+            return
+        if removed:
+            print(f"[Job] 오래된 작업 {removed}건 정리")
@@ -0,0 +1,198 @@
+import os
+import time
+import threading
+import contextvars
+
+# 끄면 stage()는 아무것도 하지 않는 공용 객체를 돌려주고 미들웨어도 붙지 않는다
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1") == "1"
+# 히스토그램 구간(초)
+METRICS_BUCKETS = tuple(
+    float(b) for b in os.getenv(
+        "METRICS_BUCKETS", "0.005,0.01,0.025,0.05,0.1,0.25,0.5,1,2.5,5,10,30"
+    ).split(",")
+)
+
+# OCR 워커가 돌려주는 timings 중 시간이 아닌 값
+_NON_STAGE_KEYS = {"cache", "skew_angle", "ocr_pixels"}
+
+# 요청 하나 동안 모은 단계별 시간 [(stage, 초)] → Server-Timing 헤더
+_spans = contextvars.ContextVar("metrics_spans", default=None)
+
+
+class Histogram:
+    """Prometheus 히스토그램 (라벨별 누적 bucket / sum / count). 외부 라이브러리 없이 텍스트 형식만."""
+
+    def __init__(self, name, help_text, labels=(), buckets=METRICS_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}  # 라벨 값 tuple → [bucket별 개수..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, seconds, label_values=()):
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    series[i] += 1
+            series[-2] += seconds
+            series[-1] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = sorted(self._series.items())
+            items = [(k, list(v)) for k, v in items]
+        for label_values, series in items:
+            base = [f'{k}="{_escape(v)}"' for k, v in zip(self.labels, label_values)]
+            bounds = [f"{bound:g}" for bound in self.buckets] + ["+Inf"]
+            counts = series[:len(self.buckets)] + [series[-1]]
+            for bound, count in zip(bounds, counts):
+                labels = ",".join(base + ['le="%s"' % bound])
+                lines.append(f"{self.name}_bucket{{{labels}}} {count}")
+            suffix = "{%s}" % ",".join(base) if base else ""
+            lines.append(f"{self.name}_sum{suffix} {series[-2]:.6f}")
+            lines.append(f"{self.name}_count{suffix} {series[-1]}")
+        return "\n".join(lines)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+stage_seconds = Histogram(
+    "rentlabel_stage_duration_seconds",
+    "Time spent per processing stage (upload, decode, tesseract, token, search, usedRange, patch, ...)",
+    labels=("stage",),
+)
+request_seconds = Histogram(
+    "rentlabel_http_request_duration_seconds",
+    "HTTP request duration by route and status",
+    labels=("method", "route", "status"),
+)
+REGISTRY = [stage_seconds, request_seconds]
+
+
+def render():
+    return "\n".join(h.render() for h in REGISTRY) + "\n"
+
+
+# -------------------------------
+# 단계 기록
+# -------------------------------
+class _Stage:
+    __slots__ = ("name", "start")
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        record(self.name, time.perf_counter() - self.start)
+        return False
+
+
+class _NoStage:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NO_STAGE = _NoStage()
+
+
+def stage(name):
+    """with stage("patch"): ...  → 히스토그램 + (요청 안이면) Server-Timing 에 기록."""
+    return _Stage(name) if METRICS_ENABLED else _NO_STAGE
+
+
+def record(name, seconds):
+    if not METRICS_ENABLED:
+        return
+    stage_seconds.observe(seconds, (name,))
+    spans = _spans.get()
+    if spans is not None:
+        spans.append((name, seconds))
+
+
+def record_timings(timings):
+    """OCR 워커가 채운 timings(ms) → 단계 기록 (decode, exif, gray, resize, deskew, threshold, tesseract)."""
+    if not METRICS_ENABLED:
+        return
+    for name, ms in timings.items():
+        if name not in _NON_STAGE_KEYS and isinstance(ms, (int, float)):
+            record(name, ms / 1000)
+
+
+def current_spans():
+    """지금 요청의 기록 목록 (다른 task에서 대신 기록해 줄 때 넘겨준다). 요청 밖이면 None."""
+    return _spans.get()
+
+
+class collect:
+    """
+    with collect() as spans: ...  → 블록 안에서 기록된 단계를 spans 에 모은다.
+    버퍼 flush처럼 요청과 다른 task에서 도는 작업의 시간을 원래 요청들에 나눠 줄 때 사용.
+    """
+
+    def __enter__(self):
+        self.spans = []
+        self._token = _spans.set(self.spans)
+        return self.spans
+
+    def __exit__(self, *exc):
+        _spans.reset(self._token)
+        return False
+
+
+def server_timing(spans, total=None):
+    """[(stage, 초)] → 'upload;dur=1.2, tesseract;dur=830.0, total;dur=900.1' (같은 단계는 합산)"""
+    merged = {}
+    for name, seconds in spans:
+        merged[name] = merged.get(name, 0.0) + seconds
+    parts = [f"{name};dur={seconds * 1000:.1f}" for name, seconds in merged.items()]
+    if total is not None:
+        parts.append(f"total;dur={total * 1000:.1f}")
+    return ", ".join(parts)
+
+
+# -------------------------------
+# ASGI 미들웨어
+# -------------------------------
+class MetricsMiddleware:
+    """요청마다 단계 기록 목록을 열고, 응답 시작 시 Server-Timing 헤더 추가 + 요청 시간 히스토그램."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        spans = []
+        token = _spans.set(spans)
+        start = time.perf_counter()
+        status = 500
+
+        async def send_with_timing(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                header = server_timing(spans, time.perf_counter() - start)
+                message = {**message, "headers": [*message.get("headers", []), (b"server-timing", header.encode())]}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _spans.reset(token)
+            # 경로 그대로 쓰면 /jobs/{id} 같은 곳에서 라벨이 끝없이 늘어난다 → 라우트 템플릿
+            route = getattr(scope.get("route"), "path", "unmatched")
+            request_seconds.observe(time.perf_counter() - start, (scope["method"], route, str(status)))
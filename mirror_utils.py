@@ -0,0 +1,362 @@
+import os
+import io
+import json
+import time
+import asyncio
+import threading
+from collections import Counter
+from contextlib import contextmanager
+
+try:
+    import fcntl  # 여러 uvicorn 워커가 같은 미러 파일을 쓸 때 프로세스 간 잠금
+except ImportError:  # Windows 개발 환경: 프로세스 안 잠금만
+    fcntl = None
+
+# 행 기록 방식: graph(행마다 Graph range PATCH) / mirror(로컬 xlsx에 쌓고 주기적으로 통째 업로드)
+WRITE_MODE = os.getenv("WRITE_MODE", "graph")
+# 로컬 미러 파일 / 업로드 주기(초) / 이만큼 쌓이면 주기 전이라도 업로드
+MIRROR_PATH = os.getenv("MIRROR_PATH", os.path.join("mirror", os.getenv("FILE_NAME", "유축기출고.xlsx")))
+MIRROR_SYNC_INTERVAL = float(os.getenv("MIRROR_SYNC_INTERVAL", "300"))
+MIRROR_SYNC_ROWS = int(os.getenv("MIRROR_SYNC_ROWS", "500"))
+# 저널(jsonl)에 모인 행을 xlsx에 반영하는 주기(초)
+MIRROR_SAVE_INTERVAL = float(os.getenv("MIRROR_SAVE_INTERVAL", "5"))
+# eTag 충돌(다른 사람이 그 사이 파일 수정) 시 병합 후 다시 올리는 최대 횟수
+MIRROR_SYNC_ATTEMPTS = int(os.getenv("MIRROR_SYNC_ATTEMPTS", "3"))
+
+HEADER = ["출고일", "대여자명", "전화번호", "주소", "기기번호", "기종", "송장번호"]
+
+
+class WorkbookMirror:
+    """
+    OneDrive 워크북의 로컬 사본(openpyxl).
+    - append_rows: 행을 저널(jsonl, fsync)에 먼저 남기고 행 번호를 돌려준다 → Graph 호출 없음
+    - materialize: 저널 행을 xlsx에 반영 (파일 잠금 안에서, 원자적 저장)
+    - sync: 업로드 세션으로 xlsx 전체를 올린다.
+        원격 eTag가 지난번 업로드 그대로면 → If-Match 로 교체
+        누가 그 사이 고쳤으면 → 원격 파일을 받아 우리 새 행만 뒤에 붙여(병합) 다시 올림
+    상태(state.json): remote_etag, synced_last_row(원격에 반영된 마지막 행), next_row
+    """
+
+    def __init__(self, path=MIRROR_PATH, sheet_name=None):
+        self.path = path
+        self.sheet_name = sheet_name or os.getenv("WORKSHEET_NAME", "유축기출고")
+        self.journal_path = f"{path}.journal.jsonl"
+        self.state_path = f"{path}.state.json"
+        self.lock_path = f"{path}.lock"
+        self._thread_lock = threading.Lock()
+        self._sync_lock = None
+        self._task = None
+        self._stopping = False
+        self._last_save = 0.0
+        self._last_sync = time.time()
+        self.counters = {"rows": 0, "saves": 0, "syncs": 0, "merges": 0, "conflicts": 0, "sync_failures": 0}
+        self.last_sync_result = None
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    # -------------------------------
+    # 잠금 / 상태
+    # -------------------------------
+    @contextmanager
+    def _locked(self):
+        with self._thread_lock:
+            with open(self.lock_path, "a") as lock_file:
+                if fcntl:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    if fcntl:
+                        fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _read_state(self):
+        try:
+            with open(self.state_path, encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _write_state(self, state):
+        tmp = f"{self.state_path}.{os.getpid()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(state, f)
+        os.replace(tmp, self.state_path)
+
+    def _load(self):
+        from openpyxl import load_workbook  # 미러 모드에서만 필요 → graph 모드 기동 때는 import 안 함
+        wb = load_workbook(self.path)
+        if self.sheet_name not in wb.sheetnames:
+            wb.create_sheet(self.sheet_name).append(HEADER)
+        return wb, wb[self.sheet_name]
+
+    def _save(self, wb):
+        tmp = f"{self.path}.{os.getpid()}.tmp"
+        wb.save(tmp)
+        os.replace(tmp, self.path)
+
+    def _ensure_local(self, state):
+        """로컬 사본이 없으면 헤더만 있는 새 파일 (원격 내용은 첫 sync 때 병합으로 합쳐진다)."""
+        if os.path.exists(self.path):
+            return state
+        from openpyxl import Workbook
+        wb = Workbook()
+        ws = wb.active
+        ws.title = self.sheet_name
+        ws.append(HEADER)
+        self._save(wb)
+        state = {"remote_etag": None, "synced_last_row": 1, "next_row": 2}
+        self._write_state(state)
+        return state
+
+    def _journal_rows(self):
+        try:
+            with open(self.journal_path, encoding="utf-8") as f:
+                return [json.loads(line) for line in f if line.strip()]
+        except OSError:
+            return []
+
+    # -------------------------------
+    # 행 추가 (동기, 버퍼 flush에서 스레드로 호출)
+    # -------------------------------
+    def append_rows(self, rows):
+        """행마다 (ok, info). info의 range는 로컬 미러 기준 (병합 시 원격에서는 뒤로 밀릴 수 있음)."""
+        with self._locked():
+            state = self._ensure_local(self._read_state())
+            first = state.get("next_row", 2)
+            with open(self.journal_path, "a", encoding="utf-8") as f:
+                for row in rows:
+                    f.write(json.dumps(row, ensure_ascii=False) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            state["next_row"] = first + len(rows)
+            self._write_state(state)
+        self.counters["rows"] += len(rows)
+        return [
+            (True, {"range": f"A{n}:G{n}", "mirror": True})
+            for n in range(first, first + len(rows))
+        ]
+
+    def _has_journal(self):
+        try:
+            return os.path.getsize(self.journal_path) > 0
+        except OSError:
+            return False
+
+    def materialize(self):
+        """저널 → xlsx. 반영한 행 수. 지난 저장 뒤 새 행이 없으면 잠금도 파일 읽기도 없이 0."""
+        if not self._has_journal():
+            return 0
+        with self._locked():
+            rows = self._journal_rows()
+            if not rows:
+                return 0
+            state = self._ensure_local(self._read_state())
+            wb, ws = self._load()
+            for row in rows:
+                ws.append(row)
+            self._save(wb)
+            os.remove(self.journal_path)
+            state["next_row"] = ws.max_row + 1
+            self._write_state(state)
+        self.counters["saves"] += 1
+        return len(rows)
+
+    def pending_rows(self):
+        state = self._read_state()
+        return max(0, state.get("next_row", 2) - 1 - state.get("synced_last_row", 1))
+
+    def _snapshot(self):
+        """업로드할 xlsx bytes + 그 안의 마지막 행."""
+        with self._locked():
+            with open(self.path, "rb") as f:
+                data = f.read()
+            from openpyxl import load_workbook
+            wb = load_workbook(io.BytesIO(data), read_only=True)
+            last_row = wb[self.sheet_name].max_row if self.sheet_name in wb.sheetnames else 1
+            wb.close()
+        return data, last_row
+
+    def _merge_remote(self, content):
+        """
+        원격 파일 + (지난 동기화 이후) 우리 새 행 → 새 로컬 사본. 반환: (원격의 마지막 행, 붙인 행 수)
+        이미 원격에 같은 내용의 행이 있으면(결과를 모르는 업로드가 실제로는 성공한 경우) 다시 붙이지 않는다.
+        """
+        with self._locked():
+            state = self._read_state()
+            synced = state.get("synced_last_row", 1)
+            _, local_ws = self._load()
+            ours = [list(r) for r in local_ws.iter_rows(min_row=synced + 1, values_only=True)]
+
+            from openpyxl import load_workbook
+            remote_wb = load_workbook(io.BytesIO(content))
+            if self.sheet_name not in remote_wb.sheetnames:
+                remote_wb.create_sheet(self.sheet_name).append(HEADER)
+            remote_ws = remote_wb[self.sheet_name]
+            remote_last_row = remote_ws.max_row
+            already = Counter(
+                tuple(r) for r in remote_ws.iter_rows(min_row=synced + 1, values_only=True)
+            )
+            added = 0
+            for row in ours:
+                if already[tuple(row)] > 0:
+                    already[tuple(row)] -= 1
+                    continue
+                remote_ws.append(row)
+                added += 1
+            self._save(remote_wb)
+            # 병합 중 들어와 저널에 남은 행은 다음 materialize 때 뒤에 붙는다
+            state["next_row"] = remote_ws.max_row + 1 + len(self._journal_rows())
+            self._write_state(state)
+        self.counters["merges"] += 1
+        return remote_last_row, added
+
+    # 잠금(스레드 lock + flock)은 materialize/병합이 xlsx 전체를 읽고 쓰는 동안 잡혀 있다
+    # → 이벤트 루프에서는 아래 두 함수도 asyncio.to_thread 로
+    def _init_local(self):
+        with self._locked():
+            self._ensure_local(self._read_state())
+
+    def _mark_synced(self, etag, last_row):
+        with self._locked():
+            state = self._read_state()
+            state["remote_etag"] = etag
+            state["synced_last_row"] = last_row
+            self._write_state(state)
+
+    async def bootstrap(self, graph, token):
+        """
+        원격과 한 번도 맞춘 적 없는 사본이면 시작 시 원격 파일을 받아 둔다
+        → 돌려주는 행 번호가 처음부터 원격과 같고, 첫 sync 가 병합 없이 교체로 끝난다.
+        """
+        if self._read_state().get("remote_etag") or not token:
+            return
+        try:
+            meta = await graph.get_drive_item(token)
+            if meta.status_code != 200:
+                return
+            content = await graph.download_item(token, meta.json()["id"])
+            if content.status_code != 200:
+                return
+            await asyncio.to_thread(self._init_local)
+            remote_last_row, _ = await asyncio.to_thread(self._merge_remote, content.content)
+        except Exception as e:
+            print("[Mirror] 원격 파일 받기 실패 → 첫 동기화 때 병합:", repr(e))
+            return
+        await asyncio.to_thread(self._mark_synced, meta.json().get("eTag"), remote_last_row)
+        print(f"[Mirror] 원격 파일 받음 → {self.path} (마지막 행 {remote_last_row})")
+
+    # -------------------------------
+    # OneDrive 동기화
+    # -------------------------------
+    async def sync(self, graph, token, force=False):
+        """로컬 사본을 OneDrive에 올린다. 반환: 결과 dict (status: synced/up_to_date/...)."""
+        if self._sync_lock is None:
+            self._sync_lock = asyncio.Lock()
+        async with self._sync_lock:
+            result = await self._sync(graph, token, force)
+        self.last_sync_result = {**result, "at": time.time()}
+        self._last_sync = time.time()
+        if result["status"] == "synced":
+            self.counters["syncs"] += 1
+        elif result["status"] not in ("up_to_date",):
+            self.counters["sync_failures"] += 1
+            print("[Mirror] 동기화 실패:", result)
+        return result
+
+    async def _sync(self, graph, token, force):
+        await asyncio.to_thread(self.materialize)
+        if not force and self.pending_rows() == 0:
+            return {"status": "up_to_date"}
+        if not token:
+            return {"status": "failed", "error": "no_access_token"}
+
+        for _ in range(MIRROR_SYNC_ATTEMPTS):
+            state = self._read_state()
+            meta = await graph.get_drive_item(token)
+            if meta.status_code == 200:
+                remote_etag = meta.json().get("eTag")
+            elif meta.status_code == 404:
+                remote_etag = None
+            else:
+                return {"status": "failed", "error": "item_lookup_failed", "http_status": meta.status_code}
+
+            if remote_etag and remote_etag != state.get("remote_etag"):
+                content = await graph.download_item(token, meta.json()["id"])
+                if content.status_code != 200:
+                    return {"status": "failed", "error": "download_failed", "http_status": content.status_code}
+                _, added = await asyncio.to_thread(self._merge_remote, content.content)
+                print(f"[Mirror] 원격 파일이 바뀌어 병합 → 새 행 {added}개를 원격 내용 뒤에 붙임")
+
+            data, last_row = await asyncio.to_thread(self._snapshot)
+            resp = await graph.upload_file(token, data, if_match=remote_etag)
+            if resp.status_code == 412:
+                # 올리는 사이 누가 또 고침 → 다시 받아 병합
+                self.counters["conflicts"] += 1
+                continue
+            if resp.status_code not in (200, 201):
+                return {"status": "failed", "error": "upload_failed", "http_status": resp.status_code}
+
+            await asyncio.to_thread(self._mark_synced, resp.json().get("eTag"), last_row)
+            print(f"[Mirror] 업로드 완료 → {graph.file_name} ({len(data)} bytes, 마지막 행 {last_row})")
+            return {"status": "synced", "bytes": len(data), "last_row": last_row}
+        return {"status": "failed", "error": "etag_conflict"}
+
+    # -------------------------------
+    # 백그라운드 (lifespan)
+    # -------------------------------
+    def start(self, graph_fn, token_fn):
+        """
+        graph_fn() → GraphWorkbookClient, token_fn() → access token (async).
+        주기 작업만 시작한다. 원격 파일 받기(bootstrap)는 기동 워밍업 단계에서 (기동을 막지 않게).
+        """
+        self._graph_fn = graph_fn
+        self._token_fn = token_fn
+        self._stopping = False
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def sync_now(self, force=False):
+        return await self.sync(self._graph_fn(), await self._token_fn(), force=force)
+
+    async def _run(self):
+        while not self._stopping:
+            await asyncio.sleep(min(MIRROR_SAVE_INTERVAL, MIRROR_SYNC_INTERVAL))
+            try:
+                if self.pending_rows() >= MIRROR_SYNC_ROWS or (
+                    time.time() - self._last_sync >= MIRROR_SYNC_INTERVAL and self.pending_rows()
+                ):
+                    await self.sync_now()
+                elif time.time() - self._last_save >= MIRROR_SAVE_INTERVAL:
+                    self._last_save = time.time()
+                    await asyncio.to_thread(self.materialize)
+            except Exception as e:
+                print("[Mirror] 백그라운드 작업 예외:", repr(e))
+
+    async def close(self):
+        """종료 시: 루프 정지 → 남은 행 한 번 더 올려 본다 (실패해도 로컬에 남아 다음 기동 때 올라감)."""
+        self._stopping = True
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        try:
+            await self.sync_now()
+        except Exception as e:
+            print("[Mirror] 종료 시 동기화 실패:", repr(e))
+
+    def stats(self):
+        state = self._read_state()
+        return {
+            "mode": WRITE_MODE,
+            "path": self.path,
+            "next_row": state.get("next_row"),
+            "synced_last_row": state.get("synced_last_row"),
+            "pending_rows": self.pending_rows(),
+            "journal_rows": len(self._journal_rows()),
+            **self.counters,
+            "last_sync": self.last_sync_result,
+        }
+
+
+workbook_mirror = WorkbookMirror()
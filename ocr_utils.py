@@ -1,39 +1,888 @@
-from PIL import Image
-import pytesseract
+import io
 import re
+import time
+import json
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 import os
-pytesseract.pytesseract.tesseract_cmd = os.getenv("TESSERACT_CMD", "/usr/bin/tesseract")
 
-def extract_shipping_info(image_path):
-    image = Image.open(image_path)
-    text = pytesseract.image_to_string(image, lang='kor+eng')
+# PIL / pytesseract 는 처음 쓰는 함수 안에서 import (앱 프로세스 기동 시간 단축, OCR 워커는 워밍업 때 로드)
+TESSERACT_CMD = os.getenv("TESSERACT_CMD", "/usr/bin/tesseract")
+# 이미지 한 장 OCR 최대 시간(초). 넘으면 tesseract 프로세스를 종료한다.
+OCR_TIMEOUT = float(os.getenv("OCR_TIMEOUT", "60"))
+# OCR 엔진: pytesseract(이미지마다 tesseract 프로세스 실행) / tesserocr(C API, 모델을 프로세스당 한 번 로드)
+OCR_BACKEND = os.getenv("OCR_BACKEND", "pytesseract")
+OCR_LANG = os.getenv("OCR_LANG", "kor+eng")
 
-    name = None
-    phone = None
-    address = None
-    invoice = None
+# -------------------------------
+# OCR 엔진
+# -------------------------------
+_backend = OCR_BACKEND
+# 템플릿 모드는 필드 스레드 여러 개가 동시에 전환할 수 있으므로 lock
+_backend_lock = threading.Lock()
+# tesserocr API 핸들은 스레드 안전하지 않으므로 스레드마다 (lang, psm) 별로 하나씩 유지
+_tess_local = threading.local()
 
-    lines = text.splitlines()
+
+def _tesserocr_api(lang, psm=None):
+    apis = getattr(_tess_local, "apis", None)
+    if apis is None:
+        apis = _tess_local.apis = {}
+    api = apis.get((lang, psm))
+    if api is None:
+        import tesserocr
+        kwargs = {"lang": lang}
+        if os.getenv("TESSDATA_PREFIX"):
+            kwargs["path"] = os.getenv("TESSDATA_PREFIX")
+        if psm is not None:
+            kwargs["psm"] = psm
+        api = tesserocr.PyTessBaseAPI(**kwargs)  # 여기서 traineddata 로드 (한 번만)
+        apis[(lang, psm)] = api
+    return api
+
+
+def _disable_tesserocr(e, reason="사용 불가"):
+    """tesserocr 실패 → 이 프로세스는 이후 pytesseract (한 번만 전환/출력)."""
+    global _backend
+    with _backend_lock:
+        if _backend == "tesserocr":
+            print(f"[OCR] tesserocr {reason} → pytesseract로 전환:", repr(e))
+            _backend = "pytesseract"
+
+
+def _pytesseract():
+    import pytesseract
+    pytesseract.pytesseract.tesseract_cmd = TESSERACT_CMD
+    return pytesseract
+
+
+def ocr_text(image, lang=OCR_LANG, psm=None, whitelist=None):
+    """
+    OCR 공통 진입점. OCR_BACKEND=tesserocr 이면 상주 엔진, 실패하면 pytesseract로 전환.
+    (tesserocr는 자체 timeout이 없으므로 OCR_TIMEOUT은 pytesseract에만 적용)
+    """
+    if _backend == "tesserocr":
+        try:
+            api = _tesserocr_api(lang, psm)
+            api.SetVariable("tessedit_char_whitelist", whitelist or "")
+            api.SetImage(image)
+            return api.GetUTF8Text()
+        except (ImportError, RuntimeError) as e:
+            _disable_tesserocr(e)
+
+    config = []
+    if psm is not None:
+        config.append(f"--psm {psm}")
+    if whitelist:
+        config.append(f"-c tessedit_char_whitelist={whitelist}")
+    return _pytesseract().image_to_string(image, lang=lang, config=" ".join(config), timeout=OCR_TIMEOUT)
+
+
+def ocr_data(image, lang=OCR_LANG, psm=None, whitelist=None):
+    """
+    단어 단위 결과: [{"text", "conf"(0~100), "left", "top", "width", "height", "line"}]
+    line 은 이미지 안에서의 줄 번호(0부터, 읽는 순서).
+    """
+    if _backend == "tesserocr":
+        try:
+            from tesserocr import RIL, iterate_level
+            api = _tesserocr_api(lang, psm)
+            api.SetVariable("tessedit_char_whitelist", whitelist or "")
+            api.SetImage(image)
+            api.Recognize()
+            words, line = [], -1
+            for it in iterate_level(api.GetIterator(), RIL.WORD):
+                if it.IsAtBeginningOf(RIL.TEXTLINE):
+                    line += 1
+                text = (it.GetUTF8Text(RIL.WORD) or "").strip()
+                box = it.BoundingBox(RIL.WORD)
+                if not text or box is None:
+                    continue
+                x1, y1, x2, y2 = box
+                words.append({
+                    "text": text, "conf": float(it.Confidence(RIL.WORD)),
+                    "left": x1, "top": y1, "width": x2 - x1, "height": y2 - y1, "line": max(line, 0),
+                })
+            return words
+        except (ImportError, RuntimeError) as e:
+            _disable_tesserocr(e)
+
+    config = []
+    if psm is not None:
+        config.append(f"--psm {psm}")
+    if whitelist:
+        config.append(f"-c tessedit_char_whitelist={whitelist}")
+    pytesseract = _pytesseract()
+    data = pytesseract.image_to_data(
+        image, lang=lang, config=" ".join(config), timeout=OCR_TIMEOUT,
+        output_type=pytesseract.Output.DICT,
+    )
+    words, lines = [], {}
+    for i, text in enumerate(data["text"]):
+        text = (text or "").strip()
+        conf = float(data["conf"][i])
+        if not text or conf < 0:
+            continue
+        key = (data["block_num"][i], data["par_num"][i], data["line_num"][i])
+        words.append({
+            "text": text, "conf": conf,
+            "left": data["left"][i], "top": data["top"][i],
+            "width": data["width"][i], "height": data["height"][i],
+            "line": lines.setdefault(key, len(lines)),
+        })
+    return words
+
+
+def warm_ocr_engine(pool_workers=1):
+    """
+    OCR 워커 시작 시 호출: tesserocr면 언어 모델을 미리 올려 둔다.
+    pool_workers: 같은 호스트의 OCR 워커 프로세스 수 (템플릿 필드 스레드 수 계산용)
+    """
+    global _pool_workers
+    _pool_workers = max(1, pool_workers)
+    if _backend == "tesserocr":
+        try:
+            _tesserocr_api(OCR_LANG)
+            if OCR_MODE == "adaptive" or (OCR_MODE == "template" and OCR_TEMPLATE_FALLBACK == "adaptive"):
+                # 필드 재인식용 (언어, psm) 조합도 미리
+                for cfg in _FIELD_OCR.values():
+                    _tesserocr_api(cfg["lang"], cfg["psm"])
+            if OCR_MODE == "template":
+                _tesserocr_api(OCR_LANG, 6)  # 택배사 판별(헤더)
+        except (ImportError, RuntimeError) as e:
+            _disable_tesserocr(e, "초기화 실패")
+    if OCR_MODE == "template":
+        # 필드 스레드를 모두 미리 띄워 각자 핸들 로드 (첫 ROI부터 모델 로드 없이)
+        _start_template_threads()
+
+# -------------------------------
+# 전처리 (Tesseract 전에: 축소 디코딩 → EXIF 회전 → 흑백 → 리사이즈 → 기울기 보정 → 이진화)
+# -------------------------------
+# 사용할 단계 (쉼표 구분, 빈 값이면 전처리 안 함)
+OCR_PREPROCESS = [
+    s.strip() for s in os.getenv("OCR_PREPROCESS", "draft,exif,gray,resize,deskew,threshold").split(",")
+    if s.strip()
+]
+# 목표 해상도: 라벨 긴 변(인치) × DPI 픽셀로 맞춘다 (예: 6인치 × 300dpi = 1800px)
+OCR_TARGET_DPI = int(os.getenv("OCR_TARGET_DPI", "300"))
+OCR_LABEL_INCHES = float(os.getenv("OCR_LABEL_INCHES", "6"))
+# 적응 이진화: 주변 평균(반경 px)보다 offset 이상 어두우면 글자
+OCR_THRESHOLD_RADIUS = int(os.getenv("OCR_THRESHOLD_RADIUS", "15"))
+OCR_THRESHOLD_OFFSET = int(os.getenv("OCR_THRESHOLD_OFFSET", "10"))
+# 기울기 보정 탐색 범위(도)
+OCR_DESKEW_MAX_ANGLE = float(os.getenv("OCR_DESKEW_MAX_ANGLE", "8"))
+
+
+def _target_side():
+    return int(OCR_TARGET_DPI * OCR_LABEL_INCHES)
+
+
+def _projection_score(binary, angle):
+    """회전 후 행별 잉크 양의 분산. 글자 줄이 수평일수록 크다."""
+    from PIL import Image
+    rotated = binary.rotate(angle, resample=Image.BILINEAR, expand=True, fillcolor=0)
+    rows = list(rotated.resize((1, rotated.height), Image.BOX).getdata())
+    mean = sum(rows) / len(rows)
+    return sum((v - mean) ** 2 for v in rows) / len(rows)
+
+
+def estimate_skew(gray, max_angle=OCR_DESKEW_MAX_ANGLE):
+    """작은 사본에서 projection profile로 기울기(도) 추정. 1도 간격 → 주변 0.25도 간격."""
+    small = gray.copy()
+    small.thumbnail((600, 600))
+    # 글자=흰색(255)으로 뒤집어서 회전 시 빈 곳(0)이 점수에 안 들어가게
+    binary = small.point(lambda v: 255 if v < 128 else 0)
+    # 점수가 같으면 0도에 가까운 쪽 (빈 이미지를 괜히 돌리지 않게)
+    score = lambda a: (round(_projection_score(binary, a), 3), -abs(a))
+    coarse = max(range(-int(max_angle), int(max_angle) + 1), key=score)
+    return max((coarse + d / 4 for d in range(-3, 4)), key=score)
+
+
+def adaptive_threshold(gray, radius=OCR_THRESHOLD_RADIUS, offset=OCR_THRESHOLD_OFFSET):
+    """주변 평균 대비 이진화 (조명 얼룩/그림자에 강함). PIL 연산만 사용."""
+    from PIL import ImageChops, ImageFilter
+    mean = gray.filter(ImageFilter.BoxBlur(radius))
+    darker = ImageChops.subtract(mean, gray)  # max(mean - gray, 0)
+    return darker.point(lambda v: 0 if v > offset else 255)
+
+
+def preprocess_image(src, timings=None, steps=None, crop=None, fit_label=False):
+    """
+    src(경로/파일 객체/bytes)를 열어 OCR에 맞게 다듬은 PIL 이미지를 돌려준다.
+    timings dict를 넘기면 단계별 소요 시간(ms)을 채운다.
+    crop: (x0, y0, x1, y1) 정규화 좌표 (EXIF 회전 후 기준) → 그 부분만 (여러 라벨 사진의 라벨 하나)
+    fit_label: 기울기 보정 뒤 라벨 종이 테두리로 잘라낸다 (OCR_MODE=template: 필드 영역 비율이
+               라벨 기준이므로 배경/회전으로 늘어난 캔버스가 남아 있으면 영역이 어긋난다)
+    """
+    from PIL import Image, ImageOps
+    steps = OCR_PREPROCESS if steps is None else steps
+    timings = {} if timings is None else timings
+
+    def _mark(stage, t0):
+        timings[stage] = round((time.perf_counter() - t0) * 1000, 1)
+        return time.perf_counter()
+
+    t = time.perf_counter()
+    if isinstance(src, (bytes, bytearray, memoryview)):
+        src = io.BytesIO(src)  # 업로드 bytes를 복사 없이 감싸서 디코딩
+    image = Image.open(src)
+    target = _target_side()
+
+    # 1) JPEG는 DCT 단계에서 1/2, 1/4, 1/8 로 줄여서 디코딩 (긴 변이 target 이상 남는 선까지)
+    #    crop 이면 잘라낸 부분의 긴 변이 target 이상 남도록 (회전 전이라 짧은 변 기준으로 보수적으로)
+    longest = max(image.size)
+    if crop:
+        longest = max(crop[2] - crop[0], crop[3] - crop[1]) * min(image.size)
+    if "draft" in steps and image.format == "JPEG" and longest > target:
+        scale = target / longest
+        image.draft("L" if "gray" in steps else image.mode,
+                    (int(image.width * scale) + 1, int(image.height * scale) + 1))
+    image.load()
+    t = _mark("decode", t)
+
+    # 2) 폰 사진의 EXIF Orientation 반영
+    if "exif" in steps:
+        image = ImageOps.exif_transpose(image)
+        t = _mark("exif", t)
+
+    if crop:
+        x0, y0, x1, y1 = crop
+        image = image.crop((
+            int(x0 * image.width), int(y0 * image.height),
+            max(int(x0 * image.width) + 1, int(x1 * image.width)),
+            max(int(y0 * image.height) + 1, int(y1 * image.height)),
+        ))
+
+    # 3) 흑백
+    if "gray" in steps and image.mode != "L":
+        image = image.convert("L")
+        t = _mark("gray", t)
+
+    # 4) 목표 DPI 크기로 축소 (확대는 하지 않음)
+    if "resize" in steps and max(image.size) > target:
+        scale = target / max(image.size)
+        image = image.resize((round(image.width * scale), round(image.height * scale)), Image.LANCZOS)
+        t = _mark("resize", t)
+
+    # 5) 기울기 보정 (흑백일 때만)
+    if "deskew" in steps and image.mode == "L":
+        angle = estimate_skew(image)
+        if angle:
+            # fit_label 이면 늘어난 모서리를 검게 → 흰 종이와 붙지 않아 라벨 테두리 찾기에 안 섞인다
+            image = image.rotate(angle, resample=Image.BICUBIC, expand=True, fillcolor=0 if fit_label else 255)
+        timings["skew_angle"] = angle
+        t = _mark("deskew", t)
+
+    # 5-1) 라벨 종이 테두리로 자르기 (템플릿 필드 영역의 기준)
+    if fit_label and image.mode == "L":
+        box = label_bounds(image)
+        if box:
+            image = image.crop(box)
+        timings["label_box"] = list(box) if box else None
+        t = _mark("fit_label", t)
+
+    # 6) 적응 이진화
+    if "threshold" in steps and image.mode == "L":
+        image = adaptive_threshold(image)
+        t = _mark("threshold", t)
+
+    return image
+
+
+# -------------------------------
+# 송장 필드 추출
+# -------------------------------
+# single: 전체 페이지 image_to_string 한 번 / adaptive: 저해상도 image_to_data → 약한 필드만 영역 재인식
+# template: 택배사 판별 → 그 택배사 라벨의 필드 영역만 잘라 인식 (못 읽으면 전체 페이지)
+OCR_MODE = os.getenv("OCR_MODE", "single")
+# adaptive 1차(빠른) 인식 해상도 — OCR_TARGET_DPI 기준으로 이만큼 줄여서
+OCR_FAST_DPI = int(os.getenv("OCR_FAST_DPI", "150"))
+# 이 신뢰도(0~100) 미만인 필드만 2차 인식
+OCR_MIN_CONFIDENCE = float(os.getenv("OCR_MIN_CONFIDENCE", "70"))
+# 필드 영역을 잘라낼 때 주변 여백(원본 px)
+OCR_FIELD_PADDING = int(os.getenv("OCR_FIELD_PADDING", "12"))
+
+PHONE_RE = re.compile(r'01[016789][-\s]?\d{3,4}[-\s]?\d{4}')
+INVOICE_RE = re.compile(r'\b\d{4}[-]?\d{4}[-]?\d{4}\b')
+
+# 필드별 2차 인식 설정: 숫자 필드는 한 줄(psm 7) + 숫자만, 이름/주소는 한국어만
+_FIELD_OCR = {
+    "phone": {"lang": "eng", "psm": 7, "whitelist": "0123456789-"},
+    "invoice": {"lang": "eng", "psm": 7, "whitelist": "0123456789-"},
+    "name": {"lang": "kor", "psm": 7, "whitelist": None},
+    "address": {"lang": "kor", "psm": 7, "whitelist": None},
+}
+
+
+def _clean_phone(text):
+    return text.replace(' ', '').replace('--', '-')
+
+
+def _parse_lines(lines):
+    """줄 목록 → (이름, 전화, 주소, 송장) 원문. 전화번호 줄의 앞/뒤 줄을 이름/주소로 본다."""
+    name = phone = address = invoice = None
     for i, line in enumerate(lines):
         if not phone:
-            m = re.search(r'01[016789][-\s]?\d{3,4}[-\s]?\d{4}', line)
+            m = PHONE_RE.search(line)
             if m:
-                phone = m.group().replace(' ', '').replace('--', '-')
+                phone = _clean_phone(m.group())
                 name = lines[i-1].strip() if i > 0 else None
                 address = lines[i+1].strip() if i+1 < len(lines) else None
         if not invoice:
-            m = re.search(r'\b\d{4}[-]?\d{4}[-]?\d{4}\b', line)
+            m = INVOICE_RE.search(line)
             if m:
                 invoice = m.group().replace('-', '')
+    return name, phone, address, invoice
+
 
+def _result(name, phone, address, invoice):
     return {
         "수취인명": name or "",
         "전화번호": phone or "",
         "주소": address or "",
         "송장번호": invoice or "",
-        "출고일": datetime.now().strftime("%Y-%m-%d"),
+        "출고일": today_str(),
+    }
+
+
+def extract_shipping_info(image_path, timings=None, courier=None, crop=None):
+    """
+    courier: (OCR_MODE=template) 이 기기에서 직전에 인식된 택배사 → 헤더 판별 생략
+    crop: 여러 라벨 사진에서 이 라벨의 영역 (segment_labels 결과 하나)
+    """
+    timings = {} if timings is None else timings
+    image = preprocess_image(image_path, timings, crop=crop, fit_label=OCR_MODE == "template")
+    if OCR_MODE == "template":
+        return _extract_template(image, timings, courier)
+    return _extract_full_page(image, timings)
+
+
+def _extract_full_page(image, timings, mode=None):
+    if (mode or OCR_MODE) == "adaptive":
+        return _extract_adaptive(image, timings)
+    t = time.perf_counter()
+    text = ocr_text(image)
+    timings["tesseract"] = round((time.perf_counter() - t) * 1000, 1)
+    timings["ocr_pixels"] = image.width * image.height
+    return _result(*_parse_lines(text.splitlines()))
+
+
+def _group_lines(words):
+    """단어 → 줄: [{"text", "conf"(단어 최소), "box"(l, t, r, b), "words"}] (읽는 순서)"""
+    lines = {}
+    for w in words:
+        lines.setdefault(w["line"], []).append(w)
+    grouped = []
+    for _, ws in sorted(lines.items()):
+        ws.sort(key=lambda w: w["left"])
+        grouped.append({
+            "text": " ".join(w["text"] for w in ws),
+            "conf": min(w["conf"] for w in ws),
+            "box": (
+                min(w["left"] for w in ws), min(w["top"] for w in ws),
+                max(w["left"] + w["width"] for w in ws), max(w["top"] + w["height"] for w in ws),
+            ),
+            "words": ws,
+        })
+    return grouped
+
+
+def _digits_conf(line):
+    """줄에서 숫자가 든 단어들(전화/송장번호)의 최소 신뢰도 + 그 단어들의 영역."""
+    digits_words = [w for w in line["words"] if any(c.isdigit() for c in w["text"])] or line["words"]
+    box = (
+        min(w["left"] for w in digits_words), min(w["top"] for w in digits_words),
+        max(w["left"] + w["width"] for w in digits_words), max(w["top"] + w["height"] for w in digits_words),
+    )
+    return min(w["conf"] for w in digits_words), box
+
+
+def _locate_fields(lines):
+    """줄 목록 → {필드: {"value", "conf", "box"}} (찾은 필드만). 규칙은 _parse_lines 와 같다."""
+    fields = {}
+    for i, line in enumerate(lines):
+        if "phone" not in fields:
+            m = PHONE_RE.search(line["text"])
+            if m:
+                conf, box = _digits_conf(line)
+                fields["phone"] = {"value": _clean_phone(m.group()), "conf": conf, "box": box}
+                if i > 0:
+                    prev = lines[i-1]
+                    fields["name"] = {"value": prev["text"].strip(), "conf": prev["conf"], "box": prev["box"]}
+                if i + 1 < len(lines):
+                    nxt = lines[i+1]
+                    fields["address"] = {"value": nxt["text"].strip(), "conf": nxt["conf"], "box": nxt["box"]}
+        if "invoice" not in fields:
+            m = INVOICE_RE.search(line["text"])
+            if m:
+                conf, box = _digits_conf(line)
+                fields["invoice"] = {"value": m.group().replace('-', ''), "conf": conf, "box": box}
+    return fields
+
+
+def _refine_field(image, field, box, scale):
+    """약한 필드 하나: 원본 해상도에서 그 영역만 잘라 필드 전용 설정으로 다시 인식. 못 읽으면 None."""
+    l, t, r, b = box
+    pad = OCR_FIELD_PADDING
+    crop = image.crop((
+        max(0, int(l * scale) - pad), max(0, int(t * scale) - pad),
+        min(image.width, int(r * scale) + pad), min(image.height, int(b * scale) + pad),
+    ))
+    return _read_field(crop, field)
+
+
+def _read_field(crop, field, settings=None):
+    """필드 영역 이미지 → 값 (전화/송장은 형식에 맞을 때만). 못 읽으면 None."""
+    text = ocr_text(crop, **(settings or _FIELD_OCR[field])).strip()
+    if field == "phone":
+        m = PHONE_RE.search(text)
+        return _clean_phone(m.group()) if m else None
+    if field == "invoice":
+        m = INVOICE_RE.search(text)
+        return m.group().replace('-', '') if m else None
+    return " ".join(text.split()) or None
+
+
+def _extract_adaptive(image, timings):
+    """
+    1차: 저해상도 image_to_data (단어 신뢰도 포함)
+    전화/송장을 아예 못 찾으면 → 원본 해상도 전체 image_to_data 로 한 번 더 (위치를 알아야 하므로)
+    2차: 못 찾았거나 신뢰도 낮은 필드만 원본 해상도에서 그 영역을 잘라 재인식
+    timings["ocr_tier"]: fast / fields / full
+    """
+    from PIL import Image
+    fast_scale = min(1.0, OCR_FAST_DPI / OCR_TARGET_DPI)
+    small = image if fast_scale >= 1.0 else image.resize(
+        (max(1, round(image.width * fast_scale)), max(1, round(image.height * fast_scale))), Image.BILINEAR
+    )
+    t = time.perf_counter()
+    fields = _locate_fields(_group_lines(ocr_data(small)))
+    timings["tesseract_fast"] = round((time.perf_counter() - t) * 1000, 1)
+    tier = "fast"
+    scale = image.width / small.width
+
+    if "phone" not in fields or "invoice" not in fields:
+        t = time.perf_counter()
+        full = _locate_fields(_group_lines(ocr_data(image)))
+        timings["tesseract_full"] = round((time.perf_counter() - t) * 1000, 1)
+        tier, scale = "full", 1.0
+        # 2차 결과를 기본으로, 2차에서 빠진 필드는 1차 값이라도 (위치는 1차 기준이라 재인식 대상에서 제외)
+        fields = {**{k: {**v, "box": None} for k, v in fields.items()}, **full}
+
+    weak = [
+        name for name, f in fields.items()
+        if f["box"] is not None and (f["conf"] < OCR_MIN_CONFIDENCE or not f["value"])
+    ]
+    if weak:
+        t = time.perf_counter()
+        for name in weak:
+            value = _refine_field(image, name, fields[name]["box"], scale)
+            if value:
+                fields[name]["value"] = value
+        timings["tesseract_fields"] = round((time.perf_counter() - t) * 1000, 1)
+        if tier == "fast":
+            tier = "fields"
+        timings["refined"] = ",".join(weak)
+    timings["ocr_tier"] = tier
+
+    get = lambda name: (fields.get(name) or {}).get("value")
+    return _result(get("name"), get("phone"), get("address"), get("invoice"))
+
+
+# -------------------------------
+# 택배사 라벨 템플릿 (OCR_MODE=template)
+# -------------------------------
+# 필드 영역: 라벨 전체를 (0, 0, 1, 1)로 본 정규화 좌표 (x0, y0, x1, y1).
+# 기본값은 각 사 표준 운송장의 대략적인 배치 → 실제 라벨 사진으로 맞춘 값을 OCR_TEMPLATES_PATH(JSON)로 덮어쓴다.
+COURIER_TEMPLATES = {
+    "cj": {
+        "label": "CJ대한통운",
+        "keywords": ["CJ대한통운", "대한통운", "CJLOGISTICS"],
+        "fields": {
+            "invoice": (0.50, 0.03, 0.98, 0.13),
+            "name": (0.04, 0.30, 0.55, 0.38),
+            "phone": (0.04, 0.37, 0.60, 0.45),
+            "address": (0.04, 0.45, 0.98, 0.60),
+        },
+    },
+    "hanjin": {
+        "label": "한진택배",
+        "keywords": ["한진택배", "한진", "HANJIN"],
+        "fields": {
+            "invoice": (0.45, 0.02, 0.98, 0.12),
+            "name": (0.04, 0.25, 0.55, 0.33),
+            "phone": (0.04, 0.33, 0.60, 0.41),
+            "address": (0.04, 0.41, 0.98, 0.56),
+        },
+    },
+    "lotte": {
+        "label": "롯데택배",
+        "keywords": ["롯데택배", "롯데글로벌로지스", "LOTTE"],
+        "fields": {
+            "invoice": (0.40, 0.03, 0.98, 0.14),
+            "name": (0.04, 0.28, 0.55, 0.36),
+            "phone": (0.04, 0.36, 0.60, 0.44),
+            "address": (0.04, 0.44, 0.98, 0.58),
+        },
+    },
+    "epost": {
+        "label": "우체국택배",
+        "keywords": ["우체국택배", "우체국", "EPOST", "KOREAPOST"],
+        "fields": {
+            "invoice": (0.45, 0.04, 0.98, 0.15),
+            "name": (0.04, 0.32, 0.55, 0.40),
+            "phone": (0.04, 0.40, 0.60, 0.48),
+            "address": (0.04, 0.48, 0.98, 0.63),
+        },
+    },
+}
+OCR_TEMPLATES_PATH = os.getenv("OCR_TEMPLATES_PATH", "")
+if OCR_TEMPLATES_PATH:
+    with open(OCR_TEMPLATES_PATH, encoding="utf-8") as _f:
+        COURIER_TEMPLATES.update(json.load(_f))
+# 택배사 판별에 쓰는 라벨 윗부분(로고/상호) 비율과 판별용 축소 폭(px)
+OCR_TEMPLATE_HEADER = float(os.getenv("OCR_TEMPLATE_HEADER", "0.2"))
+OCR_TEMPLATE_HEADER_WIDTH = int(os.getenv("OCR_TEMPLATE_HEADER_WIDTH", "800"))
+# 필드 영역을 동시에 인식할 스레드 수 (워커 프로세스 하나 안에서).
+# 0 → 코어 수 ÷ OCR 워커 수 (워커가 이미 코어를 다 쓰면 1 → 워커 수 × 스레드가 코어를 넘지 않게)
+OCR_TEMPLATE_THREADS = int(os.getenv("OCR_TEMPLATE_THREADS", "0"))
+# 템플릿으로 전화/송장을 못 읽었을 때 쓰는 전체 페이지 방식 (single / adaptive)
+OCR_TEMPLATE_FALLBACK = os.getenv("OCR_TEMPLATE_FALLBACK", "single")
+
+# 주소는 두 줄일 수 있으므로 블록(psm 6)으로
+_TEMPLATE_FIELD_OCR = {**_FIELD_OCR, "address": {"lang": "kor", "psm": 6, "whitelist": None}}
+_template_threads = None
+_template_threads_lock = threading.Lock()
+_pool_workers = 1  # warm_ocr_engine 이 OCR 워커 프로세스 수로 설정
+
+
+def _cpu_count():
+    try:
+        return len(os.sched_getaffinity(0))  # 컨테이너 CPU 제한 반영
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def _template_thread_count():
+    if OCR_TEMPLATE_THREADS > 0:
+        return OCR_TEMPLATE_THREADS
+    return max(1, _cpu_count() // _pool_workers)
+
+
+def _warm_template_thread():
+    """필드 스레드 initializer: 이 스레드의 tesserocr 핸들을 필드 설정별로 미리 만든다."""
+    if _backend != "tesserocr":
+        return
+    try:
+        for cfg in _TEMPLATE_FIELD_OCR.values():
+            _tesserocr_api(cfg["lang"], cfg["psm"])
+    except (ImportError, RuntimeError) as e:
+        _disable_tesserocr(e, "초기화 실패")
+
+
+def _start_template_threads():
+    """필드 인식 스레드 풀 (처음 한 번). 스레드를 전부 띄워 initializer 워밍업을 끝내 둔다."""
+    global _template_threads
+    with _template_threads_lock:
+        if _template_threads is not None:
+            return _template_threads
+        count = _template_thread_count()
+        pool = ThreadPoolExecutor(max_workers=count, initializer=_warm_template_thread)
+        # 모두 barrier 에서 만날 때까지 막혀 있으므로 submit 마다 새 스레드가 뜬다
+        barrier = threading.Barrier(count)
+        for f in [pool.submit(barrier.wait, OCR_TIMEOUT) for _ in range(count)]:
+            try:
+                f.result()
+            except threading.BrokenBarrierError:
+                pass
+        _template_threads = pool
+        return pool
+
+
+def _normalize_header(text):
+    return re.sub(r"\s+", "", text or "").upper()
+
+
+def detect_courier(image, timings=None):
+    """라벨 윗부분만 작게 OCR → 상호/로고 글자로 택배사 판별. 못 찾으면 None."""
+    from PIL import Image
+    timings = {} if timings is None else timings
+    t = time.perf_counter()
+    header = image.crop((0, 0, image.width, max(1, int(image.height * OCR_TEMPLATE_HEADER))))
+    if header.width > OCR_TEMPLATE_HEADER_WIDTH:
+        scale = OCR_TEMPLATE_HEADER_WIDTH / header.width
+        header = header.resize((OCR_TEMPLATE_HEADER_WIDTH, max(1, round(header.height * scale))), Image.BILINEAR)
+    text = _normalize_header(ocr_text(header, psm=6))
+    timings["tesseract_header"] = round((time.perf_counter() - t) * 1000, 1)
+    timings["ocr_pixels"] = timings.get("ocr_pixels", 0) + header.width * header.height
+    for key, template in COURIER_TEMPLATES.items():
+        if any(_normalize_header(k) in text for k in template.get("keywords", ())):
+            return key
+    return None
+
+
+def _read_template(image, key, timings):
+    """템플릿 필드 영역을 잘라 동시에 인식 → {필드: 값} (읽은 것만)."""
+    threads = _start_template_threads()
+    crops = {}
+    for field, (x0, y0, x1, y1) in COURIER_TEMPLATES[key]["fields"].items():
+        box = (int(x0 * image.width), int(y0 * image.height), int(x1 * image.width), int(y1 * image.height))
+        if box[2] > box[0] and box[3] > box[1]:
+            crops[field] = image.crop(box)
+    t = time.perf_counter()
+    futures = {
+        field: threads.submit(_read_field, crop, field, _TEMPLATE_FIELD_OCR[field])
+        for field, crop in crops.items()
     }
+    values = {field: f.result() for field, f in futures.items()}
+    timings["tesseract_fields"] = round(timings.get("tesseract_fields", 0) + (time.perf_counter() - t) * 1000, 1)
+    timings["ocr_pixels"] = timings.get("ocr_pixels", 0) + sum(c.width * c.height for c in crops.values())
+    return {field: value for field, value in values.items() if value}
+
+
+def _extract_template(image, timings, courier=None):
+    """
+    택배사 판별(직전 결과가 있으면 생략) → 필드 영역만 인식.
+    전화/송장을 못 읽으면: 직전 결과로 시작했던 경우 다시 판별해 한 번 더 → 그래도 안 되면 전체 페이지.
+    timings["courier"]: 템플릿으로 읽어 낸 택배사 (호출 측이 기기별로 기억) / 실패면 ""
+    """
+    complete = lambda f: "phone" in f and "invoice" in f
+    key = courier if courier in COURIER_TEMPLATES else None
+    hinted = key is not None
+    if key is None:
+        key = detect_courier(image, timings)
+    fields = _read_template(image, key, timings) if key else {}
+    if hinted and not complete(fields):
+        detected = detect_courier(image, timings)
+        if detected and detected != key:
+            key = detected
+            fields = _read_template(image, key, timings)
+
+    if complete(fields):
+        timings["courier"] = key
+        timings["ocr_tier"] = "template"
+        return _result(fields.get("name"), fields.get("phone"), fields.get("address"), fields.get("invoice"))
+
+    # 전체 페이지: 템플릿으로 읽은 값은 전체 페이지에서 못 찾은 필드에만
+    timings["courier"] = ""
+    full_timings = {}
+    full = _extract_full_page(image, full_timings, OCR_TEMPLATE_FALLBACK)
+    for name, value in full_timings.items():
+        timings[name] = timings.get(name, 0) + value if name == "ocr_pixels" else value
+    timings["ocr_tier"] = "template+full" if key else "full"
+    merged = {
+        "name": full["수취인명"] or fields.get("name"),
+        "phone": full["전화번호"] or fields.get("phone"),
+        "address": full["주소"] or fields.get("address"),
+        "invoice": full["송장번호"] or fields.get("invoice"),
+    }
+    return _result(merged["name"], merged["phone"], merged["address"], merged["invoice"])
+
+
+def templates_fingerprint():
+    return hashlib.sha256(json.dumps(COURIER_TEMPLATES, sort_keys=True).encode()).hexdigest()[:12]
+
+
+
+# -------------------------------
+# 한 사진에 라벨 여러 장 (밝은 사각형 찾기)
+# -------------------------------
+# 찾기용 축소 크기(긴 변 px) / 라벨로 볼 최소 면적(사진 대비) / 사각형다움(영역 안 밝은 픽셀 비율)
+OCR_SEGMENT_SIDE = int(os.getenv("OCR_SEGMENT_SIDE", "400"))
+OCR_SEGMENT_MIN_AREA = float(os.getenv("OCR_SEGMENT_MIN_AREA", "0.02"))
+OCR_SEGMENT_MIN_FILL = float(os.getenv("OCR_SEGMENT_MIN_FILL", "0.6"))
+OCR_SEGMENT_MAX_LABELS = int(os.getenv("OCR_SEGMENT_MAX_LABELS", "12"))
+# 라벨(흰 종이) 밝기 기준. 0 → 사진마다 Otsu 로 자동
+OCR_SEGMENT_BRIGHTNESS = int(os.getenv("OCR_SEGMENT_BRIGHTNESS", "0"))
+# 잘라낼 때 사방 여백(라벨 크기 대비)
+OCR_SEGMENT_PADDING = float(os.getenv("OCR_SEGMENT_PADDING", "0.02"))
+
+
+def _otsu(gray):
+    hist = gray.histogram()[:256]
+    total = sum(hist)
+    sum_all = sum(i * h for i, h in enumerate(hist))
+    best, best_var, weight_bg, sum_bg = 128, -1.0, 0, 0.0
+    for i, h in enumerate(hist):
+        weight_bg += h
+        if weight_bg == 0 or weight_bg == total:
+            continue
+        sum_bg += i * h
+        mean_bg = sum_bg / weight_bg
+        mean_fg = (sum_all - sum_bg) / (total - weight_bg)
+        var = weight_bg * (total - weight_bg) * (mean_bg - mean_fg) ** 2
+        if var > best_var:
+            best, best_var = i, var
+    return best
+
+
+def _components(mask, width, height):
+    """밝은 픽셀(255) 4-연결 덩어리 → [(left, top, right, bottom, 픽셀 수)]"""
+    pixels = bytearray(1 if v else 0 for v in mask.getdata())
+    boxes = []
+    for start in range(len(pixels)):
+        if not pixels[start]:
+            continue
+        pixels[start] = 0
+        stack = [start]
+        left, top, right, bottom, count = width, height, 0, 0, 0
+        while stack:
+            i = stack.pop()
+            y, x = divmod(i, width)
+            count += 1
+            left, right = min(left, x), max(right, x)
+            top, bottom = min(top, y), max(bottom, y)
+            for j in (i - width, i + width) + ((i - 1,) if x else ()) + ((i + 1,) if x + 1 < width else ()):
+                if 0 <= j < len(pixels) and pixels[j]:
+                    pixels[j] = 0
+                    stack.append(j)
+        boxes.append((left, top, right + 1, bottom + 1, count))
+    return boxes
+
+
+def _reading_order(boxes):
+    """위 → 아래 줄, 줄 안에서는 왼쪽 → 오른쪽 (사진 속 상자 순서대로 QR 을 찍는다고 보고)."""
+    if not boxes:
+        return []
+    heights = sorted(b[3] - b[1] for b in boxes)
+    band = max(heights[len(heights) // 2] / 2, 1e-6)
+    rows = []
+    for box in sorted(boxes, key=lambda b: (b[1] + b[3]) / 2):
+        cy = (box[1] + box[3]) / 2
+        if rows and abs(cy - rows[-1][0]) <= band:
+            rows[-1][1].append(box)
+        else:
+            rows.append([cy, [box]])
+    return [box for _, row in rows for box in sorted(row, key=lambda b: b[0])]
+
+
+def _paper_boxes(small):
+    """축소 흑백 사본 → 라벨(밝은 사각형 종이)로 볼 만한 덩어리들 [(left, top, right, bottom)] px."""
+    from PIL import ImageFilter
+    width, height = small.size
+    level = OCR_SEGMENT_BRIGHTNESS or _otsu(small)
+    mask = small.point(lambda v: 255 if v > level else 0)
+    # 닫기: 글자(어두운 점)를 메워 라벨 하나가 한 덩어리가 되게 / 열기: 라벨끼리 가는 밝은 띠로 붙은 것 떼기
+    mask = mask.filter(ImageFilter.MaxFilter(5)).filter(ImageFilter.MinFilter(5))
+    mask = mask.filter(ImageFilter.MinFilter(3)).filter(ImageFilter.MaxFilter(3))
+
+    min_area = OCR_SEGMENT_MIN_AREA * width * height
+    boxes = []
+    for left, top, right, bottom, count in _components(mask, width, height):
+        area = (right - left) * (bottom - top)
+        if area < min_area or count / area < OCR_SEGMENT_MIN_FILL:
+            continue
+        boxes.append((left, top, right, bottom))
+    return boxes
+
+
+def label_bounds(gray):
+    """
+    흑백 이미지 속 가장 큰 라벨 종이의 (left, top, right, bottom) px (OCR_MODE=template 기준 틀).
+    못 찾거나 이미 이미지 거의 전체면 None (자를 필요 없음).
+    """
+    small = gray.copy()
+    small.thumbnail((OCR_SEGMENT_SIDE, OCR_SEGMENT_SIDE))
+    boxes = _paper_boxes(small)
+    if not boxes:
+        return None
+    left, top, right, bottom = max(boxes, key=lambda b: (b[2] - b[0]) * (b[3] - b[1]))
+    if (right - left) * (bottom - top) > 0.95 * small.width * small.height:
+        return None
+    sx, sy = gray.width / small.width, gray.height / small.height
+    return (
+        max(0, int(left * sx)), max(0, int(top * sy)),
+        min(gray.width, int(right * sx + 0.999)), min(gray.height, int(bottom * sy + 0.999)),
+    )
+
+
+def segment_labels(src):
+    """
+    사진 속 라벨(밝은 사각형 종이) 영역들 → [(x0, y0, x1, y1)] 정규화 좌표, 읽는 순서.
+    축소 사본에서 밝기 이진화 → 닫기(글자 구멍 메우기) → 연결 성분 → 크기/사각형다움으로 거른다.
+    라벨을 못 찾거나 한 장이 사진 대부분이면 사진 전체 한 장.
+    """
+    from PIL import Image, ImageOps
+    if isinstance(src, (bytes, bytearray, memoryview)):
+        src = io.BytesIO(src)
+    image = Image.open(src)
+    image.draft("L", (OCR_SEGMENT_SIDE * 2, OCR_SEGMENT_SIDE * 2))
+    image = ImageOps.exif_transpose(image).convert("L")
+    image.thumbnail((OCR_SEGMENT_SIDE, OCR_SEGMENT_SIDE))
+    width, height = image.size
+
+    labels = _reading_order(_paper_boxes(image))[:OCR_SEGMENT_MAX_LABELS]
+    if not labels or (len(labels) == 1 and
+                      (labels[0][2] - labels[0][0]) * (labels[0][3] - labels[0][1]) > 0.8 * width * height):
+        return [(0.0, 0.0, 1.0, 1.0)]
+
+    result = []
+    for left, top, right, bottom in labels:
+        pad_x = (right - left) * OCR_SEGMENT_PADDING
+        pad_y = (bottom - top) * OCR_SEGMENT_PADDING
+        result.append((
+            round(max(0.0, (left - pad_x) / width), 4), round(max(0.0, (top - pad_y) / height), 4),
+            round(min(1.0, (right + pad_x) / width), 4), round(min(1.0, (bottom + pad_y) / height), 4),
+        ))
+    return result
+
+
+def today_str():
+    return datetime.now().strftime("%Y-%m-%d")
+
+def note_backend(backend):
+    """
+    OCR 워커가 실제로 쓴 엔진(timings["ocr_backend"])을 앱 프로세스에도 반영.
+    워커가 tesserocr → pytesseract 로 전환했으면 이후 캐시 조회 키도 그 엔진 기준으로.
+    """
+    global _backend
+    if backend:
+        with _backend_lock:
+            _backend = backend
+
+
+def ocr_config_fingerprint(backend=None):
+    """
+    OCR 결과에 영향을 주는 설정. 결과 캐시 키에 포함 → 설정이 바뀌면 캐시가 자연히 무효.
+    backend: 결과를 만든 엔진 (기본: 지금 쓰는 엔진 — 환경변수가 아니라 전환 후 값)
+    """
+    return "|".join([
+        backend or _backend, OCR_LANG, ",".join(OCR_PREPROCESS), str(OCR_TARGET_DPI), str(OCR_LABEL_INCHES),
+        str(OCR_THRESHOLD_RADIUS), str(OCR_THRESHOLD_OFFSET), str(OCR_DESKEW_MAX_ANGLE),
+        OCR_MODE, str(OCR_FAST_DPI), str(OCR_MIN_CONFIDENCE), str(OCR_FIELD_PADDING),
+        # 템플릿: 택배사 판별(헤더) / 전체 페이지 대체 / 라벨 테두리 자르기(분할 설정 공유)
+        OCR_TEMPLATE_FALLBACK, str(OCR_TEMPLATE_HEADER), str(OCR_TEMPLATE_HEADER_WIDTH), templates_fingerprint(),
+        # 여러 라벨 분할 (crop 좌표를 정하는 설정)
+        str(OCR_SEGMENT_SIDE), str(OCR_SEGMENT_MIN_AREA), str(OCR_SEGMENT_MIN_FILL), str(OCR_SEGMENT_MAX_LABELS),
+        str(OCR_SEGMENT_BRIGHTNESS), str(OCR_SEGMENT_PADDING),
+    ])
+
+def extract_shipping_info_timed(image_path, courier=None, crop=None):
+    """프로세스 풀용: (송장 정보, 단계별 소요 시간 ms) 를 함께 돌려준다."""
+    timings = {}
+    info = extract_shipping_info(image_path, timings, courier, crop)
+    timings["ocr_backend"] = _backend  # 실제로 쓴 엔진 (tesserocr 실패 시 pytesseract) → 캐시 키
+    return info, timings
+
+# 기동 워밍업용 내장 샘플 (첫 요청이 PIL 디코더/ tesseract 모델 로드 비용을 치르지 않게)
+WARMUP_TEXT = "CJ 010-1234-5678"
+
+def warmup_image_bytes():
+    """흰 바탕에 검은 글자 한 줄인 작은 PNG."""
+    from PIL import Image, ImageDraw
+    image = Image.new("L", (240, 40), 255)
+    ImageDraw.Draw(image).text((8, 14), WARMUP_TEXT, fill=0)
+    buf = io.BytesIO()
+    image.save(buf, format="PNG")
+    return buf.getvalue()
+
+def warm_ocr_sample():
+    """프로세스 풀용: 샘플을 전처리 + OCR 한 번 → 걸린 시간(초). 인식 결과는 보지 않는다."""
+    t = time.perf_counter()
+    ocr_text(preprocess_image(warmup_image_bytes()))
+    return round(time.perf_counter() - t, 3)
 
 def parse_qr_text(qr_text):
     code_map = {
@@ -43,9 +892,11 @@ def parse_qr_text(qr_text):
     prefix = (qr_text or "")[:2]
     return {"기종": code_map.get(prefix, "알 수 없음"), "기기번호": (qr_text or "")[2:]}
 
-def make_final_entry(qr_text, 송장_image_path):
+def make_final_entry(qr_text, 송장_image_path, timings=None):
+    return build_entry(qr_text, extract_shipping_info(송장_image_path, timings))
+
+def build_entry(qr_text, 송장_data):
     qr_data = parse_qr_text(qr_text)
-    송장_data = extract_shipping_info(송장_image_path)
     return {
         "출고일": 송장_data["출고일"],
         "대여자명": 송장_data["수취인명"],
@@ -55,4 +906,3 @@ def make_final_entry(qr_text, 송장_image_path):
         "기종": qr_data["기종"],
         "송장번호": 송장_data["송장번호"],
     }
-
@@ -0,0 +1,150 @@
+import os
+import asyncio
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from ocr_utils import OCR_TIMEOUT, warm_ocr_engine
+
+
+def _default_workers():
+    try:
+        return len(os.sched_getaffinity(0))  # 컨테이너 CPU 제한 반영
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+# OCR 프로세스 수 (기본: 사용 가능한 코어 수) / 실행+대기 중 최대 작업 수
+OCR_WORKERS = int(os.getenv("OCR_WORKERS", "0")) or _default_workers()
+OCR_QUEUE_MAX = int(os.getenv("OCR_QUEUE_MAX", "0")) or OCR_WORKERS * 4
+# 워커 프로세스 시작 방식. uvicorn 프로세스는 스레드가 있으므로 fork 대신 spawn 기본
+OCR_MP_START = os.getenv("OCR_MP_START", "spawn")
+# 클라이언트 연결 끊김 확인 주기(초)
+OCR_DISCONNECT_POLL = float(os.getenv("OCR_DISCONNECT_POLL", "0.5"))
+
+
+class OcrBusy(Exception):
+    pass
+
+
+class OcrTimeout(Exception):
+    pass
+
+
+class OcrCancelled(Exception):
+    pass
+
+
+def _init_worker(workers):
+    # tesseract의 OpenMP 스레드끼리 코어를 다투지 않게 → 프로세스 수만큼 선형 확장
+    os.environ.setdefault("OMP_THREAD_LIMIT", "1")
+    # OCR_BACKEND=tesserocr 면 워커마다 언어 모델을 한 번만 로드해 두고 계속 재사용
+    # (workers: 템플릿 필드 스레드 수를 코어 수 ÷ 워커 수로 맞추는 데 쓴다)
+    warm_ocr_engine(workers)
+
+
+class OcrPool:
+    """
+    OCR(Tesseract)을 프로세스 풀에서 돌려 이벤트 루프를 막지 않게 한다.
+    - 실행 중 + 대기 작업이 queue_max를 넘으면 즉시 OcrBusy (→ 503)
+    - timeout 초과 시 OcrTimeout (→ 504)
+    - 클라이언트가 끊기면 OcrCancelled. 아직 시작 안 한 작업은 취소되고,
+      이미 도는 작업은 tesseract 자체 timeout(OCR_TIMEOUT)으로 끝난다.
+      그런 작업도 워커를 잡고 있으므로 실제로 끝날 때까지 queue_max 자리를 차지한다.
+    """
+
+    def __init__(self, workers=OCR_WORKERS, queue_max=OCR_QUEUE_MAX, timeout=OCR_TIMEOUT):
+        self.workers = workers
+        self.queue_max = queue_max
+        self.timeout = timeout
+        self._executor = None
+        self._inflight = 0
+        self._abandoned = 0  # 응답은 끝났지만 워커에서 아직 도는 작업
+        self._lock = threading.Lock()  # 완료 콜백은 executor 관리 스레드에서 불린다
+
+    def start(self):
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context(OCR_MP_START),
+                initializer=_init_worker,
+                initargs=(self.workers,),
+            )
+        return self._executor
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    async def run(self, fn, *args, request=None):
+        """fn(*args)를 워커 프로세스에서 실행. fn/args는 pickle 가능해야 한다."""
+        with self._lock:
+            if self._inflight >= self.queue_max:
+                raise OcrBusy(f"OCR queue is full ({self.queue_max})")
+            self._inflight += 1
+        watcher = None
+        future = None
+        try:
+            executor = self.start()
+            future = executor.submit(fn, *args)
+            # 자리는 워커 쪽 작업이 실제로 끝날 때 반납 (timeout/끊김으로 버린 작업 포함)
+            future.add_done_callback(self._release)
+            job = asyncio.wrap_future(future)
+            watcher = asyncio.ensure_future(self._wait_disconnect(request))
+            done, _ = await asyncio.wait(
+                {job, watcher}, timeout=self.timeout, return_when=asyncio.FIRST_COMPLETED
+            )
+            if job in done:
+                return job.result()
+            if not future.cancel():
+                # 이미 워커에서 도는 중 → 멈출 수 없음. 끝날 때까지 자리 유지
+                with self._lock:
+                    self._abandoned += 1
+                future.add_done_callback(self._release_abandoned)
+            job.cancel()
+            if watcher in done:
+                raise OcrCancelled("client disconnected")
+            raise OcrTimeout(f"OCR took longer than {self.timeout}s")
+        except BrokenProcessPool:
+            # 워커 하나가 죽으면 풀 전체가 못 쓰게 된다 → 버리고 다음 요청에서 새로 만든다
+            self._reset(executor)
+            raise
+        finally:
+            if future is None:
+                # submit 전에 실패 → 콜백이 없으니 여기서 반납
+                self._release(None)
+            if watcher is not None:
+                watcher.cancel()
+
+    def _release(self, _future):
+        with self._lock:
+            self._inflight -= 1
+
+    def _release_abandoned(self, _future):
+        with self._lock:
+            self._abandoned -= 1
+
+    def _reset(self, executor):
+        if self._executor is executor:
+            print("[OCR] 프로세스 풀 손상 → 다시 생성")
+            self._executor = None
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    async def _wait_disconnect(self, request):
+        if request is None:
+            await asyncio.Event().wait()  # 끊김 감지 안 함 (취소될 때까지)
+            return
+        while not await request.is_disconnected():
+            await asyncio.sleep(OCR_DISCONNECT_POLL)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "workers": self.workers, "queue_max": self.queue_max,
+                "inflight": self._inflight, "abandoned": self._abandoned,
+            }
+
+
+ocr_pool = OcrPool()
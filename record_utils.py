@@ -0,0 +1,304 @@
+import os
+import re
+import time
+import asyncio
+import sqlite3
+from datetime import date, timedelta
+from contextlib import closing
+
+from row_utils import parse_last_row
+
+# 출고 기록 조회용 로컬 사본 (SQLite). /records 조회는 Graph를 전혀 부르지 않는다.
+RECORD_STORE_PATH = os.getenv("RECORD_STORE_PATH", "records.sqlite3")
+# 워크북과 맞추는 주기(초). 0 → 백그라운드 동기화 끔 (쓰기 기록 + POST /records/sync 만)
+RECORD_SYNC_INTERVAL = float(os.getenv("RECORD_SYNC_INTERVAL", "300"))
+# 평소에는 새로 늘어난 행만 읽고, 이 주기(초)마다 한 번은 전체를 다시 읽는다 (사람이 고친/지운 행 반영)
+RECORD_FULL_SYNC_INTERVAL = float(os.getenv("RECORD_FULL_SYNC_INTERVAL", "21600"))
+# range 읽기 한 번에 가져오는 행 수
+RECORD_SYNC_PAGE_ROWS = int(os.getenv("RECORD_SYNC_PAGE_ROWS", "2000"))
+RECORD_QUERY_LIMIT = int(os.getenv("RECORD_QUERY_LIMIT", "100"))
+
+COLUMNS = ("출고일", "대여자명", "전화번호", "주소", "기기번호", "기종", "송장번호")
+_NON_DIGITS = re.compile(r"\D")
+_EXCEL_EPOCH = date(1899, 12, 30)
+
+
+def digits(value):
+    """전화번호/송장번호 비교용: 숫자만 ("010-1234-5678" == "01012345678")."""
+    return _NON_DIGITS.sub("", str(value or ""))
+
+
+def normalize_device(value):
+    return str(value or "").strip().upper()
+
+
+def normalize_date(value):
+    """엑셀 날짜 일련번호(45678) / "2026-10-16" / "2026.10.16" → "2026-10-16". 못 읽으면 원문."""
+    if isinstance(value, (int, float)) and not isinstance(value, bool) and 20000 < value < 80000:
+        return (_EXCEL_EPOCH + timedelta(days=int(value))).isoformat()
+    text = str(value or "").strip()
+    m = re.match(r"^(\d{4})[-./](\d{1,2})[-./](\d{1,2})", text)
+    if m:
+        return f"{m.group(1)}-{int(m.group(2)):02d}-{int(m.group(3)):02d}"
+    return text
+
+
+class RecordStore:
+    """
+    워크북 행(출고일~송장번호)을 행 번호 그대로 담아 두는 색인 저장소.
+    - 우리가 쓴 행: 쓰기 성공 직후 record_rows (source=write)
+    - 다른 사람이 엑셀에서 직접 넣은/고친 행: sync_from_workbook 이 cTag 가 바뀌었을 때만 range 로 읽어 반영
+    기기번호 / 송장번호·전화번호(숫자만) / 출고일 색인.
+    """
+
+    def __init__(self, path=RECORD_STORE_PATH):
+        self.path = path
+        self._task = None
+        self._stopping = False
+        self._lock = None
+        self.last_sync_result = None
+        with closing(self._connect()) as db:
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS records ("
+                " sheet_key TEXT NOT NULL,"
+                " row INTEGER NOT NULL,"
+                " shipped_date TEXT, name TEXT, phone TEXT, address TEXT,"
+                " device TEXT, model TEXT, invoice TEXT,"
+                " device_key TEXT, phone_key TEXT, invoice_key TEXT,"
+                " source TEXT NOT NULL,"
+                " updated_at REAL NOT NULL,"
+                " PRIMARY KEY (sheet_key, row))"
+            )
+            db.execute("CREATE INDEX IF NOT EXISTS records_device ON records (device_key)")
+            db.execute("CREATE INDEX IF NOT EXISTS records_invoice ON records (invoice_key)")
+            db.execute("CREATE INDEX IF NOT EXISTS records_phone ON records (phone_key)")
+            db.execute("CREATE INDEX IF NOT EXISTS records_date ON records (shipped_date)")
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS record_sync ("
+                " sheet_key TEXT PRIMARY KEY,"
+                " ctag TEXT,"
+                " last_row INTEGER NOT NULL DEFAULT 1,"
+                " full_at REAL NOT NULL DEFAULT 0,"
+                " synced_at REAL)"
+            )
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30, isolation_level=None)
+
+    # -------------------------------
+    # 쓰기
+    # -------------------------------
+    @staticmethod
+    def _params(sheet_key, row_no, values, source, now):
+        values = (list(values) + [""] * len(COLUMNS))[:len(COLUMNS)]
+        shipped, name, phone, address, device, model, invoice = ["" if v is None else v for v in values]
+        return (
+            sheet_key, row_no, normalize_date(shipped), str(name), str(phone), str(address),
+            str(device), str(model), str(invoice),
+            normalize_device(device), digits(phone), digits(invoice), source, now,
+        )
+
+    def record_rows(self, sheet_key, rows, source="write"):
+        """rows: [(행 번호, [출고일, ..., 송장번호])]. 같은 행 번호는 덮어쓴다."""
+        now = time.time()
+        with closing(self._connect()) as db:
+            db.execute("BEGIN IMMEDIATE")
+            db.executemany(
+                "INSERT OR REPLACE INTO records (sheet_key, row, shipped_date, name, phone, address,"
+                " device, model, invoice, device_key, phone_key, invoice_key, source, updated_at)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [self._params(sheet_key, n, values, source, now) for n, values in rows],
+            )
+            db.execute("COMMIT")
+
+    def _replace_range(self, db, sheet_key, first_row, values, now):
+        """워크북에서 읽은 first_row~ 구간으로 교체 (빈 행은 지움)."""
+        last_row = first_row + len(values) - 1
+        db.execute(
+            "DELETE FROM records WHERE sheet_key = ? AND row BETWEEN ? AND ?", (sheet_key, first_row, last_row)
+        )
+        db.executemany(
+            "INSERT INTO records (sheet_key, row, shipped_date, name, phone, address,"
+            " device, model, invoice, device_key, phone_key, invoice_key, source, updated_at)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            [
+                self._params(sheet_key, first_row + i, row, "sync", now)
+                for i, row in enumerate(values)
+                if any(v not in ("", None) for v in row)
+            ],
+        )
+
+    # -------------------------------
+    # 조회 (Graph 호출 없음)
+    # -------------------------------
+    def query(self, device=None, invoice=None, phone=None, name=None,
+              date_from=None, date_to=None, limit=RECORD_QUERY_LIMIT):
+        """조건은 AND. 최근 출고(출고일, 행 번호 역순)부터."""
+        where, params = [], []
+        if device:
+            where.append("device_key = ?")
+            params.append(normalize_device(device))
+        if invoice:
+            where.append("invoice_key = ?")
+            params.append(digits(invoice))
+        if phone:
+            where.append("phone_key = ?")
+            params.append(digits(phone))
+        if name:
+            where.append("name = ?")
+            params.append(name.strip())
+        if date_from:
+            where.append("shipped_date >= ?")
+            params.append(normalize_date(date_from))
+        if date_to:
+            where.append("shipped_date <= ?")
+            params.append(normalize_date(date_to))
+        sql = (
+            "SELECT sheet_key, row, shipped_date, name, phone, address, device, model, invoice, source, updated_at"
+            " FROM records"
+        )
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY shipped_date DESC, row DESC LIMIT ?"
+        with closing(self._connect()) as db:
+            rows = db.execute(sql, (*params, max(1, min(int(limit), 1000)))).fetchall()
+        return [self._to_dict(r) for r in rows]
+
+    @staticmethod
+    def _to_dict(r):
+        sheet_key, row_no, *values, source, updated_at = r
+        return {
+            "sheet": sheet_key,
+            "row": row_no,
+            "range": f"A{row_no}:G{row_no}",
+            **dict(zip(COLUMNS, values)),
+            "source": source,
+            "updated_at": updated_at,
+        }
+
+    def stats(self):
+        with closing(self._connect()) as db:
+            counts = dict(db.execute("SELECT source, COUNT(*) FROM records GROUP BY source").fetchall())
+            sync = db.execute("SELECT sheet_key, ctag, last_row, full_at, synced_at FROM record_sync").fetchall()
+        return {
+            "records": sum(counts.values()),
+            "by_source": counts,
+            "sheets": [
+                {"sheet": k, "ctag": c, "last_row": n, "full_sync_at": f or None, "synced_at": s}
+                for k, c, n, f, s in sync
+            ],
+            "last_sync": self.last_sync_result,
+        }
+
+    def _sync_state(self, sheet_key):
+        with closing(self._connect()) as db:
+            row = db.execute(
+                "SELECT ctag, last_row, full_at FROM record_sync WHERE sheet_key = ?", (sheet_key,)
+            ).fetchone()
+        return row or (None, 1, 0.0)
+
+    def _save_sync_state(self, db, sheet_key, ctag, last_row, full_at):
+        db.execute(
+            "INSERT INTO record_sync (sheet_key, ctag, last_row, full_at, synced_at) VALUES (?, ?, ?, ?, ?)"
+            " ON CONFLICT(sheet_key) DO UPDATE SET ctag = excluded.ctag, last_row = excluded.last_row,"
+            " full_at = excluded.full_at, synced_at = excluded.synced_at",
+            (sheet_key, ctag, last_row, full_at, time.time()),
+        )
+
+    # -------------------------------
+    # 워크북 → 저장소 동기화
+    # -------------------------------
+    async def sync_from_workbook(self, graph, token, sheet_key, full=False):
+        """
+        1) 파일 cTag(내용이 바뀔 때만 바뀜) 확인 → 그대로면 끝 (GET 한 번)
+        2) usedRange 로 마지막 행 확인
+        3) 지난번 마지막 행 이후만 range 로 읽기 (전체 재동기화 주기이거나 행이 줄었으면 2행부터 전부)
+        """
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            result = await self._sync(graph, token, sheet_key, full)
+        self.last_sync_result = {**result, "at": time.time()}
+        return result
+
+    async def _sync(self, graph, token, sheet_key, full):
+        if not token:
+            return {"status": "failed", "error": "no_access_token"}
+        ctag, known_last, full_at = await asyncio.to_thread(self._sync_state, sheet_key)
+        full = full or time.time() - full_at >= RECORD_FULL_SYNC_INTERVAL
+
+        meta = await graph.get_drive_item(token)
+        if meta.status_code != 200:
+            return {"status": "failed", "error": "item_lookup_failed", "http_status": meta.status_code}
+        item = meta.json()
+        if not full and item.get("cTag") and item.get("cTag") == ctag:
+            return {"status": "unchanged"}
+
+        used = await graph.get_used_range(token, item["id"])
+        if used.status_code != 200:
+            return {"status": "failed", "error": "used_range_failed", "http_status": used.status_code}
+        last_row = parse_last_row(used.json().get("address"))
+        if last_row < known_last:
+            full = True  # 행이 지워졌다 → 번호가 당겨졌을 수 있으므로 전부 다시
+        first = 2 if full else known_last + 1
+
+        pages = []
+        for start in range(first, last_row + 1, RECORD_SYNC_PAGE_ROWS):
+            end = min(last_row, start + RECORD_SYNC_PAGE_ROWS - 1)
+            resp = await graph.get_range(token, item["id"], f"A{start}:G{end}")
+            if resp.status_code != 200:
+                return {"status": "failed", "error": "range_read_failed", "http_status": resp.status_code}
+            pages.append((start, resp.json().get("values") or []))
+
+        now = time.time()
+
+        def apply():
+            with closing(self._connect()) as db:
+                db.execute("BEGIN IMMEDIATE")
+                if full:
+                    db.execute("DELETE FROM records WHERE sheet_key = ? AND row > ?", (sheet_key, last_row))
+                for start, values in pages:
+                    self._replace_range(db, sheet_key, start, values, now)
+                self._save_sync_state(db, sheet_key, item.get("cTag"), last_row, now if full else full_at)
+                db.execute("COMMIT")
+
+        await asyncio.to_thread(apply)
+        rows = sum(len(v) for _, v in pages)
+        if rows:
+            print(f"[Records] 워크북 동기화 → {sheet_key}: {first}~{last_row}행 ({'전체' if full else '추가분'})")
+        return {"status": "synced", "full": full, "from_row": first, "last_row": last_row, "rows_read": rows}
+
+    # -------------------------------
+    # 백그라운드 (lifespan)
+    # -------------------------------
+    def start(self, graph_fn, token_fn, sheet_key, interval=RECORD_SYNC_INTERVAL):
+        self._graph_fn = graph_fn
+        self._token_fn = token_fn
+        self.sheet_key = sheet_key
+        self._stopping = False
+        if interval > 0 and (self._task is None or self._task.done()):
+            self._task = asyncio.create_task(self._run(interval))
+
+    async def sync_now(self, full=False):
+        return await self.sync_from_workbook(self._graph_fn(), await self._token_fn(), self.sheet_key, full=full)
+
+    async def _run(self, interval):
+        while not self._stopping:
+            try:
+                result = await self.sync_now()
+                if result["status"] == "failed":
+                    print("[Records] 워크북 동기화 실패:", result)
+            except Exception as e:
+                print("[Records] 워크북 동기화 예외:", repr(e))
+            await asyncio.sleep(interval)
+
+    async def close(self):
+        self._stopping = True
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+
+record_store = RecordStore()
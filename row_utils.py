@@ -0,0 +1,132 @@
+import os
+import sqlite3
+import time
+from contextlib import closing
+
+# 모든 uvicorn 워커가 공유하는 행 예약 장부(SQLite). 워커끼리 같은 행을 받지 않게 한다.
+ROW_LEDGER_PATH = os.getenv("ROW_LEDGER_PATH", "row_ledger.sqlite3")
+# 예약 기록 보관 시간(초). 충돌 후 재동기화 때 이 안의 예약(쓰는 중 / 방금 쓴 행)은 건너뛴다.
+# usedRange 조회 → sync 사이에 다른 워커가 쓴 행을 덮지 않도록 Graph 쓰기 timeout 보다 길게.
+ROW_RESERVATION_TTL = float(os.getenv("ROW_RESERVATION_TTL", "300"))
+
+
+def parse_last_row(address):
+    """usedRange address 예: "유축기출고!A1:G12" → 12. 못 읽으면 1(헤더 행)."""
+    try:
+        return int(address.split("!")[1].split(":")[1][1:])
+    except Exception:
+        return 1
+
+
+class RowAllocator:
+    """
+    다음 쓸 행 번호(cursor)를 로컬 장부에 두고, 예약은 BEGIN IMMEDIATE 트랜잭션으로 처리.
+    → 프로세스가 여러 개여도 같은 행을 두 번 내주지 않는다.
+    usedRange 재동기화는 시작 시 / 충돌(쓰기 실패) 후에만 필요하다.
+    최근 예약은 row_reservation 에 남겨 두어, 충돌 후 sync 가 실패한 행 자리로 cursor를 되돌릴 수 있게 한다.
+    """
+
+    def __init__(self, path=ROW_LEDGER_PATH, reservation_ttl=ROW_RESERVATION_TTL):
+        self.path = path
+        self.reservation_ttl = reservation_ttl
+        with closing(self._connect()) as db:
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS row_cursor ("
+                " sheet_key TEXT PRIMARY KEY,"
+                " next_row INTEGER NOT NULL,"
+                " needs_sync INTEGER NOT NULL DEFAULT 0,"
+                " synced_at REAL)"
+            )
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS row_reservation ("
+                " sheet_key TEXT NOT NULL,"
+                " first_row INTEGER NOT NULL,"
+                " end_row INTEGER NOT NULL,"
+                " expires_at REAL NOT NULL,"
+                " PRIMARY KEY (sheet_key, first_row))"
+            )
+
+    def _connect(self):
+        # isolation_level=None → 트랜잭션을 직접 BEGIN IMMEDIATE로 연다 (쓰기 잠금 즉시 획득)
+        return sqlite3.connect(self.path, timeout=30, isolation_level=None)
+
+    def reserve(self, sheet_key, count=1):
+        """
+        count개 연속 행을 예약하고 첫 행 번호를 돌려준다.
+        cursor가 없거나 재동기화가 필요하면 None → 호출 측에서 usedRange로 sync() 후 다시 호출.
+        """
+        db = self._connect()
+        try:
+            db.execute("BEGIN IMMEDIATE")
+            cur = db.execute(
+                "SELECT next_row, needs_sync FROM row_cursor WHERE sheet_key = ?", (sheet_key,)
+            ).fetchone()
+            if cur is None or cur[1]:
+                db.execute("ROLLBACK")
+                return None
+            start = cur[0]
+            now = time.time()
+            db.execute(
+                "UPDATE row_cursor SET next_row = ? WHERE sheet_key = ?", (start + count, sheet_key)
+            )
+            db.execute("DELETE FROM row_reservation WHERE expires_at <= ?", (now,))
+            db.execute(
+                "INSERT OR REPLACE INTO row_reservation (sheet_key, first_row, end_row, expires_at)"
+                " VALUES (?, ?, ?, ?)",
+                (sheet_key, start, start + count, now + self.reservation_ttl),
+            )
+            db.execute("COMMIT")
+            return start
+        finally:
+            db.close()
+
+    def sync(self, sheet_key, last_row):
+        """
+        usedRange의 마지막 행으로 cursor를 맞춘다.
+        평소에는 뒤로 되돌리지 않는다 (다른 워커가 예약만 하고 아직 못 쓴 행이 있을 수 있음).
+        충돌(mark_conflict) 후에는 usedRange + 1 까지 되돌린다 → 실패한 쓰기가 빈 행으로 남지 않는다.
+        단 아직 보관 중인 예약(쓰는 중 / 방금 쓴 행)보다 앞으로는 가지 않는다.
+        """
+        db = self._connect()
+        try:
+            db.execute("BEGIN IMMEDIATE")
+            cur = db.execute(
+                "SELECT next_row, needs_sync FROM row_cursor WHERE sheet_key = ?", (sheet_key,)
+            ).fetchone()
+            reserved_end = db.execute(
+                "SELECT MAX(end_row) FROM row_reservation WHERE sheet_key = ? AND expires_at > ?",
+                (sheet_key, time.time()),
+            ).fetchone()[0]
+            floor = cur[0] if cur and not cur[1] else 0
+            next_row = max(last_row + 1, reserved_end or 0, floor)
+            db.execute(
+                "INSERT INTO row_cursor (sheet_key, next_row, needs_sync, synced_at) VALUES (?, ?, 0, ?)"
+                " ON CONFLICT(sheet_key) DO UPDATE SET"
+                " next_row = excluded.next_row, needs_sync = 0, synced_at = excluded.synced_at",
+                (sheet_key, next_row, time.time()),
+            )
+            db.execute("COMMIT")
+            return next_row
+        finally:
+            db.close()
+
+    def mark_conflict(self, sheet_key, first_row=None):
+        """
+        쓰기가 실패하면 다음 예약 전에 usedRange로 다시 맞추도록 표시.
+        first_row: 확실히 쓰이지 않은(오류 응답) 예약 → 해제해서 sync 때 그 자리부터 다시 쓴다.
+        (타임아웃처럼 결과를 모르면 None → 예약을 남겨 두어 그 행은 건너뛴다)
+        """
+        db = self._connect()
+        try:
+            db.execute("BEGIN IMMEDIATE")
+            db.execute("UPDATE row_cursor SET needs_sync = 1 WHERE sheet_key = ?", (sheet_key,))
+            if first_row is not None:
+                db.execute(
+                    "DELETE FROM row_reservation WHERE sheet_key = ? AND first_row = ?", (sheet_key, first_row)
+                )
+            db.execute("COMMIT")
+        finally:
+            db.close()
+
+
+row_allocator = RowAllocator()
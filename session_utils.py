@@ -0,0 +1,203 @@
+import os
+import time
+import asyncio
+
+# 워크북 세션 사용 여부 (세션 없이 부르면 Graph가 호출마다 워크북을 새로 연다 → 느림)
+WORKBOOK_SESSIONS = os.getenv("WORKBOOK_SESSIONS", "1") == "1"
+# Graph 영구 세션은 약 5분 동안 안 쓰면 사라진다 → 이보다 오래 안 썼으면 새로 만든다(초)
+WORKBOOK_SESSION_IDLE = float(os.getenv("WORKBOOK_SESSION_IDLE", "300"))
+# 마지막 사용/refresh 후 이 시간(초)이 지나면 refreshSession 으로 살려 둔다
+WORKBOOK_SESSION_REFRESH = float(os.getenv("WORKBOOK_SESSION_REFRESH", "180"))
+# 마지막 사용 후 이 시간(초)이 지나면 더 이상 살려 두지 않는다 (다음 요청 때 새로 생성)
+WORKBOOK_SESSION_KEEPALIVE = float(os.getenv("WORKBOOK_SESSION_KEEPALIVE", "1800"))
+
+SESSION_HEADER = "workbook-session-id"
+_SESSION_ACTIONS = ("/createSession", "/refreshSession", "/closeSession")
+
+
+def is_session_error(resp):
+    """세션이 만료/무효 (InvalidSession, invalidSessionReCreatable, sessionNotFound 등)."""
+    if resp.status_code < 400:
+        return False
+    try:
+        code = (resp.json().get("error") or {}).get("code") or ""
+    except Exception:
+        return False
+    return "session" in code.lower()
+
+
+class _Latency:
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds):
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def stats(self):
+        return {
+            "count": self.count,
+            "avg_ms": round(self.total / self.count * 1000, 1) if self.count else None,
+            "max_ms": round(self.max * 1000, 1) if self.count else None,
+        }
+
+
+class WorkbookSessionManager:
+    """
+    워크북(파일)마다 persistChanges=true 세션 하나를 만들어 두고 모든 워크북 호출에 붙인다.
+    - 처음 필요할 때 createSession (동시에 여러 요청이 와도 한 번만)
+    - 오래 안 쓴 세션은 백그라운드에서 refreshSession, 완전히 idle 이면 다음 요청 때 새로
+      (used: 실제 요청만 갱신 → KEEPALIVE 판단 / refreshed: refresh 주기. refresh 는 used 를 건드리지 않는다)
+    - 세션 키는 워크북 item ID (items/{id} 와 root:/경로: 호출이 같은 세션을 쓴다)
+    - InvalidSession 응답이면 버리고 새로 만들어 한 번 재시도 (GraphWorkbookClient.request)
+    - 종료 시 closeSession
+    client: GraphWorkbookClient (요청은 client.request 로 → 재시도/동시성 제한 동일 적용)
+    """
+
+    def __init__(self, client, enabled=WORKBOOK_SESSIONS):
+        self.client = client
+        self.enabled = enabled
+        self._sessions = {}  # workbook 키(item ID) → {"id", "base", "token", "created", "used", "refreshed"}
+        self._locks = {}
+        self._keepalive = None
+        self.counters = {"created": 0, "create_failed": 0, "refreshed": 0, "invalidated": 0, "closed": 0}
+        self.latency = {"session": _Latency(), "sessionless": _Latency(), "create_session": _Latency()}
+
+    @staticmethod
+    def is_session_action(url):
+        return url.endswith(_SESSION_ACTIONS)
+
+    async def session_id(self, key, base, token):
+        """
+        key(워크북 item ID)에 쓸 세션 ID. 만들 수 없으면 None (→ 세션 없이 호출).
+        base: 세션이 없을 때 createSession 을 보낼 ".../workbook" URL
+        """
+        if not self.enabled:
+            return None
+        session = self._live(key)
+        if session:
+            session["token"] = token
+            return session["id"]
+        lock = self._locks.setdefault(key, asyncio.Lock())
+        async with lock:
+            session = self._live(key)
+            if session is None:
+                session = await self._create(key, base, token)
+            if session is None:
+                return None
+            session["token"] = token
+            return session["id"]
+
+    def touch(self, key):
+        """실제 워크북 요청 후에만 호출 (refresh 는 used 를 갱신하지 않는다)."""
+        session = self._sessions.get(key)
+        if session:
+            session["used"] = time.monotonic()
+
+    def invalidate(self, key, session_id):
+        session = self._sessions.get(key)
+        if session and session["id"] == session_id:
+            del self._sessions[key]
+            self.counters["invalidated"] += 1
+            print("[OneDrive] 워크북 세션 무효 → 다시 생성:", key)
+
+    def record(self, with_session, seconds):
+        self.latency["session" if with_session else "sessionless"].add(seconds)
+
+    @staticmethod
+    def _last_contact(session):
+        """Graph 쪽 idle 시계는 요청이든 refresh 든 마지막 호출부터."""
+        return max(session["used"], session["refreshed"])
+
+    def _live(self, key):
+        session = self._sessions.get(key)
+        if session and time.monotonic() - self._last_contact(session) < WORKBOOK_SESSION_IDLE:
+            return session
+        self._sessions.pop(key, None)
+        return None
+
+    async def _create(self, key, base, token):
+        start = time.perf_counter()
+        try:
+            resp = await self.client.request(
+                "POST", f"{base}/createSession", token, json={"persistChanges": True}
+            )
+        except Exception as e:
+            print("[OneDrive] createSession 예외 → 세션 없이 진행:", repr(e))
+            self.counters["create_failed"] += 1
+            return None
+        self.latency["create_session"].add(time.perf_counter() - start)
+        if resp.status_code not in (200, 201):
+            print("[OneDrive] createSession 실패 → 세션 없이 진행:", resp.status_code)
+            self.counters["create_failed"] += 1
+            return None
+        now = time.monotonic()
+        session = {"id": resp.json()["id"], "base": base, "token": token, "created": now, "used": now, "refreshed": now}
+        self._sessions[key] = session
+        self.counters["created"] += 1
+        if self._keepalive is None or self._keepalive.done():
+            self._keepalive = asyncio.create_task(self._keepalive_loop())
+        return session
+
+    async def _keepalive_loop(self):
+        interval = max(1.0, WORKBOOK_SESSION_REFRESH / 2)
+        while self._sessions:
+            await asyncio.sleep(interval)
+            now = time.monotonic()
+            for key, session in list(self._sessions.items()):
+                silent = now - self._last_contact(session)
+                if silent >= WORKBOOK_SESSION_IDLE or now - session["used"] >= WORKBOOK_SESSION_KEEPALIVE:
+                    # 이미 만료됐거나 요청이 끊긴 지 오래된 세션 → 놓아 두고 다음 요청 때 새로
+                    self._sessions.pop(key, None)
+                    continue
+                if silent >= WORKBOOK_SESSION_REFRESH:
+                    await self._refresh(key, session)
+
+    async def _refresh(self, key, session):
+        try:
+            resp = await self.client.request(
+                "POST", f"{session['base']}/refreshSession", session["token"],
+                headers={SESSION_HEADER: session["id"]},
+            )
+        except Exception as e:
+            print("[OneDrive] refreshSession 예외:", repr(e))
+            return
+        if resp.status_code in (200, 204):
+            session["refreshed"] = time.monotonic()
+            self.counters["refreshed"] += 1
+        else:
+            # 토큰 만료/세션 무효 → 다음 요청 때 새로 생성
+            self._sessions.pop(key, None)
+
+    async def close(self):
+        if self._keepalive is not None:
+            self._keepalive.cancel()
+            self._keepalive = None
+        for session in list(self._sessions.values()):
+            try:
+                await self.client.request(
+                    "POST", f"{session['base']}/closeSession", session["token"],
+                    headers={SESSION_HEADER: session["id"]},
+                )
+                self.counters["closed"] += 1
+            except Exception as e:
+                print("[OneDrive] closeSession 예외:", repr(e))
+        self._sessions.clear()
+
+    def stats(self):
+        now = time.monotonic()
+        return {
+            "enabled": self.enabled,
+            **self.counters,
+            "sessions": [
+                {
+                    "workbook": key, "age_s": round(now - s["created"], 1),
+                    "idle_s": round(now - s["used"], 1), "since_refresh_s": round(now - s["refreshed"], 1),
+                }
+                for key, s in self._sessions.items()
+            ],
+            "latency": {name: lat.stats() for name, lat in self.latency.items()},
+        }
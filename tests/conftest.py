@@ -0,0 +1,5 @@
+import os
+import sys
+
+# 모듈들이 저장소 루트에 있으므로 (패키지 아님) 루트를 import 경로에
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
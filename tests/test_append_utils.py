@@ -0,0 +1,116 @@
+import asyncio
+
+import pytest
+
+from append_utils import AppendBuffer, AppendQueueFull
+
+
+def _recording_flush(calls):
+    async def flush(rows):
+        calls.append(list(rows))
+        return [(True, {"row": row}) for row in rows]
+    return flush
+
+
+def test_rows_are_split_into_batches_of_max_rows():
+    async def main():
+        calls = []
+        buffer = AppendBuffer(_recording_flush(calls), max_rows=3, max_delay_ms=20, max_queue=100)
+        results = await asyncio.gather(*(buffer.append(i) for i in range(7)))
+        await buffer.close()
+        return calls, results
+
+    calls, results = asyncio.run(main())
+    assert [len(c) for c in calls] == [3, 3, 1]
+    assert [row for c in calls for row in c] == list(range(7))
+    # 각 호출자는 자기 행의 결과를 받는다
+    assert results == [(True, {"row": i}) for i in range(7)]
+
+
+def test_append_many_keeps_order_in_one_flush():
+    async def main():
+        calls = []
+        buffer = AppendBuffer(_recording_flush(calls), max_rows=10, max_delay_ms=10, max_queue=100)
+        results = await buffer.append_many(["a", "b", "c"])
+        await buffer.close()
+        return calls, results
+
+    calls, results = asyncio.run(main())
+    assert calls == [["a", "b", "c"]]
+    assert [info["row"] for _, info in results] == ["a", "b", "c"]
+
+
+def test_sync_flush_fn_runs_in_thread():
+    def flush(rows):
+        return [(True, {"n": len(rows)})] * len(rows)
+
+    async def main():
+        buffer = AppendBuffer(flush, max_rows=5, max_delay_ms=10)
+        result = await buffer.append("x")
+        await buffer.close()
+        return result
+
+    assert asyncio.run(main()) == (True, {"n": 1})
+
+
+def test_flush_exception_fails_every_row_in_batch():
+    async def flush(rows):
+        raise RuntimeError("boom")
+
+    async def main():
+        buffer = AppendBuffer(flush, max_rows=5, max_delay_ms=10)
+        results = await asyncio.gather(buffer.append(1), buffer.append(2))
+        await buffer.close()
+        return results
+
+    results = asyncio.run(main())
+    assert [ok for ok, _ in results] == [False, False]
+    assert all(info["error"] == "write_failed" for _, info in results)
+
+
+def test_queue_full():
+    async def main():
+        gate = asyncio.Event()
+
+        async def flush(rows):
+            await gate.wait()
+            return [(True, {})] * len(rows)
+
+        buffer = AppendBuffer(flush, max_rows=1, max_delay_ms=0, max_queue=2)
+        first = asyncio.ensure_future(buffer.append_many([1, 2]))
+        await asyncio.sleep(0)
+        with pytest.raises(AppendQueueFull):
+            await buffer.append_many([3, 4])
+        gate.set()
+        await first
+        await buffer.close()
+
+    asyncio.run(main())
+
+
+def test_close_without_flush_fails_pending_rows():
+    async def main():
+        gate = asyncio.Event()
+        calls = []
+
+        async def flush(rows):
+            calls.append(list(rows))
+            await gate.wait()
+            return [(True, {})] * len(rows)
+
+        buffer = AppendBuffer(flush, max_rows=1, max_delay_ms=0, flush_on_shutdown=False)
+        tasks = [asyncio.ensure_future(buffer.append(i)) for i in range(3)]
+        await asyncio.sleep(0.01)  # 0번 행은 flush 중, 1·2번은 대기
+        closing = asyncio.ensure_future(buffer.close())
+        await asyncio.sleep(0)
+        gate.set()
+        await closing
+        results = await asyncio.gather(*tasks)
+        with pytest.raises(AppendQueueFull):
+            await buffer.append(9)
+        return calls, results
+
+    calls, results = asyncio.run(main())
+    assert calls == [[0]]
+    assert results[0] == (True, {})
+    assert results[1:] == [(False, {"error": "shutdown"})] * 2
@@ -0,0 +1,81 @@
+import asyncio
+
+import idempotency_utils
+from idempotency_utils import IdempotencyStore, request_key, STATE_NEW, STATE_DONE, STATE_INFLIGHT
+
+
+def _store(tmp_path, **kwargs):
+    return IdempotencyStore(str(tmp_path / "idem.sqlite3"), **kwargs)
+
+
+def test_request_key_is_stable():
+    assert request_key("SM1", "1234") == request_key("SM1", "1234")
+    assert request_key("SM1", "1234") != request_key("SM1", "1235")
+
+
+def test_completed_response_is_replayed(tmp_path):
+    async def main():
+        store = _store(tmp_path)
+        assert await store.acquire("k") == (STATE_NEW, None)
+        await store.finish("k", 200, {"status": "ok"}, store=True)
+        return await store.acquire("k")
+
+    assert asyncio.run(main()) == (STATE_DONE, (200, {"status": "ok"}))
+
+
+def test_released_key_is_processed_again(tmp_path):
+    async def main():
+        store = _store(tmp_path)
+        await store.acquire("k")
+        await store.finish("k", 503, {"error": "queue_full"}, store=False)
+        return await store.acquire("k")
+
+    assert asyncio.run(main()) == (STATE_NEW, None)
+
+
+def test_waiter_gets_result_of_inflight_request(tmp_path):
+    async def main():
+        store = _store(tmp_path)
+        await store.acquire("k")
+        waiter = asyncio.ensure_future(store.acquire("k", wait=5))
+        await asyncio.sleep(0.05)
+        assert not waiter.done()
+        await store.finish("k", 200, {"n": 1}, store=True)
+        return await waiter
+
+    assert asyncio.run(main()) == (STATE_DONE, (200, {"n": 1}))
+
+
+def test_wait_timeout_reports_inflight(tmp_path):
+    async def main():
+        store = _store(tmp_path)
+        await store.acquire("k")
+        result = await store.acquire("k", wait=0.05)
+        return result, store.counters["wait_timeouts"]
+
+    assert asyncio.run(main()) == ((STATE_INFLIGHT, None), 1)
+
+
+def test_expired_response_is_not_replayed(tmp_path):
+    store = _store(tmp_path, ttl=0)
+    assert store.begin("k")[0] == STATE_NEW
+    store.complete("k", 200, {})
+    assert store.begin("k")[0] == STATE_NEW
+
+
+def test_stale_lease_is_taken_over(tmp_path, monkeypatch):
+    store = _store(tmp_path)
+    monkeypatch.setattr(idempotency_utils, "IDEMPOTENCY_LEASE", 0)
+    assert store.begin("k")[0] == STATE_NEW
+    # 처리하던 프로세스가 죽어 lease 가 지남 → 다음 요청이 맡는다
+    assert store.begin("k")[0] == STATE_NEW
+
+
+def test_purge_keeps_newest_entries(tmp_path):
+    store = _store(tmp_path, max_entries=2)
+    for key in ("a", "b", "c"):
+        store.begin(key)
+        store.complete(key, 200, {"key": key})
+    store.purge()
+    assert store.begin("a")[0] == STATE_NEW
+    assert store.begin("c")[0] == STATE_DONE
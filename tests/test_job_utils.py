@@ -0,0 +1,65 @@
+import time
+
+from job_utils import JobQueue, STATE_OCR, STATE_WRITE, STATE_DONE, STATE_FAILED
+
+
+def _queue(tmp_path, **kwargs):
+    return JobQueue(str(tmp_path / "jobs.sqlite3"), **kwargs)
+
+
+def test_job_moves_through_ocr_and_write(tmp_path):
+    queue = _queue(tmp_path)
+    job_id = queue.submit("SM1", b"image")
+    job = queue.claim()
+    assert (job["id"], job["state"], job["image"], job["attempts"]) == (job_id, STATE_OCR, b"image", 1)
+
+    queue.ocr_done(job_id, {"송장번호": "1234"})
+    job = queue.claim()
+    assert (job["state"], job["entry"], job["image"], job["attempts"]) == (STATE_WRITE, {"송장번호": "1234"}, None, 1)
+
+    queue.write_done(job_id, {"range": "A2:G2"})
+    assert queue.claim() is None
+    status = queue.get(job_id)
+    assert status["status"] == STATE_DONE
+    assert status["write_info"] == {"range": "A2:G2"}
+
+
+def test_claimed_job_is_leased(tmp_path):
+    queue = _queue(tmp_path, lease=60)
+    queue.submit("SM1", b"x")
+    assert queue.claim() is not None
+    assert queue.claim() is None
+
+
+def test_expired_lease_is_claimed_again(tmp_path):
+    queue = _queue(tmp_path, lease=0)
+    job_id = queue.submit("SM1", b"x")
+    queue.claim()
+    job = queue.claim()
+    assert job["id"] == job_id
+    assert job["attempts"] == 2
+
+
+def test_retry_backs_off_then_fails(tmp_path):
+    queue = _queue(tmp_path, max_attempts=2)
+    job_id = queue.submit("SM1", b"x")
+    job = queue.claim()
+    delay = queue.retry(job_id, job["attempts"], "timeout")
+    assert delay > 0
+    assert queue.claim() is None  # next_at 전에는 안 나온다
+    assert queue.get(job_id)["next_attempt_at"] > time.time()
+
+    assert queue.retry(job_id, 2, "timeout again") is None
+    status = queue.get(job_id)
+    assert status["status"] == STATE_FAILED
+    assert status["error"] == "timeout again"
+
+
+def test_purge_removes_only_old_finished_jobs(tmp_path):
+    queue = _queue(tmp_path)
+    done = queue.submit("SM1", b"x")
+    pending = queue.submit("SM2", b"y")
+    queue.write_done(done, {})
+    assert queue.purge(older_than=-1) == 1
+    assert queue.get(done) is None
+    assert queue.get(pending)["status"] == STATE_OCR
@@ -0,0 +1,127 @@
+import asyncio
+import threading
+from concurrent.futures import Future
+
+import pytest
+
+from pool_utils import OcrPool, OcrBusy, OcrTimeout, OcrCancelled
+
+
+class StubExecutor:
+    """submit 한 작업을 바로 끝내지 않고 테스트가 직접 끝낸다. running=True 면 cancel() 불가(워커에서 도는 중)."""
+
+    def __init__(self, running=True):
+        self.running = running
+        self.futures = []
+
+    def submit(self, fn, *args):
+        future = Future()
+        if self.running:
+            future.set_running_or_notify_cancel()
+        self.futures.append((future, fn, args))
+        return future
+
+    def finish_all(self):
+        for future, fn, args in self.futures:
+            if not future.done():
+                future.set_result(fn(*args))
+
+    def shutdown(self, wait=False, cancel_futures=False):
+        pass
+
+
+class StubRequest:
+    def __init__(self):
+        self.disconnected = False
+
+    async def is_disconnected(self):
+        return self.disconnected
+
+
+def _pool(executor, **kwargs):
+    pool = OcrPool(workers=1, queue_max=kwargs.pop("queue_max", 2), timeout=kwargs.pop("timeout", 5))
+    pool._executor = executor
+    return pool
+
+
+def _finish_from_worker_thread(executor):
+    # 실제 풀처럼 완료 콜백이 다른 스레드에서 불리게
+    t = threading.Thread(target=executor.finish_all)
+    t.start()
+    t.join()
+
+
+def test_result_releases_slot():
+    async def main():
+        executor = StubExecutor()
+        pool = _pool(executor)
+        task = asyncio.ensure_future(pool.run(abs, -3))
+        await asyncio.sleep(0)
+        assert pool.stats()["inflight"] == 1
+        _finish_from_worker_thread(executor)
+        assert await task == 3
+        assert pool.stats()["inflight"] == 0
+
+    asyncio.run(main())
+
+
+def test_timed_out_running_job_keeps_slot_until_it_finishes():
+    async def main():
+        executor = StubExecutor(running=True)
+        pool = _pool(executor, queue_max=1, timeout=0.01)
+        with pytest.raises(OcrTimeout):
+            await pool.run(abs, -1)
+        assert pool.stats()["inflight"] == 1
+        assert pool.stats()["abandoned"] == 1
+        # 워커가 아직 그 작업을 돌리는 중 → 새 작업은 받지 않는다
+        with pytest.raises(OcrBusy):
+            await pool.run(abs, -2)
+        _finish_from_worker_thread(executor)
+        assert pool.stats()["inflight"] == 0
+        assert pool.stats()["abandoned"] == 0
+
+    asyncio.run(main())
+
+
+def test_disconnected_queued_job_is_cancelled_and_releases_slot():
+    async def main():
+        executor = StubExecutor(running=False)  # 아직 대기열 → cancel 가능
+        pool = _pool(executor)
+        request = StubRequest()
+        request.disconnected = True
+        with pytest.raises(OcrCancelled):
+            await pool.run(abs, -1, request=request)
+        assert executor.futures[0][0].cancelled()
+        assert pool.stats()["inflight"] == 0
+        assert pool.stats()["abandoned"] == 0
+
+    asyncio.run(main())
+
+
+def test_disconnected_running_job_keeps_slot():
+    async def main():
+        executor = StubExecutor(running=True)
+        pool = _pool(executor)
+        request = StubRequest()
+        request.disconnected = True
+        with pytest.raises(OcrCancelled):
+            await pool.run(abs, -1, request=request)
+        assert pool.stats()["inflight"] == 1
+        _finish_from_worker_thread(executor)
+        assert pool.stats()["inflight"] == 0
+
+    asyncio.run(main())
+
+
+def test_submit_failure_releases_slot():
+    class Broken(StubExecutor):
+        def submit(self, fn, *args):
+            raise RuntimeError("cannot schedule new futures after shutdown")
+
+    async def main():
+        pool = _pool(Broken())
+        with pytest.raises(RuntimeError):
+            await pool.run(abs, -1)
+        assert pool.stats()["inflight"] == 0
+
+    asyncio.run(main())
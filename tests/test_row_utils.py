@@ -0,0 +1,78 @@
+from row_utils import RowAllocator, parse_last_row
+
+SHEET = "item/유축기출고"
+
+
+def _allocator(tmp_path, **kwargs):
+    return RowAllocator(str(tmp_path / "ledger.sqlite3"), **kwargs)
+
+
+def test_parse_last_row():
+    assert parse_last_row("유축기출고!A1:G12") == 12
+    assert parse_last_row(None) == 1
+
+
+def test_reserve_needs_sync_first(tmp_path):
+    ledger = _allocator(tmp_path)
+    assert ledger.reserve(SHEET) is None
+    assert ledger.sync(SHEET, 10) == 11
+    assert ledger.reserve(SHEET, 3) == 11
+    assert ledger.reserve(SHEET) == 14
+
+
+def test_sync_does_not_rewind_without_conflict(tmp_path):
+    ledger = _allocator(tmp_path)
+    ledger.sync(SHEET, 10)
+    ledger.reserve(SHEET, 5)
+    # usedRange 가 아직 예약분을 모름 → 다른 워커가 쓰는 중일 수 있으므로 그대로
+    assert ledger.sync(SHEET, 10) == 16
+
+
+def test_conflict_blocks_reserve_until_sync(tmp_path):
+    ledger = _allocator(tmp_path)
+    ledger.sync(SHEET, 1)
+    ledger.reserve(SHEET)
+    ledger.mark_conflict(SHEET)
+    assert ledger.reserve(SHEET) is None
+
+
+def test_released_reservation_is_reused_after_conflict(tmp_path):
+    ledger = _allocator(tmp_path)
+    ledger.sync(SHEET, 10)
+    first = ledger.reserve(SHEET, 3)
+    ledger.mark_conflict(SHEET, first)  # 오류 응답 → 안 쓰인 행
+    assert ledger.sync(SHEET, 10) == first
+    assert ledger.reserve(SHEET, 2) == first
+
+
+def test_conflict_sync_skips_rows_still_reserved(tmp_path):
+    ledger = _allocator(tmp_path)
+    ledger.sync(SHEET, 10)
+    failed = ledger.reserve(SHEET, 2)       # 11-12: 실패
+    other = ledger.reserve(SHEET, 2)        # 13-14: 다른 워커가 쓰는 중
+    ledger.mark_conflict(SHEET, failed)
+    assert ledger.sync(SHEET, 10) == other + 2
+
+
+def test_unknown_outcome_keeps_reservation(tmp_path):
+    ledger = _allocator(tmp_path)
+    ledger.sync(SHEET, 10)
+    first = ledger.reserve(SHEET, 2)
+    ledger.mark_conflict(SHEET)  # 타임아웃: 쓰였는지 모름
+    assert ledger.sync(SHEET, 10) == first + 2
+
+
+def test_expired_reservations_do_not_block_rewind(tmp_path):
+    ledger = _allocator(tmp_path, reservation_ttl=0)
+    ledger.sync(SHEET, 10)
+    ledger.reserve(SHEET, 4)
+    ledger.mark_conflict(SHEET)
+    assert ledger.sync(SHEET, 10) == 11
+
+
+def test_sheets_are_independent(tmp_path):
+    ledger = _allocator(tmp_path)
+    ledger.sync("a/s", 5)
+    ledger.sync("b/s", 50)
+    assert ledger.reserve("a/s") == 6
+    assert ledger.reserve("b/s") == 51
@@ -0,0 +1,91 @@
+import time
+import asyncio
+
+import pytest
+
+pytest.importorskip("httpx")
+
+import throttle_utils
+from throttle_utils import AdaptiveLimit, CircuitBreaker, GraphCircuitOpen, retry_after_seconds, workbook_key
+
+
+def test_retry_after_seconds():
+    assert retry_after_seconds({"Retry-After": "3"}) == 3.0
+    assert retry_after_seconds({"retry-after": "soon"}) is None
+    assert retry_after_seconds({}) is None
+
+
+def test_workbook_key():
+    assert workbook_key("https://g/v1.0/me/drive/items/ABC/workbook/worksheets('s')") == "ABC"
+    assert workbook_key("https://g/v1.0/me/drive/root:/a.xlsx:/workbook/tables") == "/a.xlsx"
+    assert workbook_key("https://g/v1.0/me") is None
+
+
+def test_aimd_additive_increase_multiplicative_decrease(monkeypatch):
+    monkeypatch.setattr(throttle_utils, "GRAPH_AIMD_DECREASE_INTERVAL", 0)
+    limit = AdaptiveLimit(initial=4, minimum=1, maximum=5)
+    for _ in range(4):
+        limit.increase()
+    assert 4.9 < limit.limit <= 5
+    for _ in range(10):
+        limit.increase()
+    assert limit.limit == 5
+    limit.decrease()
+    assert limit.limit == 2.5
+    for _ in range(5):
+        limit.decrease()
+    assert limit.limit == 1
+
+
+def test_aimd_decreases_once_per_interval(monkeypatch):
+    monkeypatch.setattr(throttle_utils, "GRAPH_AIMD_DECREASE_INTERVAL", 60)
+    limit = AdaptiveLimit(initial=8)
+    limit._last_decrease = time.monotonic() - 120  # 부팅 직후 monotonic 이 작아도 첫 감소는 되게
+    limit.decrease()
+    limit.decrease()
+    assert (limit.limit, limit.decreases) == (4, 1)
+
+
+def test_aimd_limits_concurrency():
+    async def main():
+        limit = AdaptiveLimit(initial=2)
+        running, peak = 0, 0
+
+        async def work():
+            nonlocal running, peak
+            async with limit:
+                running += 1
+                peak = max(peak, running)
+                await asyncio.sleep(0.01)
+                running -= 1
+
+        await asyncio.gather(*(work() for _ in range(6)))
+        return peak, limit.inflight
+
+    assert asyncio.run(main()) == (2, 0)
+
+
+def test_breaker_opens_after_threshold_and_half_opens_after_cooldown():
+    breaker = CircuitBreaker(threshold=2, cooldown=0.05)
+    breaker.failure()
+    breaker.before()
+    breaker.failure()
+    assert breaker.state == "open"
+    with pytest.raises(GraphCircuitOpen):
+        breaker.before()
+
+    time.sleep(0.06)
+    breaker.before()
+    assert breaker.state == "half_open"
+    breaker.failure()  # half_open 에서 한 번 실패 → 바로 다시 open
+    assert breaker.state == "open"
+    assert breaker.opens == 2
+
+
+def test_breaker_closes_on_success():
+    breaker = CircuitBreaker(threshold=1, cooldown=0)
+    breaker.failure()
+    breaker.before()
+    assert breaker.state == "half_open"
+    breaker.success()
+    assert (breaker.state, breaker.failures) == ("closed", 0)
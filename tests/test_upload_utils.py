@@ -0,0 +1,35 @@
+import io
+import json
+import zipfile
+
+import pytest
+
+from upload_utils import read_batch_archive, UploadRejected
+
+
+def _zip(manifest, files=None):
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, "w") as z:
+        z.writestr("manifest.json", json.dumps(manifest))
+        for name, data in (files or {}).items():
+            z.writestr(name, data)
+    return buf.getvalue()
+
+
+def test_non_object_manifest_entries_are_rejected_per_item():
+    items = read_batch_archive(_zip(["label1.jpg", 3, [1, 2], None, {"qr_text": "SM1", "file": "missing.jpg"}]))
+    codes = [(qr, result.code) for qr, result in items]
+    assert codes == [
+        ("", "bad_manifest_entry"),
+        ("", "bad_manifest_entry"),
+        ("", "bad_manifest_entry"),
+        ("", "bad_manifest_entry"),
+        ("SM1", "file_not_in_archive"),
+    ]
+    assert all(isinstance(result, UploadRejected) for _, result in items)
+
+
+def test_manifest_must_be_a_list():
+    with pytest.raises(UploadRejected) as e:
+        read_batch_archive(_zip("label1.jpg"))
+    assert e.value.code == "invalid_archive"
@@ -0,0 +1,238 @@
+import os
+import re
+import time
+import random
+import asyncio
+import email.utils
+
+import httpx
+
+# 재시도: 최대 횟수 / backoff 기본·최대(초). Retry-After가 max보다 길면 기다리지 않고 응답을 그대로 돌려준다
+GRAPH_MAX_RETRIES = int(os.getenv("GRAPH_MAX_RETRIES", "4"))
+GRAPH_RETRY_BASE = float(os.getenv("GRAPH_RETRY_BASE", "0.5"))
+GRAPH_RETRY_MAX = float(os.getenv("GRAPH_RETRY_MAX", "30"))
+# 파일(워크북)별 동시 요청 한도 (AIMD: 성공마다 조금씩 늘리고, 429/503이면 절반으로)
+GRAPH_AIMD_START = float(os.getenv("GRAPH_AIMD_START", "4"))
+GRAPH_AIMD_MIN = float(os.getenv("GRAPH_AIMD_MIN", "1"))
+GRAPH_AIMD_MAX = float(os.getenv("GRAPH_AIMD_MAX", "16"))
+# 동시에 여러 요청이 throttle 되어도 한 번만 줄이도록, 줄인 뒤 이 시간(초) 동안은 다시 줄이지 않음
+GRAPH_AIMD_DECREASE_INTERVAL = float(os.getenv("GRAPH_AIMD_DECREASE_INTERVAL", "1"))
+# 연속 실패 N번 → 회로 차단(cooldown 초 동안 Graph 호출 없이 바로 실패)
+GRAPH_BREAKER_FAILURES = int(os.getenv("GRAPH_BREAKER_FAILURES", "5"))
+GRAPH_BREAKER_COOLDOWN = float(os.getenv("GRAPH_BREAKER_COOLDOWN", "30"))
+
+# 429: Graph가 처리하지 않은 요청 → 어떤 메서드든 재시도 가능
+# 503/504: 처리됐는지 모름 → 멱등 요청만 재시도
+RETRY_STATUSES = {429, 503, 504}
+IDEMPOTENT_METHODS = {"GET", "HEAD", "OPTIONS", "PUT", "DELETE"}
+# 요청이 아예 나가지 않은 게 확실한 연결 오류 → 메서드와 상관없이 재시도
+_NOT_SENT_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+
+# 워크북 요청의 파일 키: /drive/items/{id}/workbook..., /drive/root:/{path}:/workbook...
+_WORKBOOK_URL = re.compile(r"/drive/(?:items/([^/]+)|root:([^:]+):)/workbook")
+
+
+class GraphCircuitOpen(httpx.TransportError):
+    """회로 차단 중 → Graph에 보내지 않고 바로 실패 (기존 httpx.HTTPError 처리 경로를 그대로 탄다)."""
+
+
+def retry_after_seconds(headers):
+    """Retry-After 헤더(초 또는 HTTP-date) → 초. 없거나 못 읽으면 None."""
+    value = None
+    for name, v in (headers or {}).items():
+        if name.lower() == "retry-after":
+            value = str(v).strip()
+            break
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def backoff_delay(attempt, base=GRAPH_RETRY_BASE, cap=GRAPH_RETRY_MAX):
+    """full jitter: 0 ~ min(cap, base × 2^attempt)"""
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+def workbook_key(url):
+    m = _WORKBOOK_URL.search(url)
+    return (m.group(1) or m.group(2)) if m else None
+
+
+def workbook_base(url):
+    """워크북 요청 URL → ".../workbook" 까지 (없으면 None)."""
+    m = _WORKBOOK_URL.search(url)
+    return url[:m.end()] if m else None
+
+
+class AdaptiveLimit:
+    """동시 요청 한도. 성공마다 +1/limit (한 바퀴에 약 +1), 429/503이면 ×1/2."""
+
+    def __init__(self, initial=GRAPH_AIMD_START, minimum=GRAPH_AIMD_MIN, maximum=GRAPH_AIMD_MAX):
+        self.limit = float(initial)
+        self.minimum = float(minimum)
+        self.maximum = float(maximum)
+        self.inflight = 0
+        self.decreases = 0
+        self._last_decrease = 0.0
+        self._cond = asyncio.Condition()
+
+    async def __aenter__(self):
+        async with self._cond:
+            await self._cond.wait_for(lambda: self.inflight < max(1, int(self.limit)))
+            self.inflight += 1
+        return self
+
+    async def __aexit__(self, *exc):
+        async with self._cond:
+            self.inflight -= 1
+            self._cond.notify_all()
+
+    def increase(self):
+        self.limit = min(self.maximum, self.limit + 1 / self.limit)
+
+    def decrease(self):
+        now = time.monotonic()
+        if now - self._last_decrease < GRAPH_AIMD_DECREASE_INTERVAL:
+            return
+        self._last_decrease = now
+        self.limit = max(self.minimum, self.limit / 2)
+        self.decreases += 1
+
+    def stats(self):
+        return {"limit": round(self.limit, 2), "inflight": self.inflight, "decreases": self.decreases}
+
+
+class CircuitBreaker:
+    """
+    closed → (연속 실패 threshold번) → open → (cooldown 지나면) half_open
+    half_open 에서 첫 결과가 성공이면 closed, 실패면 다시 open.
+    """
+
+    def __init__(self, threshold=GRAPH_BREAKER_FAILURES, cooldown=GRAPH_BREAKER_COOLDOWN):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.state = "closed"
+        self.failures = 0
+        self.opens = 0
+        self._opened_at = 0.0
+
+    def before(self):
+        if self.state != "open":
+            return
+        remaining = self._opened_at + self.cooldown - time.monotonic()
+        if remaining > 0:
+            raise GraphCircuitOpen(f"Graph circuit open (retry in {remaining:.1f}s)")
+        self.state = "half_open"
+
+    def success(self):
+        self.failures = 0
+        self.state = "closed"
+
+    def failure(self):
+        self.failures += 1
+        if self.state == "half_open" or (self.state == "closed" and self.failures >= self.threshold):
+            if self.state != "open":
+                self.opens += 1
+                print(f"[OneDrive] Graph 연속 실패 {self.failures}회 → {self.cooldown:.0f}초 동안 호출 중단")
+            self.state = "open"
+            self._opened_at = time.monotonic()
+
+    def stats(self):
+        return {"state": self.state, "consecutive_failures": self.failures, "opens": self.opens}
+
+
+class ThrottlePolicy:
+    """
+    모든 Graph 요청이 지나가는 재시도/동시성/회로 차단 계층.
+    - 429/503/504: Retry-After(없으면 jitter backoff) 만큼 기다렸다 재시도 (503/504는 멱등 요청만)
+    - 워크북 요청은 파일별 AdaptiveLimit 으로 동시 개수 제한
+    - 재시도 후에도 실패가 이어지면 CircuitBreaker 가 잠시 호출을 막는다
+    """
+
+    def __init__(self, max_retries=GRAPH_MAX_RETRIES):
+        self.max_retries = max_retries
+        self.breaker = CircuitBreaker()
+        self._limits = {}
+        self.counters = {
+            "requests": 0, "retries": 0, "throttled_429": 0, "unavailable_5xx": 0,
+            "transport_errors": 0, "gave_up": 0, "rejected_open": 0, "retry_wait_seconds": 0.0,
+        }
+
+    def limit_for(self, url):
+        key = workbook_key(url)
+        if key is None:
+            return None
+        if key not in self._limits:
+            self._limits[key] = AdaptiveLimit()
+        return self._limits[key]
+
+    def check_open(self):
+        try:
+            self.breaker.before()
+        except GraphCircuitOpen:
+            self.counters["rejected_open"] += 1
+            raise
+
+    async def send(self, http, method, url, idempotent, **kwargs):
+        limit = self.limit_for(url)
+        attempt = 0
+        while True:
+            self.check_open()
+            self.counters["requests"] += 1
+            try:
+                if limit is None:
+                    resp = await http.request(method, url, **kwargs)
+                else:
+                    async with limit:
+                        resp = await http.request(method, url, **kwargs)
+                        if resp.status_code in RETRY_STATUSES:
+                            limit.decrease()
+                        elif resp.status_code < 500:
+                            limit.increase()
+            except httpx.TransportError as e:
+                self.counters["transport_errors"] += 1
+                retryable = idempotent or isinstance(e, _NOT_SENT_ERRORS)
+                if not retryable or attempt >= self.max_retries:
+                    self.counters["gave_up"] += 1
+                    self.breaker.failure()
+                    raise
+                delay = backoff_delay(attempt)
+            else:
+                status = resp.status_code
+                if status not in RETRY_STATUSES:
+                    if status >= 500:
+                        self.breaker.failure()
+                    else:
+                        self.breaker.success()
+                    return resp
+                self.counters["throttled_429" if status == 429 else "unavailable_5xx"] += 1
+                wait = retry_after_seconds(resp.headers)
+                retryable = status == 429 or idempotent
+                if not retryable or attempt >= self.max_retries or (wait or 0) > GRAPH_RETRY_MAX:
+                    self.counters["gave_up"] += 1
+                    self.breaker.failure()
+                    return resp
+                delay = wait if wait is not None else backoff_delay(attempt)
+                await resp.aclose()
+            attempt += 1
+            self.note_retry(delay)
+            await asyncio.sleep(delay)
+
+    def note_retry(self, delay):
+        self.counters["retries"] += 1
+        self.counters["retry_wait_seconds"] += delay
+
+    def stats(self):
+        return {
+            **self.counters,
+            "retry_wait_seconds": round(self.counters["retry_wait_seconds"], 3),
+            "breaker": self.breaker.stats(),
+            "workbooks": {key: limit.stats() for key, limit in self._limits.items()},
+        }
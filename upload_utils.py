@@ -0,0 +1,99 @@
+import io
+import os
+import json
+import zipfile
+
+# 업로드 최대 크기(바이트) / 최대 픽셀 수 (가로×세로, 디코딩 전에 헤더만 보고 판단)
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(20 * 1024 * 1024)))
+MAX_IMAGE_PIXELS = int(os.getenv("MAX_IMAGE_PIXELS", str(50_000_000)))
+# 일괄 처리: 한 요청 최대 라벨 수 / zip 최대 크기(바이트)
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", "200"))
+BATCH_MAX_ARCHIVE_BYTES = int(os.getenv("BATCH_MAX_ARCHIVE_BYTES", str(100 * 1024 * 1024)))
+
+
+class UploadRejected(Exception):
+    def __init__(self, code, text, status=400):
+        super().__init__(text)
+        self.code = code
+        self.status = status
+
+
+def check_image_bytes(data):
+    """헤더만 읽어 (width, height) 확인. 이미지가 아니거나 너무 크면 UploadRejected."""
+    from PIL import Image, UnidentifiedImageError  # 첫 업로드(또는 기동 워밍업) 때 로드
+    # PIL 자체의 decompression bomb 경고 기준도 같은 값으로
+    Image.MAX_IMAGE_PIXELS = MAX_IMAGE_PIXELS
+    try:
+        with Image.open(io.BytesIO(data)) as im:
+            width, height = im.size
+    except (UnidentifiedImageError, Image.DecompressionBombError, OSError) as e:
+        raise UploadRejected("invalid_image", f"not a readable image: {e}")
+    if width * height > MAX_IMAGE_PIXELS:
+        raise UploadRejected(
+            "image_too_large", f"{width}x{height} exceeds {MAX_IMAGE_PIXELS} pixels", status=413
+        )
+    return width, height
+
+
+async def read_upload_image(upload):
+    """
+    UploadFile → bytes (디스크에 따로 쓰지 않음, 파일명도 쓰지 않음).
+    크기 제한은 읽기 전(Content-Length 기반 size)과 읽은 뒤 두 번 확인한다.
+    """
+    if upload.size is not None and upload.size > MAX_UPLOAD_BYTES:
+        raise UploadRejected("upload_too_large", f"{upload.size} bytes > {MAX_UPLOAD_BYTES}", status=413)
+    # 한 번에 읽기 → 스풀 버퍼에서 bytes 한 벌만 만든다
+    data = await upload.read(MAX_UPLOAD_BYTES + 1)
+    if len(data) > MAX_UPLOAD_BYTES:
+        raise UploadRejected("upload_too_large", f"> {MAX_UPLOAD_BYTES} bytes", status=413)
+    if not data:
+        raise UploadRejected("empty_upload", "empty image")
+    check_image_bytes(data)
+    return data
+
+
+def read_batch_archive(data):
+    """
+    zip bytes → [(qr_text, 이미지 bytes 또는 UploadRejected)].
+    zip 안의 manifest.json 예: [{"qr_text": "SM123456", "file": "label1.jpg"}, ...]
+    항목별 오류는 그 항목에만 담고, zip/manifest 자체가 잘못되면 UploadRejected.
+    """
+    try:
+        archive = zipfile.ZipFile(io.BytesIO(data))
+        manifest = json.loads(archive.read("manifest.json").decode("utf-8"))
+    except (zipfile.BadZipFile, KeyError, ValueError) as e:
+        raise UploadRejected("invalid_archive", f"zip with manifest.json required: {e}")
+    if isinstance(manifest, dict):
+        manifest = manifest.get("items", [])
+    if not isinstance(manifest, list):
+        raise UploadRejected("invalid_archive", "manifest.json must be a list")
+    if len(manifest) > BATCH_MAX_ITEMS:
+        raise UploadRejected("too_many_items", f"{len(manifest)} > {BATCH_MAX_ITEMS}", status=413)
+
+    items = []
+    for entry in manifest:
+        if not isinstance(entry, dict):
+            # 문자열/숫자/리스트 항목 → 그 항목만 거절 (배치 전체를 500으로 만들지 않게)
+            items.append(("", UploadRejected("bad_manifest_entry", f"manifest entry must be an object: {entry!r}")))
+            continue
+        qr_text = str(entry.get("qr_text", ""))
+        name = entry.get("file")
+        try:
+            info = archive.getinfo(name)
+        except (KeyError, TypeError):
+            items.append((qr_text, UploadRejected("file_not_in_archive", f"{name!r} not in zip")))
+            continue
+        # 압축 해제 전에 선언된 크기로 zip bomb 차단
+        if info.file_size > MAX_UPLOAD_BYTES:
+            items.append((qr_text, UploadRejected(
+                "upload_too_large", f"{name}: {info.file_size} bytes > {MAX_UPLOAD_BYTES}", status=413
+            )))
+            continue
+        image = archive.read(info)
+        try:
+            check_image_bytes(image)
+        except UploadRejected as e:
+            items.append((qr_text, e))
+            continue
+        items.append((qr_text, image))
+    return items
@@ -0,0 +1,121 @@
+import os
+import time
+import asyncio
+
+from metrics_utils import stage
+
+# 0 이면 기동 워밍업 없이 바로 ready
+WARMUP_ENABLED = os.getenv("WARMUP_ENABLED", "1") == "1"
+# 이 단계들이 성공해야 /ready 가 200 (쉼표 구분). 나머지 단계는 실패해도 ready, 결과에 실패로만 표시
+WARMUP_REQUIRED = [s.strip() for s in os.getenv("WARMUP_REQUIRED", "ocr").split(",") if s.strip()]
+# 단계 한 번의 최대 시간(초) / 필수 단계가 실패했을 때 다시 시도하는 간격(초)
+WARMUP_STEP_TIMEOUT = float(os.getenv("WARMUP_STEP_TIMEOUT", "120"))
+WARMUP_RETRY_INTERVAL = float(os.getenv("WARMUP_RETRY_INTERVAL", "15"))
+
+
+def _process_age():
+    """프로세스가 시작된 뒤 지난 시간(초). /proc 가 없으면 None."""
+    try:
+        with open("/proc/self/stat") as f:
+            start_ticks = int(f.read().rsplit(")", 1)[1].split()[19])
+        with open("/proc/uptime") as f:
+            uptime = float(f.read().split()[0])
+        return max(0.0, uptime - start_ticks / os.sysconf("SC_CLK_TCK"))
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class Startup:
+    """
+    기동 시간 보고 + 워밍업 상태 (/ready).
+    - boot_s: 프로세스 시작 → app 모듈 import 시작 (인터프리터 + uvicorn 기동)
+    - import_s: app 모듈 import 시간
+    - ready_s: import 시작 → 워밍업 끝 (첫 ready)
+    /__ping 은 프로세스가 살아 있는지만, /ready 는 첫 요청이 느리지 않을 상태인지.
+    """
+
+    def __init__(self, required=WARMUP_REQUIRED):
+        self.required = set(required)
+        self.import_started = time.perf_counter()
+        self.boot_s = None
+        self.import_s = None
+        self.ready_s = None
+        self.ready = False
+        self.steps = {}
+        self._task = None
+
+    def imported(self, import_started):
+        """app 모듈 맨 아래에서 호출. import_started: 맨 위에서 잰 perf_counter."""
+        now = time.perf_counter()
+        age = _process_age()
+        self.import_started = import_started
+        self.import_s = round(now - import_started, 3)
+        if age is not None:
+            self.boot_s = round(max(0.0, age - (now - import_started)), 3)
+        print(f"[Startup] import {self.import_s}s (프로세스 시작 → import 시작 {self.boot_s}s)")
+
+    def start(self, chains):
+        """
+        chains: [[(name, async fn), ...], ...] — chain끼리는 동시에, chain 안은 순서대로.
+        백그라운드로 돌린다 → 서버는 바로 요청을 받고(/__ping), /ready 는 끝날 때까지 503.
+        """
+        if not WARMUP_ENABLED:
+            self._mark_ready()
+            return
+        for chain in chains:
+            for name, _ in chain:
+                self.steps[name] = {"ok": None, "seconds": None, "attempts": 0}
+        self._task = asyncio.create_task(self._run(chains))
+
+    async def _run(self, chains):
+        await asyncio.gather(*(self._chain(chain) for chain in chains))
+        self._mark_ready()
+
+    async def _chain(self, chain):
+        for name, fn in chain:
+            while not await self._step(name, fn) and name in self.required:
+                await asyncio.sleep(WARMUP_RETRY_INTERVAL)
+
+    async def _step(self, name, fn):
+        step = self.steps[name]
+        step["attempts"] += 1
+        t = time.perf_counter()
+        try:
+            with stage(f"warmup_{name}"):
+                detail = await asyncio.wait_for(fn(), timeout=WARMUP_STEP_TIMEOUT)
+            step.update(ok=True, error=None)
+            if detail is not None:
+                step["detail"] = detail
+        except Exception as e:
+            step.update(ok=False, error=repr(e))
+            print(f"[Startup] 워밍업 {name} 실패 ({step['attempts']}회):", repr(e))
+        step["seconds"] = round(time.perf_counter() - t, 3)
+        return step["ok"]
+
+    def _mark_ready(self):
+        self.ready = True
+        self.ready_s = round(time.perf_counter() - self.import_started, 3)
+        failed = [name for name, step in self.steps.items() if not step["ok"]]
+        print(f"[Startup] ready {self.ready_s}s (import {self.import_s}s)" + (f" / 실패: {failed}" if failed else ""))
+
+    async def close(self):
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    def report(self):
+        return {
+            "ready": self.ready,
+            "boot_s": self.boot_s,
+            "import_s": self.import_s,
+            "ready_s": self.ready_s,
+            "uptime_s": round(time.perf_counter() - self.import_started, 3),
+            "required": sorted(self.required),
+            "steps": self.steps,
+        }
+
+
+startup = Startup()